@@ -5,138 +5,521 @@ Usage:
     cd image_gen && python3 app.py
 
 Opens at http://localhost:5000
+
+Production mode runs several web workers plus separate generator processes,
+sharing job state and the queue through SQLite (see worker.py):
+
+    IMAGE_GEN_MODE=production python3 worker.py --processes 2
+    IMAGE_GEN_MODE=production gunicorn -w 4 -k gthread --threads 16 -b 127.0.0.1:5000 app:app
 """
 
+if __name__ == "__main__":
+    # Process-pool workers re-run the main script before they start (see
+    # output_writer.pool_context), and this module must run only once: its
+    # job store marks jobs left unfinished as interrupted. serve.py is safe
+    # to re-run, and imports this module as ``app`` when it starts.
+    import os.path
+    import runpy
+
+    runpy.run_path(os.path.join(os.path.dirname(os.path.abspath(__file__)), "serve.py"), run_name="__main__")
+    raise SystemExit
+
 import os
-import uuid
+import queue
 import threading
+import time
+import uuid
+from functools import partial
 from pathlib import Path
 
 from dotenv import load_dotenv
-from flask import Flask, request, jsonify, send_from_directory
-from google import genai
-from google.genai import types
-from PIL import Image
-import io
-
-from generate import slugify, OUTPUT_DIR, DEFAULT_MODEL
+from flask import Flask, Response, request, jsonify, send_file
+from werkzeug.utils import safe_join
+
+from config import PRODUCTION
+from disk_budget import DiskBudget
+from generate import OUTPUT_DIR, DEFAULT_MODEL, result_cache
+from events import EventBus, format_sse
+import export
+from gallery_index import IMAGE_SUFFIXES, GalleryIndex
+from genai_client import clients
+from job_runner import JobRunner
+from job_store import JobStore, SharedJobStore
+import metrics
+import refs
+from result_cache import InFlight, cache_key
+from scheduler import PRIORITY_BATCH, PRIORITY_INTERACTIVE, JobScheduler, QueueFull
+from shared_queue import SharedQueue
+from thumbs import ensure_thumbnail, get_placeholder
+import variants
 
 load_dotenv(Path(__file__).parent / ".env")
 
+MAX_REFS = 3
+ASPECT_RATIOS = ("16:9", "9:16", "1:1")
+SIZES = ("1K", "2K", "4K")  # 1K: draft previews, finalized later with /finalize
+MAX_SAMPLES = 4  # per aspect ratio in one fan-out submission
+
 app = Flask(__name__)
+app.config["MAX_CONTENT_LENGTH"] = MAX_REFS * refs.MAX_REF_BYTES + 1024 * 1024
 
 # ---------------------------------------------------------------------------
-# In-memory job store
+# Job store
 # ---------------------------------------------------------------------------
-jobs: dict[str, dict] = {}
-jobs_lock = threading.Lock()
-
-
-def _generate_job(client: genai.Client, job_id: str, prompt: str, aspect_ratio: str, ref_images: list[Image.Image] | None = None):
-    """Run generation in a background thread and update job status."""
-    try:
-        contents: list = [prompt]
-        if ref_images:
-            contents.extend(ref_images)
-
-        response = client.models.generate_content(
-            model=DEFAULT_MODEL,
-            contents=contents,
-            config=types.GenerateContentConfig(
-                response_modalities=["IMAGE"],
-                image_config=types.ImageConfig(
-                    aspect_ratio=aspect_ratio,
-                    image_size="4K",
-                ),
-            ),
-        )
-
-        saved = []
-        slug = slugify(prompt)
-        img_count = 0
-        for part in response.parts:
-            if part.inline_data is not None:
-                image = part.as_image()
-                filename = f"{slug}_{job_id[:8]}_{img_count}.png"
-                filepath = OUTPUT_DIR / filename
-                image.save(str(filepath))
-                saved.append(filename)
-                img_count += 1
-
-        if not saved:
-            text_resp = ""
-            for part in response.parts:
-                if part.text is not None:
-                    text_resp += part.text
-            with jobs_lock:
-                jobs[job_id].update(status="error", error=text_resp or "No image returned")
-        else:
-            with jobs_lock:
-                jobs[job_id].update(status="done", images=saved)
-
-    except Exception as e:
-        with jobs_lock:
-            jobs[job_id].update(status="error", error=str(e))
+events = EventBus()
+
+# cache key -> job_id of the job currently generating it (in-process mode;
+# the shared queue coalesces on cache keys itself)
+in_flight = InFlight()
+
+if PRODUCTION:
+    jobs = SharedJobStore()
+    scheduler = SharedQueue()
+else:
+    jobs = JobStore(bus=events)
+    scheduler = JobScheduler()
+    scheduler.on_change = lambda: events.publish("queue", scheduler.positions()) if len(events) else None
+PRIORITIES = {"interactive": PRIORITY_INTERACTIVE, "batch": PRIORITY_BATCH}
+
+SSE_KEEPALIVE = 15  # seconds between comment pings on idle streams
+SHARED_POLL_INTERVAL = 0.5  # production mode: seconds between checks for changes made by other processes
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600  # output filenames never change content
+MAX_PAGE = 500  # most entries one /gallery or /search response returns
+
+gallery_index = GalleryIndex()
+disk_budget = DiskBudget(gallery_index)
+if PRODUCTION:
+    # worker.py's supervisor watches the outputs and enforces the budget once
+    # for every process; web processes only record which outputs they served
+    disk_budget.start(enforce=False)
+    metrics.start_publishing(f"web-{os.getpid()}-{uuid.uuid4().hex[:8]}")
+else:
+    gallery_index.start_watcher()
+    disk_budget.start()
+
+runner = JobRunner(jobs, gallery_index, in_flight)
+
+metrics.jobs_running.set_function(lambda: scheduler.stats()["running"])
+metrics.queue_depth.set_function(lambda: scheduler.stats()["queued"])
+metrics.jobs_stored.set_function(lambda: len(jobs))
+metrics.output_bytes.set_function(lambda: gallery_index.usage()[1])
+
+
+def _relay_shared_events():
+    """Production mode: turn job and queue changes made by any process into local events."""
+    positions = None
+    while True:
+        time.sleep(SHARED_POLL_INTERVAL)
+        try:
+            jobs.publish_changes(events)
+            if len(events):
+                current = scheduler.positions()
+                if current != positions:
+                    events.publish("queue", current)
+                    positions = current
+        except Exception as e:
+            print(f"Shared event relay failed: {e}")
+
+
+if PRODUCTION:
+    threading.Thread(target=_relay_shared_events, name="shared-event-relay", daemon=True).start()
 
 
 # ---------------------------------------------------------------------------
 # API routes
 # ---------------------------------------------------------------------------
+def _enqueue(job_id: str, prompt: str, aspect_ratio: str, ref_ids: list[str], key: str | None, priority: int,
+             size: str) -> str | None:
+    """Queue a created job. Returns the id of an identical queued job it coalesced onto, if any.
+
+    Raises QueueFull at capacity.
+    """
+    if PRODUCTION:
+        payload = dict(prompt=prompt, aspect_ratio=aspect_ratio, ref_ids=ref_ids, key=key, submitted=time.time(),
+                       size=size)
+        return scheduler.submit(job_id, payload, priority, key=key)
+    run = partial(runner.run_leased, clients, job_id, prompt, aspect_ratio, ref_ids, key, time.time(), size)
+    scheduler.submit(job_id, run, priority)
+    return None
+
+
+def _submit(prompt: str, aspect_ratio: str, ref_ids: list[str], size: str, fresh: bool, priority: int, **fields):
+    """Create and queue one job, answering from the result cache or an identical running job when allowed."""
+    job_id = uuid.uuid4().hex
+    key = cache_key(DEFAULT_MODEL, prompt, aspect_ratio, size, ref_ids)
+
+    if not fresh:
+        cached = result_cache.get(key)
+        if cached is not None:
+            jobs.create(job_id, prompt, aspect_ratio, size=size, status="done", images=cached, cached=True,
+                        ref_ids=ref_ids, **fields)
+            return jsonify(job_id=job_id, cached=True)
+
+        if not PRODUCTION:
+            existing = in_flight.claim(key, job_id)
+            if existing is not None:
+                return jsonify(job_id=existing, coalesced=True)
+
+    jobs.create(job_id, prompt, aspect_ratio, size=size, ref_ids=ref_ids, **fields)
+
+    job_key = None if fresh else key
+    try:
+        existing = _enqueue(job_id, prompt, aspect_ratio, ref_ids, job_key, priority, size)
+    except QueueFull as e:
+        in_flight.release_owner(job_id)
+        jobs.delete(job_id)
+        return _too_busy(e)
+    if existing is not None:
+        jobs.delete(job_id)
+        return jsonify(job_id=existing, coalesced=True)
+
+    return jsonify(job_id=job_id, queue_position=scheduler.position(job_id))
+
+
+def _too_busy(e: QueueFull):
+    resp = jsonify(error=str(e))
+    resp.headers["Retry-After"] = str(e.retry_after)
+    return resp, 429
+
+
+def _fan_out(prompt: str, aspect_ratios: list[str], samples: int, ref_ids: list[str], size: str, priority: int):
+    """Submit ``samples`` jobs per aspect ratio as children of one parent job.
+
+    Children share the already-processed reference images by ref_id. They
+    always generate fresh: identical requests are the point, so they skip the
+    result cache and coalescing.
+    """
+    parent_id = uuid.uuid4().hex
+    children = [(uuid.uuid4().hex, ratio) for ratio in aspect_ratios for _ in range(samples)]
+    jobs.create(parent_id, prompt, ",".join(aspect_ratios), size=size, ref_ids=ref_ids,
+                children=[c for c, _ in children])
+    for child_id, ratio in children:
+        jobs.create(child_id, prompt, ratio, size=size, ref_ids=ref_ids, parent=parent_id)
+
+    submitted = []
+    try:
+        for child_id, ratio in children:
+            _enqueue(child_id, prompt, ratio, ref_ids, None, priority, size)
+            submitted.append(child_id)
+    except QueueFull as e:
+        # all or nothing: a partial fan-out isn't the comparison that was asked for.
+        # Children a worker already picked up can't be withdrawn; they keep their
+        # records so the worker can finish them, and are evicted like any job.
+        unsubmitted = [child_id for child_id, _ in children if child_id not in submitted]
+        for child_id in [c for c in submitted if scheduler.cancel(c)] + unsubmitted:
+            jobs.delete(child_id)
+        jobs.delete(parent_id)
+        return _too_busy(e)
+
+    return jsonify(job_id=parent_id, children=[c for c, _ in children])
+
+
 @app.post("/generate")
 def generate():
+    """Queue a generation. Several ``aspect_ratio`` values or ``samples`` > 1 fan out into child jobs.
+
+    ``size`` defaults to 4K; ``1K`` makes a fast draft to finalize later.
+    """
     prompt = request.form.get("prompt", "").strip()
-    aspect_ratio = request.form.get("aspect_ratio", "16:9")
+    aspect_ratios = list(dict.fromkeys(request.form.getlist("aspect_ratio"))) or ["16:9"]
+    samples = request.form.get("samples", 1, type=int)
+    size = request.form.get("size", "4K").upper()
+    fresh = request.form.get("fresh") in ("1", "true", "on")
+    priority = request.form.get("priority", "interactive")
 
     if not prompt:
         return jsonify(error="Prompt is required"), 400
-    if aspect_ratio not in ("16:9", "9:16", "1:1"):
+    if any(ratio not in ASPECT_RATIOS for ratio in aspect_ratios):
         return jsonify(error="Invalid aspect ratio"), 400
-
-    api_key = os.getenv("GOOGLE_API_KEY")
-    if not api_key:
+    if not 1 <= samples <= MAX_SAMPLES:
+        return jsonify(error=f"samples must be between 1 and {MAX_SAMPLES}"), 400
+    if size not in SIZES:
+        return jsonify(error="Invalid size"), 400
+    if priority not in PRIORITIES:
+        return jsonify(error="Invalid priority"), 400
+
+    if clients.needs_api_key and not os.getenv("GOOGLE_API_KEY"):
         return jsonify(error="GOOGLE_API_KEY not set"), 500
 
-    # Load reference images if provided (up to 3)
-    ref_images = []
-    for ref_file in request.files.getlist("ref_image"):
-        if ref_file and ref_file.filename:
-            ref_images.append(Image.open(io.BytesIO(ref_file.read())))
-    ref_images = ref_images[:3]
-
-    client = genai.Client(api_key=api_key)
-    job_id = uuid.uuid4().hex
+    # Reference images (up to 3): previously uploaded ref_ids and/or new files
+    ref_ids = request.form.getlist("ref_id")
+    try:
+        for ref_id in ref_ids:
+            if not refs.exists(ref_id):
+                raise refs.RefError(f"Unknown ref_id {ref_id}")
+        for ref_file in request.files.getlist("ref_image"):
+            if len(ref_ids) >= MAX_REFS:
+                break
+            if ref_file and ref_file.filename:
+                ref_ids.append(refs.ingest(ref_file.stream))
+    except refs.RefError as e:
+        return jsonify(error=str(e)), 400
+    ref_ids = ref_ids[:MAX_REFS]
+
+    if samples > 1 or len(aspect_ratios) > 1:
+        return _fan_out(prompt, aspect_ratios, samples, ref_ids, size, PRIORITIES[priority])
+    return _submit(prompt, aspect_ratios[0], ref_ids, size, fresh, PRIORITIES[priority])
+
+
+@app.post("/finalize")
+def finalize():
+    """Re-run a draft output at ``size`` (2K/4K) with its prompt, aspect ratio and references.
+
+    ``mode=reference`` (default) also passes the draft itself as a reference
+    image, so the final keeps its composition; ``mode=rerun`` only reuses the
+    draft's inputs. If a reference the draft used is gone, nothing is queued
+    and the 422 lists it in ``missing_ref_ids``.
+    """
+    image = request.form.get("image", "")
+    size = request.form.get("size", "4K").upper()
+    mode = request.form.get("mode", "reference")
+    fresh = request.form.get("fresh") in ("1", "true", "on")
+    priority = request.form.get("priority", "interactive")
+
+    if size not in SIZES:
+        return jsonify(error="Invalid size"), 400
+    if mode not in ("reference", "rerun"):
+        return jsonify(error="mode must be reference or rerun"), 400
+    if priority not in PRIORITIES:
+        return jsonify(error="Invalid priority"), 400
+    source = _output_path(image)
+    draft = gallery_index.get(image) if source is not None else None
+    if draft is None:
+        return jsonify(error="Unknown image"), 404
+    if not draft["prompt"] or draft["aspect_ratio"] not in ASPECT_RATIOS:
+        return jsonify(error="The image has no recorded prompt to finalize"), 422
+    if clients.needs_api_key and not os.getenv("GOOGLE_API_KEY"):
+        return jsonify(error="GOOGLE_API_KEY not set"), 500
 
-    with jobs_lock:
-        jobs[job_id] = dict(status="pending", prompt=prompt, aspect_ratio=aspect_ratio, images=[], error=None)
+    missing = [ref_id for ref_id in draft["ref_ids"] if not refs.exists(ref_id)]
+    if missing:
+        # finalizing without them would quietly make a different image than the draft
+        return jsonify(error="Reference images used by the draft no longer exist; upload them again",
+                       missing_ref_ids=missing), 422
+    ref_ids = list(draft["ref_ids"])
+    if mode == "reference":
+        try:
+            with open(source, "rb") as f:
+                ref_ids.append(refs.ingest(f))
+        except refs.RefError as e:
+            return jsonify(error=str(e)), 422
+    return _submit(draft["prompt"], draft["aspect_ratio"], ref_ids, size, fresh, PRIORITIES[priority], draft=image)
+
+
+@app.post("/refs")
+def upload_ref():
+    """Ingest one reference image and return its ref_id for later /generate calls."""
+    ref_file = request.files.get("ref_image")
+    if not ref_file or not ref_file.filename:
+        return jsonify(error="ref_image is required"), 400
+    try:
+        ref_id = refs.ingest(ref_file.stream)
+    except refs.RefError as e:
+        return jsonify(error=str(e)), 400
+    return jsonify(ref_id=ref_id)
 
-    thread = threading.Thread(target=_generate_job, args=(client, job_id, prompt, aspect_ratio, ref_images or None), daemon=True)
-    thread.start()
 
-    return jsonify(job_id=job_id)
+@app.delete("/jobs/<job_id>")
+def cancel_job(job_id: str):
+    """Cancel a queued job. For a fan-out parent, cancel its children that haven't started yet."""
+    job = jobs.get(job_id)
+    if not job:
+        return jsonify(error="Unknown job"), 404
+    if job.get("children"):
+        cancelled = [child_id for child_id in job["children"] if scheduler.cancel(child_id)]
+        for child_id in cancelled:
+            jobs.update(child_id, status="cancelled")
+        if not cancelled and job["status"] != "pending":
+            return jsonify(error=f"Job is {job['status']}, nothing left to cancel"), 409
+        # children already generating finish normally and still add their images
+        return jsonify(job_id=job_id, status=jobs.get(job_id)["status"], cancelled=cancelled)
+    if not scheduler.cancel(job_id):
+        return jsonify(error=f"Job is {job['status']}, only queued jobs can be cancelled"), 409
+    in_flight.release_owner(job_id)
+    jobs.update(job_id, status="cancelled")
+    return jsonify(job_id=job_id, status="cancelled")
 
 
 @app.get("/status/<job_id>")
 def status(job_id: str):
-    with jobs_lock:
-        job = jobs.get(job_id)
+    job = jobs.get(job_id)
     if not job:
         return jsonify(error="Unknown job"), 404
+    if job.get("children"):
+        job["children"] = [_child_status(child_id) for child_id in job["children"]]
+    if job["status"] == "pending":
+        return jsonify(dict(job, queue_position=scheduler.position(job_id)))
     return jsonify(job)
 
 
+def _child_status(child_id: str) -> dict:
+    child = jobs.get(child_id) or dict(status="expired")
+    child.pop("prompt", None)
+    child.pop("ref_ids", None)
+    child.pop("parent", None)
+    if child["status"] == "pending":
+        child["queue_position"] = scheduler.position(child_id)
+    return dict(child, job_id=child_id)
+
+
+@app.get("/events")
+def event_stream():
+    """Server-sent events: ``job`` on every job change, ``queue`` when positions shift.
+
+    One stream per browser covers all of its tabs; clients filter by job_id.
+    Every stream starts with a ``queue`` snapshot, and clients fetch /status
+    for their jobs on open. A stream that falls too far behind is ended
+    (see events.py), so the browser reconnects and re-syncs.
+    """
+    def stream():
+        q = events.subscribe()
+        try:
+            yield "retry: 3000\n\n"
+            yield format_sse("queue", scheduler.positions())
+            while not q.overflowed:
+                try:
+                    event, data = q.get(timeout=SSE_KEEPALIVE)
+                except queue.Empty:
+                    yield ": keepalive\n\n"
+                    continue
+                yield format_sse(event, data)
+        finally:
+            events.unsubscribe(q)
+
+    return Response(stream(), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@app.get("/stats")
+def stats():
+    return jsonify(scheduler=scheduler.stats(), client=clients.stats(), jobs=len(jobs), event_streams=len(events),
+                   disk=disk_budget.stats())
+
+
+@app.get("/metrics")
+def metrics_endpoint():
+    """Prometheus text exposition of stage timings, gauges and counters (in production, workers' included)."""
+    text = metrics.render_shared() if PRODUCTION else metrics.registry.render()
+    return Response(text, mimetype="text/plain; version=0.0.4")
+
+
+def _limit(default: int = 60) -> int:
+    """The ``limit`` query parameter, clamped to 1..MAX_PAGE."""
+    return max(1, min(request.args.get("limit", default, type=int), MAX_PAGE))
+
+
 @app.get("/gallery")
 def gallery():
-    images = sorted(
-        [f.name for f in OUTPUT_DIR.iterdir() if f.suffix.lower() in (".png", ".jpg", ".jpeg", ".webp")],
-        key=lambda n: os.path.getmtime(OUTPUT_DIR / n),
-        reverse=True,
-    )
-    return jsonify(images=images)
+    limit = _limit()
+    cursor = request.args.get("cursor") or None
+    since = request.args.get("since", type=float)
+    dedupe = request.args.get("dedupe", "") in ("1", "true")
+    try:
+        rows, next_cursor = gallery_index.page(limit=limit, cursor=cursor, since=since, dedupe=dedupe)
+    except ValueError:
+        return jsonify(error="Invalid cursor"), 400
+
+    items = [
+        dict(row, thumb=f"/thumbs/{row['name']}", placeholder=get_placeholder(row["name"]))
+        for row in rows
+    ]
+    latest = rows[0]["created"] if rows else since
+    return jsonify(images=[row["name"] for row in rows], items=items, next_cursor=next_cursor, latest=latest)
+
+
+@app.get("/search")
+def search():
+    """Full-text search over prompts: ``q``, optional ``aspect_ratio``, ``since`` and ``limit``."""
+    q = request.args.get("q", "").strip()
+    if not q:
+        return jsonify(error="q is required"), 400
+    limit = _limit()
+    rows = gallery_index.search(q, limit=limit, aspect_ratio=request.args.get("aspect_ratio") or None,
+                                since=request.args.get("since", type=float))
+    items = [
+        dict(row, thumb=f"/thumbs/{row['name']}", placeholder=get_placeholder(row["name"]))
+        for row in rows
+    ]
+    return jsonify(query=q, items=items)
+
+
+@app.post("/pins/<path:filename>")
+def pin_output(filename: str):
+    """Star an output: the disk budget never evicts it."""
+    if not gallery_index.set_pinned(filename, True):
+        return jsonify(error="Unknown image"), 404
+    return jsonify(name=filename, pinned=True)
+
+
+@app.delete("/pins/<path:filename>")
+def unpin_output(filename: str):
+    if not gallery_index.set_pinned(filename, False):
+        return jsonify(error="Unknown image"), 404
+    return jsonify(name=filename, pinned=False)
+
+
+@app.post("/export")
+def export_assets():
+    """Write responsive landing-page derivatives of ``filename`` to public/images (see export.py)."""
+    filename = request.form.get("filename", "")
+    source = _output_path(filename)
+    if source is None:
+        return jsonify(error="Unknown image"), 404
+    name = request.form.get("name") or export.asset_name(source)
+    try:
+        entries = export.export([(source, name)], og_name=request.form.get("og") or None,
+                                force=request.form.get("force") in ("1", "true"))
+    except export.ExportError as e:
+        return jsonify(error=str(e)), 400
+    return jsonify(entries[0])
+
+
+def _output_path(filename: str) -> Path | None:
+    """Path of an existing output image, or None. Dot-directories hold state, thumbnails and caches, not outputs."""
+    source = safe_join(str(OUTPUT_DIR), filename)
+    if (source is None or any(part.startswith(".") for part in Path(filename).parts)
+            or Path(filename).suffix.lower() not in IMAGE_SUFFIXES or not os.path.isfile(source)):
+        return None
+    return Path(source)
+
+
+def _send_immutable(path: Path, mimetype: str | None = None):
+    """Send a file whose content never changes under its URL: strong ETag, conditional and range support."""
+    resp = send_file(path, mimetype=mimetype, conditional=True, etag=variants.file_etag(path),
+                     max_age=IMMUTABLE_MAX_AGE)
+    resp.cache_control.immutable = True
+    return resp
 
 
 @app.get("/outputs/<path:filename>")
 def serve_output(filename: str):
-    return send_from_directory(OUTPUT_DIR, filename)
+    """An output image, or with ``?w=`` / ``?fmt=`` a resized WebP/AVIF variant of it."""
+    source = _output_path(filename)
+    if source is None:
+        return jsonify(error="Unknown image"), 404
+    disk_budget.touch(filename)
+    if "w" not in request.args and "fmt" not in request.args:
+        return _send_immutable(source)
+    try:
+        width, fmt = variants.parse_params(request.args.get("w"), request.args.get("fmt"))
+    except variants.VariantError as e:
+        return jsonify(error=str(e)), 400
+    try:
+        path = variants.get_variant(filename, source, width, fmt)
+    except Exception as e:
+        return jsonify(error=f"Could not build variant: {e}"), 422
+    return _send_immutable(path, variants.FORMATS[fmt][1])
+
+
+@app.get("/thumbs/<path:filename>")
+def serve_thumb(filename: str):
+    if _output_path(filename) is None:
+        return jsonify(error="Unknown image"), 404
+    try:
+        path = ensure_thumbnail(filename)
+    except OSError:  # includes PIL.UnidentifiedImageError: not a decodable image
+        return jsonify(error="Unknown image"), 404
+    return send_file(path, max_age=3600)
 
 
 # ---------------------------------------------------------------------------
@@ -178,6 +561,8 @@ h1{font-size:1.3rem;font-weight:600;margin-bottom:24px;letter-spacing:-.02em;col
 .prompt-bar button:hover{background:var(--accent-hover)}
 .prompt-bar button:disabled{opacity:.5;cursor:not-allowed}
 
+.fresh-toggle{display:flex;align-items:center;gap:6px;color:var(--muted);font-size:.85rem;cursor:pointer;white-space:nowrap}
+
 /* ---- ref image upload ---- */
 .ref-upload{display:flex;align-items:center;gap:6px}
 .ref-upload label{
@@ -216,6 +601,7 @@ h1{font-size:1.3rem;font-weight:600;margin-bottom:24px;letter-spacing:-.02em;col
 .tab-pane{display:none;padding:24px;text-align:center}
 .tab-pane.active{display:block}
 .tab-pane .prompt-text{color:var(--muted);font-size:.85rem;margin-bottom:16px;word-break:break-word}
+.tab-pane .queue-pos{color:var(--muted);font-size:.82rem}
 .tab-pane .error{color:var(--error);margin-top:12px;font-size:.88rem}
 .tab-pane img{max-width:100%;border-radius:var(--radius);margin-top:8px}
 .tab-pane a.download{
@@ -223,6 +609,20 @@ h1{font-size:1.3rem;font-weight:600;margin-bottom:24px;letter-spacing:-.02em;col
   text-decoration:none;border-radius:var(--radius);font-size:.85rem;font-weight:500;
 }
 .tab-pane a.download:hover{background:var(--accent-hover)}
+.tab-pane .variants{display:grid;grid-template-columns:repeat(auto-fill,minmax(240px,1fr));gap:12px}
+.tab-pane .variants:empty{display:none}
+.tab-pane .stop{
+  margin-top:10px;padding:6px 16px;background:none;border:1px solid var(--border);border-radius:var(--radius);
+  color:var(--muted);font-size:.8rem;cursor:pointer;
+}
+.tab-pane .stop:hover{border-color:var(--error);color:var(--text)}
+.tab-pane .finalize{
+  margin:12px 0 0 6px;padding:8px 16px;background:none;border:1px solid var(--accent);border-radius:var(--radius);
+  color:var(--accent);font-size:.85rem;cursor:pointer;
+}
+.tab-pane .finalize:hover{background:var(--accent);color:#fff}
+.tab-pane .draft-label{color:var(--muted);font-size:.75rem;margin-top:10px;text-transform:uppercase;letter-spacing:.06em}
+.tab-pane img.draft{max-width:320px;opacity:.8}
 
 /* spinner */
 .spinner{display:inline-block;width:36px;height:36px;border:3px solid var(--border);border-top-color:var(--accent);border-radius:50%;animation:spin .8s linear infinite;margin:32px auto}
@@ -231,10 +631,21 @@ h1{font-size:1.3rem;font-weight:600;margin-bottom:24px;letter-spacing:-.02em;col
 /* ---- gallery ---- */
 .gallery-section{width:100%;max-width:860px}
 .gallery-section h2{font-size:1rem;font-weight:600;color:var(--muted);margin-bottom:14px}
+.gallery-search{width:100%;margin-bottom:14px;padding:8px 12px;background:var(--surface);border:1px solid var(--border);border-radius:var(--radius);color:var(--text);font-size:.88rem}
+.gallery-search:focus{outline:none;border-color:var(--accent)}
 .gallery-grid{display:grid;grid-template-columns:repeat(auto-fill,minmax(180px,1fr));gap:10px}
-.gallery-grid a{display:block;overflow:hidden;border-radius:var(--radius);border:1px solid var(--border);transition:border-color .2s}
+.gallery-grid a{display:block;position:relative;overflow:hidden;border-radius:var(--radius);border:1px solid var(--border);transition:border-color .2s}
 .gallery-grid a:hover{border-color:var(--accent)}
-.gallery-grid img{width:100%;display:block}
+.gallery-grid img{width:100%;display:block;background-size:cover}
+.gallery-grid .star{
+  position:absolute;top:6px;right:6px;width:26px;height:26px;border:none;border-radius:50%;
+  background:rgba(10,10,12,.6);color:var(--muted);font-size:.9rem;cursor:pointer;opacity:0;transition:opacity .2s;
+}
+.gallery-grid a:hover .star,.gallery-grid .star.on{opacity:1}
+.gallery-grid .star.on{color:#f5c542}
+
+.gallery-more{display:block;margin:14px auto 0;padding:8px 20px;background:var(--surface);border:1px solid var(--border);border-radius:var(--radius);color:var(--muted);font-size:.85rem;cursor:pointer}
+.gallery-more:hover{border-color:var(--accent);color:var(--text)}
 
 .empty{color:var(--muted);font-size:.88rem;padding:40px 0;text-align:center}
 </style>
@@ -254,7 +665,19 @@ h1{font-size:1.3rem;font-weight:600;margin-bottom:24px;letter-spacing:-.02em;col
     <option value="16:9">&#9644; Landscape</option>
     <option value="9:16">&#9647; Portrait</option>
     <option value="1:1">&#9632; Square</option>
+    <option value="all">All ratios</option>
+  </select>
+  <select id="samples" title="Variants per aspect ratio">
+    <option value="1">&times;1</option>
+    <option value="2">&times;2</option>
+    <option value="4">&times;4</option>
   </select>
+  <select id="imageSize" title="Drafts are fast; finalize the ones you keep">
+    <option value="1K" selected>Draft 1K</option>
+    <option value="2K">2K</option>
+    <option value="4K">4K</option>
+  </select>
+  <label class="fresh-toggle" title="Skip cached results and generate a new variation"><input type="checkbox" id="freshToggle"> Fresh</label>
   <button type="submit">Generate</button>
 </form>
 
@@ -265,16 +688,19 @@ h1{font-size:1.3rem;font-weight:600;margin-bottom:24px;letter-spacing:-.02em;col
 
 <div class="gallery-section">
   <h2>gallery</h2>
+  <input type="search" class="gallery-search" id="gallerySearch" placeholder="Search prompts…" autocomplete="off">
+  <div class="gallery-grid" id="searchGrid" hidden></div>
   <div class="gallery-grid" id="galleryGrid"></div>
+  <button type="button" class="gallery-more" id="galleryMore" hidden>Load more</button>
 </div>
 
 <script>
-const tabs = [];          // {id, prompt, el_btn, el_pane, interval}
+const tabs = [];          // {id, prompt, el_btn, el_pane, finished, total, draft} — total: fan-out children, else 0; draft: image being finalized
 let activeTab = null;
 
 // ---- ref images (up to 3) ----
 const MAX_REFS = 3;
-const refFiles = [];      // array of File objects
+const refFiles = [];      // {file, refId: Promise<string|null>} — uploaded as soon as they're added
 const refInput = document.getElementById('refImage');
 const refLabel = document.getElementById('refLabel');
 const refThumbs = document.getElementById('refThumbs');
@@ -283,7 +709,7 @@ function updateRefUI() {
   refLabel.textContent = `Ref (${refFiles.length}/${MAX_REFS})`;
   refLabel.classList.toggle('full', refFiles.length >= MAX_REFS);
   refThumbs.innerHTML = '';
-  refFiles.forEach((file, i) => {
+  refFiles.forEach(({file}, i) => {
     const wrap = document.createElement('div');
     wrap.className = 'ref-thumb-item';
     const img = document.createElement('img');
@@ -302,10 +728,21 @@ function updateRefUI() {
 function addRefFile(file) {
   if (!file || !file.type.startsWith('image/')) return;
   if (refFiles.length >= MAX_REFS) return;
-  refFiles.push(file);
+  refFiles.push({file, refId: uploadRef(file)});
   updateRefUI();
 }
 
+async function uploadRef(file) {
+  const fd = new FormData();
+  fd.append('ref_image', file);
+  try {
+    const res = await fetch('/refs', { method: 'POST', body: fd });
+    const data = await res.json();
+    if (data.error) { alert(data.error); return null; }
+    return data.ref_id;
+  } catch { return null; }
+}
+
 function addRefFiles(files) {
   for (const f of files) { if (refFiles.length >= MAX_REFS) break; addRefFile(f); }
 }
@@ -342,24 +779,35 @@ document.getElementById('promptForm').addEventListener('submit', async e => {
   const prompt = input.value.trim();
   if (!prompt) return;
   const aspect = document.getElementById('aspectRatio').value;
+  const samples = document.getElementById('samples').value;
 
   const fd = new FormData();
   fd.append('prompt', prompt);
-  fd.append('aspect_ratio', aspect);
-  for (const f of refFiles) fd.append('ref_image', f);
+  for (const ratio of aspect === 'all' ? ['16:9', '9:16', '1:1'] : [aspect]) fd.append('aspect_ratio', ratio);
+  if (samples !== '1') fd.append('samples', samples);
+  fd.append('size', document.getElementById('imageSize').value);
+  if (document.getElementById('freshToggle').checked) fd.append('fresh', '1');
+  for (const ref of refFiles) {
+    const refId = await ref.refId;
+    if (refId) fd.append('ref_id', refId);
+    else fd.append('ref_image', ref.file);  // upload failed earlier; send inline
+  }
 
   input.value = '';
   clearRefs();
 
   const res = await fetch('/generate', { method: 'POST', body: fd });
   const data = await res.json();
+  if (res.status === 429) { alert(`${data.error}. Try again in ${res.headers.get('Retry-After')}s.`); return; }
   if (data.error) { alert(data.error); return; }
 
-  createTab(data.job_id, prompt);
+  // identical request already running in this browser — just show its tab
+  if (tabs.some(t => t.id === data.job_id)) { switchTab(data.job_id); return; }
+  createTab(data.job_id, prompt, data.children ? data.children.length : 0);
 });
 
 // ---- tabs ----
-function createTab(jobId, prompt) {
+function createTab(jobId, prompt, total = 0, draft = null) {
   document.getElementById('emptyTabs').style.display = 'none';
 
   const btn = document.createElement('button');
@@ -373,12 +821,16 @@ function createTab(jobId, prompt) {
 
   const pane = document.createElement('div');
   pane.className = 'tab-pane';
-  pane.innerHTML = `<div class="prompt-text">${esc(prompt)}</div><div class="spinner"></div>`;
+  pane.innerHTML = `<div class="prompt-text">${esc(prompt)}</div>` + draftHTML(draft)
+    + (total ? '<div class="variants"></div>' : '')
+    + '<div class="spinner"></div><div class="queue-pos"></div>'
+    + (total ? '<button type="button" class="stop">Stop remaining</button>' : '');
+  if (total) pane.querySelector('.stop').addEventListener('click', () => fetch(`/jobs/${jobId}`, { method: 'DELETE' }).catch(() => {}));
   document.getElementById('tabsBody').appendChild(pane);
 
-  const interval = setInterval(() => pollStatus(jobId), 2000);
-  tabs.push({id: jobId, prompt, el_btn: btn, el_pane: pane, interval});
+  tabs.push({id: jobId, prompt, el_btn: btn, el_pane: pane, finished: false, total, draft});
   switchTab(jobId);
+  syncStatus(jobId);  // catch anything that finished before the stream saw it
 }
 
 function switchTab(jobId) {
@@ -394,7 +846,7 @@ function removeTab(jobId) {
   const idx = tabs.findIndex(t => t.id === jobId);
   if (idx === -1) return;
   const t = tabs[idx];
-  clearInterval(t.interval);
+  if (!t.finished) fetch(`/jobs/${jobId}`, { method: 'DELETE' }).catch(() => {});  // frees the slot if still queued
   t.el_btn.remove();
   t.el_pane.remove();
   tabs.splice(idx, 1);
@@ -404,41 +856,200 @@ function removeTab(jobId) {
   }
 }
 
-async function pollStatus(jobId) {
-  const tab = tabs.find(t => t.id === jobId);
-  if (!tab) return;
+const STAGE_LABELS = {queued: 'Queued', calling_model: 'Generating...', saving: 'Saving...'};
+
+// ---- drafts ----
+// Sizes above the one an image was made at, offered as "Finalize" actions.
+function finalizeHTML(img, size) {
+  const higher = ['2K', '4K'].filter(s => s > (size || '4K'));
+  return higher.map(s => `<button type="button" class="finalize" data-image="${esc(img)}" data-size="${s}">Finalize ${s}</button>`).join('');
+}
+
+// The draft stays visible in the tab that finalizes it.
+function draftHTML(draft) {
+  if (!draft) return '';
+  return `<div class="draft-label">Draft</div><img class="draft" src="/outputs/${encodeURIComponent(draft)}?w=800" alt="Draft">`;
+}
+
+document.getElementById('tabsBody').addEventListener('click', async e => {
+  const btn = e.target.closest('.finalize');
+  if (!btn) return;
+  const tab = tabs.find(t => t.el_pane.contains(btn));
+  const fd = new FormData();
+  fd.append('image', btn.dataset.image);
+  fd.append('size', btn.dataset.size);
+  btn.disabled = true;
   try {
-    const res = await fetch(`/status/${jobId}`);
+    const res = await fetch('/finalize', { method: 'POST', body: fd });
     const data = await res.json();
-    if (data.status === 'done') {
-      clearInterval(tab.interval);
-      let html = `<div class="prompt-text">${esc(tab.prompt)}</div>`;
-      for (const img of data.images) {
-        html += `<img src="/outputs/${encodeURIComponent(img)}" alt="Generated image">`;
-        html += `<br><a class="download" href="/outputs/${encodeURIComponent(img)}" download="${esc(img)}">Download</a>`;
-      }
-      tab.el_pane.innerHTML = html;
-      loadGallery();
-    } else if (data.status === 'error') {
-      clearInterval(tab.interval);
-      tab.el_pane.innerHTML = `<div class="prompt-text">${esc(tab.prompt)}</div><div class="error">${esc(data.error)}</div>`;
+    if (res.status === 429) { alert(`${data.error}. Try again in ${res.headers.get('Retry-After')}s.`); return; }
+    if (data.error) { alert(data.error); return; }
+    if (tabs.some(t => t.id === data.job_id)) { switchTab(data.job_id); return; }
+    createTab(data.job_id, tab ? tab.prompt : '', 0, btn.dataset.image);
+  } finally {
+    btn.disabled = false;
+  }
+});
+
+// Fan-out tabs add each variant as its child job finishes.
+function renderVariants(tab, data) {
+  const grid = tab.el_pane.querySelector('.variants');
+  const fresh = (data.images || []).slice(grid.children.length);
+  for (const img of fresh) {
+    grid.insertAdjacentHTML('beforeend', `<div><img src="/outputs/${encodeURIComponent(img)}?w=800" alt="Generated variant">`
+      + `<br><a class="download" href="/outputs/${encodeURIComponent(img)}" download="${esc(img)}">Download</a>${finalizeHTML(img, data.size)}</div>`);
+  }
+  if (data.status !== 'pending') {
+    for (const sel of ['.spinner', '.queue-pos', '.stop']) tab.el_pane.querySelector(sel)?.remove();
+  }
+  return fresh.length;
+}
+
+function renderJob(tab, data) {
+  if (tab.finished) return;
+  if (tab.total && (data.status === 'pending' || data.status === 'done')) {
+    if (renderVariants(tab, data)) loadNewGallery();
+    if (data.status === 'done') { tab.finished = true; return; }
+    const pos = tab.el_pane.querySelector('.queue-pos');
+    if (pos && data.completed !== undefined) pos.textContent = `${data.completed}/${tab.total} finished — ${STAGE_LABELS[data.stage] || ''}`;
+    return;
+  }
+  if (data.status === 'pending') {
+    const pos = tab.el_pane.querySelector('.queue-pos');
+    if (pos) pos.textContent = data.stage === 'queued' && data.queue_position
+      ? `Queued — position ${data.queue_position}` : (STAGE_LABELS[data.stage] || '');
+  } else if (data.status === 'done') {
+    tab.finished = true;
+    let html = `<div class="prompt-text">${esc(tab.prompt)}</div>` + draftHTML(tab.draft);
+    for (const img of data.images) {
+      html += `<img src="/outputs/${encodeURIComponent(img)}?w=1600" alt="Generated image">`;
+      html += `<br><a class="download" href="/outputs/${encodeURIComponent(img)}" download="${esc(img)}">Download</a>`;
+      html += finalizeHTML(img, data.size);
     }
+    tab.el_pane.innerHTML = html;
+    loadNewGallery();
+  } else if (data.status === 'error' || data.status === 'cancelled') {
+    tab.finished = true;
+    tab.el_pane.innerHTML = `<div class="prompt-text">${esc(tab.prompt)}</div>${draftHTML(tab.draft)}<div class="error">${esc(data.error || 'Cancelled')}</div>`;
+  }
+}
+
+// One-off status fetch, used when a tab opens and when the stream reconnects.
+async function syncStatus(jobId) {
+  const tab = tabs.find(t => t.id === jobId);
+  if (!tab || tab.finished) return;
+  try {
+    const res = await fetch(`/status/${jobId}`);
+    renderJob(tab, await res.json());
   } catch {}
 }
 
+// ---- live updates (one stream for all tabs) ----
+const stream = new EventSource('/events');
+stream.addEventListener('open', () => tabs.forEach(t => syncStatus(t.id)));
+stream.addEventListener('job', e => {
+  const data = JSON.parse(e.data);
+  const tab = tabs.find(t => t.id === data.job_id);
+  if (tab) renderJob(tab, data);
+});
+stream.addEventListener('queue', e => {
+  const positions = JSON.parse(e.data);
+  for (const t of tabs) {
+    if (t.finished || !(t.id in positions)) continue;
+    renderJob(t, {status: 'pending', stage: 'queued', queue_position: positions[t.id]});
+  }
+});
+
 // ---- gallery ----
+const GALLERY_PAGE = 60;
+let galleryCursor = null;   // next page of older entries
+let galleryLatest = null;   // created time of the newest entry shown
+
+function galleryItemHTML(it) {
+  const bg = it.placeholder ? ` style="background-image:url('${it.placeholder}')"` : '';
+  const star = `<button type="button" class="star${it.pinned ? ' on' : ''}" data-name="${esc(it.name)}" title="Star: keep when the disk budget evicts">&#9733;</button>`;
+  return `<a href="/outputs/${encodeURIComponent(it.name)}" target="_blank" title="${esc(it.prompt || '')}"><img src="/thumbs/${encodeURIComponent(it.name)}"${bg} loading="lazy" alt="">${star}</a>`;
+}
+
+// Starring pins an output so the disk budget never evicts it.
+for (const id of ['galleryGrid', 'searchGrid']) {
+  document.getElementById(id).addEventListener('click', async e => {
+    const btn = e.target.closest('.star');
+    if (!btn) return;
+    e.preventDefault();
+    const on = !btn.classList.contains('on');
+    const res = await fetch(`/pins/${encodeURIComponent(btn.dataset.name)}`, { method: on ? 'POST' : 'DELETE' });
+    if (res.ok) btn.classList.toggle('on', on);
+  });
+}
+
+async function fetchGallery(params) {
+  const res = await fetch(`/gallery?${new URLSearchParams({limit: GALLERY_PAGE, ...params})}`);
+  return res.json();
+}
+
+// Append the next page of older entries (or the first page).
 async function loadGallery() {
   try {
-    const res = await fetch('/gallery');
-    const data = await res.json();
-    const grid = document.getElementById('galleryGrid');
-    grid.innerHTML = data.images.map(img =>
-      `<a href="/outputs/${encodeURIComponent(img)}" target="_blank"><img src="/outputs/${encodeURIComponent(img)}" loading="lazy" alt=""></a>`
-    ).join('');
+    const data = await fetchGallery(galleryCursor ? {cursor: galleryCursor} : {});
+    if (galleryLatest === null) galleryLatest = data.latest;
+    galleryCursor = data.next_cursor;
+    document.getElementById('galleryGrid').insertAdjacentHTML('beforeend', data.items.map(galleryItemHTML).join(''));
+    document.getElementById('galleryMore').hidden = !galleryCursor;
+  } catch {}
+}
+
+// Prepend only entries created since the newest one shown. Every page of them
+// is fetched before galleryLatest moves on, so a burst larger than one page
+// isn't skipped; calls run one at a time so none prepends the same entries twice.
+let newGalleryRun = Promise.resolve();
+function loadNewGallery() {
+  newGalleryRun = newGalleryRun.then(fetchNewGallery);
+  return newGalleryRun;
+}
+
+async function fetchNewGallery() {
+  if (galleryLatest === null) return loadGallery();
+  try {
+    const items = [];
+    let latest = null, cursor = null;
+    do {
+      const data = await fetchGallery(cursor ? {since: galleryLatest, cursor} : {since: galleryLatest});
+      if (latest === null) latest = data.latest;
+      items.push(...data.items);
+      cursor = data.next_cursor;
+    } while (cursor);
+    if (!items.length) return;
+    galleryLatest = latest;
+    document.getElementById('galleryGrid').insertAdjacentHTML('afterbegin', items.map(galleryItemHTML).join(''));
   } catch {}
 }
+
+document.getElementById('galleryMore').addEventListener('click', loadGallery);
 loadGallery();
 
+// Search replaces the grid while the box has text; clearing it restores the gallery.
+let searchTimer = null;
+document.getElementById('gallerySearch').addEventListener('input', e => {
+  clearTimeout(searchTimer);
+  searchTimer = setTimeout(() => runSearch(e.target.value.trim()), 200);
+});
+
+async function runSearch(q) {
+  const grid = document.getElementById('searchGrid');
+  const searching = q.length > 0;
+  grid.hidden = !searching;
+  document.getElementById('galleryGrid').hidden = searching;
+  document.getElementById('galleryMore').hidden = searching || !galleryCursor;
+  if (!searching) return;
+  try {
+    const res = await fetch(`/search?${new URLSearchParams({q, limit: GALLERY_PAGE})}`);
+    const data = await res.json();
+    if (document.getElementById('gallerySearch').value.trim() !== q) return;  // stale response
+    grid.innerHTML = data.items.length ? data.items.map(galleryItemHTML).join('') : '<div class="empty">No matches</div>';
+  } catch {}
+}
+
 function esc(s) { const d = document.createElement('div'); d.textContent = s; return d.innerHTML; }
 </script>
 </body>
@@ -449,6 +1060,3 @@ function esc(s) { const d = document.createElement('div'); d.textContent = s; re
 def index():
     return INDEX_HTML
 
-
-if __name__ == "__main__":
-    app.run(debug=True, port=5000)
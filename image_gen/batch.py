@@ -0,0 +1,288 @@
+"""
+Asyncio batch engine for large prompt x aspect ratio x size sweeps.
+
+Uses the SDK's async client, so hundreds of requests can be in flight from
+one thread under a semaphore instead of one OS thread each. Calls share the
+adaptive rate limiter and retry budget from generate.py, and every result is
+written to disk as soon as it arrives.
+
+Usage:
+  # Sweep the built-in PROMPTS over two aspect ratios at 1K:
+  python3 batch.py --aspect 16:9 9:16 --size 1K
+
+  # Prompts from a file (one per line), 128 requests in flight:
+  python3 batch.py --prompts-file prompts.txt --aspect 16:9 1:1 --size 1K 2K --concurrency 128
+
+  # After a crash or Ctrl-C, rerun only the failed or missing tasks:
+  python3 batch.py --prompts-file prompts.txt --aspect 16:9 1:1 --size 1K 2K --resume
+
+  # Write Prometheus-format metrics for the run to a file:
+  python3 batch.py --prompts-file prompts.txt --metrics run.prom
+
+  # Cap each task at 2 minutes and hedge calls slower than the p95 (losers are cancelled):
+  python3 batch.py --prompts-file prompts.txt --deadline 120 --hedge 95
+
+As a library:
+  tasks = build_sweep(prompts, ["16:9", "9:16"], ["1K"])
+  results = asyncio.run(run_sweep(clients.get(), tasks, concurrency=64))
+"""
+
+import argparse
+import asyncio
+import itertools
+import os
+import sys
+import time
+import uuid
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import AsyncIterator, Callable
+
+from google import genai
+
+from config import DEFAULT_MODEL, OUTPUT_DIR
+from generate import (
+    PROMPTS, DEFAULT_SIZE, MAX_ATTEMPTS, RunStats, generation_config, rate_limiter, result_cache,
+    retry_budget, slugify,
+)
+from genai_client import clients
+from hedging import JOB_DEADLINE, DeadlineExceeded, deadline_in, hedger, remaining
+import image_meta
+from manifest import DEFAULT_MANIFEST, Manifest, task_id
+import metrics
+from output_writer import write_image
+from rate_limit import backoff_delay, classify_error
+from result_cache import cache_key
+
+DEFAULT_CONCURRENCY = 64
+
+
+@dataclass(frozen=True)
+class Task:
+    prompt: str
+    aspect_ratio: str
+    size: str
+    model: str = DEFAULT_MODEL
+
+    @property
+    def id(self) -> str:
+        return task_id(self.model, self.prompt, self.aspect_ratio, self.size)
+
+    @property
+    def stem(self) -> str:
+        """Filename prefix shared by every run of this task; run_task appends a per-run id."""
+        return f"{slugify(self.prompt)}_{self.aspect_ratio.replace(':', 'x')}_{self.size}_{self.id[:8]}"
+
+
+@dataclass
+class Result:
+    task: Task
+    files: list[str] = field(default_factory=list)
+    error: str | None = None
+    latency: float = 0.0
+    cached: bool = False
+
+
+def build_sweep(prompts: list[str], aspect_ratios: list[str], sizes: list[str], model: str = DEFAULT_MODEL) -> list[Task]:
+    """Every prompt x aspect ratio x size combination, deduplicated, in order."""
+    tasks = [Task(p, ar, s, model) for p, ar, s in itertools.product(prompts, aspect_ratios, sizes)]
+    return list(dict.fromkeys(tasks))
+
+
+def pending_tasks(tasks: list[Task], manifest: Manifest) -> list[Task]:
+    """Drop tasks the manifest records as done."""
+    completed = manifest.completed()
+    return [t for t in tasks if t.id not in completed]
+
+
+def record_result(manifest: Manifest, result: Result):
+    t = result.task
+    manifest.append(t.id, prompt=t.prompt, model=t.model, aspect_ratio=t.aspect_ratio, size=t.size,
+                    files=result.files, latency=result.latency, error=result.error)
+
+
+async def call_model_async(client: genai.Client, task: Task, contents, stats: RunStats | None = None,
+                           deadline: float | None = None):
+    """Async counterpart of generate.call_model: rate limited, with jittered retries, hedging and a deadline."""
+
+    async def request(timeout: float | None):
+        with metrics.model_calls_in_flight.track(), metrics.model_call_seconds.time(size=task.size):
+            return await client.aio.models.generate_content(
+                model=task.model,
+                contents=contents,
+                config=generation_config(task.aspect_ratio, task.size, timeout),
+            )
+
+    retry_budget.record_attempt()
+    attempt = 0
+    while True:
+        remaining(deadline)
+        await rate_limiter.acquire_async()
+        start = time.monotonic()
+        try:
+            response = await hedger.call_async(request, task.size, deadline, before_hedge=rate_limiter.acquire_async)
+        except DeadlineExceeded:
+            raise
+        except Exception as e:
+            retryable, throttled = classify_error(e)
+            if throttled:
+                rate_limiter.on_throttle()
+            if not retryable or attempt + 1 >= MAX_ATTEMPTS or not retry_budget.try_spend():
+                raise
+            delay = backoff_delay(attempt)
+            left = remaining(deadline)
+            if left is not None and delay >= left:
+                raise DeadlineExceeded(f"Deadline exceeded: no time left to retry after: {e}") from e
+            metrics.model_retries.inc()
+            if stats:
+                stats.record_retry()
+            await asyncio.sleep(delay)
+            attempt += 1
+            continue
+        rate_limiter.on_success()
+        if stats:
+            stats.record_call(time.monotonic() - start)
+        return response
+
+
+async def run_task(client: genai.Client, task: Task, use_cache: bool = True, stats: RunStats | None = None,
+                   deadline: float | None = JOB_DEADLINE) -> Result:
+    """Run one task; ``deadline`` is seconds for its model call, retries included (None or 0: no limit)."""
+    key = cache_key(task.model, task.prompt, task.aspect_ratio, task.size)
+    if use_cache:
+        cached = result_cache.get(key)
+        if cached is not None:
+            return Result(task, files=cached, cached=True)
+
+    start = time.monotonic()
+    try:
+        response = await call_model_async(client, task, task.prompt, stats, deadline_in(deadline))
+        files = []
+        meta = image_meta.record(task.prompt, task.model, task.aspect_ratio, task.size)
+        # a fresh run of the same task must not overwrite the earlier outputs; resume
+        # matches tasks by id through the manifest, never by filename
+        stem = f"{task.stem}_{uuid.uuid4().hex[:8]}"
+        for i, part in enumerate(p for p in response.parts if p.inline_data is not None):
+            # write off the event loop; re-encoding (if configured) runs in the process pool
+            path = await asyncio.to_thread(write_image, part.inline_data.data, part.inline_data.mime_type,
+                                           f"{stem}_{i}", metadata=meta)
+            files.append(path.name)
+        if not files:
+            text = "".join(p.text for p in response.parts if p.text is not None)
+            metrics.results.inc(outcome="text_only")
+            return Result(task, error=text or "No image returned", latency=time.monotonic() - start)
+        result_cache.put(key, files)
+        metrics.results.inc(outcome="success")
+        return Result(task, files=files, latency=time.monotonic() - start)
+    except Exception as e:
+        metrics.record_error(e)
+        return Result(task, error=str(e), latency=time.monotonic() - start)
+
+
+async def iter_sweep(client: genai.Client, tasks: list[Task], concurrency: int = DEFAULT_CONCURRENCY,
+                     use_cache: bool = True, stats: RunStats | None = None,
+                     deadline: float | None = JOB_DEADLINE) -> AsyncIterator[Result]:
+    """Yield results in completion order, with at most ``concurrency`` requests in flight."""
+    sem = asyncio.Semaphore(concurrency)
+
+    async def bounded(task: Task) -> Result:
+        async with sem:
+            return await run_task(client, task, use_cache, stats, deadline)
+
+    pending = [asyncio.ensure_future(bounded(t)) for t in tasks]
+    try:
+        for next_done in asyncio.as_completed(pending):
+            yield await next_done
+    finally:
+        for fut in pending:
+            fut.cancel()
+
+
+async def run_sweep(client: genai.Client, tasks: list[Task], concurrency: int = DEFAULT_CONCURRENCY,
+                    use_cache: bool = True, stats: RunStats | None = None,
+                    on_result: Callable[[Result], None] | None = None,
+                    deadline: float | None = JOB_DEADLINE) -> list[Result]:
+    """Run every task and return all results (completion order)."""
+    results = []
+    async for result in iter_sweep(client, tasks, concurrency, use_cache, stats, deadline):
+        if on_result:
+            on_result(result)
+        results.append(result)
+    return results
+
+
+def _print_result(done: list[int], total: int):
+    def on_result(result: Result):
+        done[0] += 1
+        t = result.task
+        label = f"[{done[0]}/{total}] {t.aspect_ratio} {t.size} {t.prompt[:60]}"
+        if result.error:
+            print(f"  {label} — error: {result.error[:120]}")
+        else:
+            print(f"  {label} — {'cached' if result.cached else f'{result.latency:.1f}s'}: {', '.join(result.files)}")
+    return on_result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a prompt sweep with the asyncio batch engine")
+    parser.add_argument("--prompts-file", type=Path, help="Text file with one prompt per line (default: generate.PROMPTS)")
+    parser.add_argument("--aspect", nargs="+", default=["16:9"], choices=["16:9", "9:16", "1:1"], help="Aspect ratios")
+    parser.add_argument("--size", nargs="+", default=[DEFAULT_SIZE], choices=["1K", "2K", "4K"], help="Resolutions")
+    parser.add_argument("--model", type=str, default=DEFAULT_MODEL, help=f"Model (default: {DEFAULT_MODEL})")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY, help=f"Requests in flight (default: {DEFAULT_CONCURRENCY})")
+    parser.add_argument("--rate", type=float, default=rate_limiter.rate, help="Starting requests/second; adapts from there")
+    parser.add_argument("--fresh", action="store_true", help="Skip the result cache")
+    parser.add_argument("--manifest", type=Path, default=DEFAULT_MANIFEST, help="Run manifest (JSONL) to record results in")
+    parser.add_argument("--resume", action="store_true", help="Skip tasks the manifest records as done")
+    parser.add_argument("--metrics", type=str, metavar="FILE", help="Dump metrics at the end: a file (Prometheus text) or - for a summary")
+    parser.add_argument("--deadline", type=float, default=JOB_DEADLINE, help=f"Seconds per task, retries included (default: {JOB_DEADLINE:g}, 0 = none)")
+    parser.add_argument("--hedge", type=float, metavar="P", default=hedger.percentile, help="Hedge model calls slower than this latency percentile (default: off)")
+    args = parser.parse_args()
+    hedger.percentile = args.hedge
+
+    api_key = os.getenv("GOOGLE_API_KEY")
+    if clients.needs_api_key and (not api_key or api_key == "your-key-here"):
+        print("Set your GOOGLE_API_KEY in image_gen/.env")
+        sys.exit(1)
+
+    prompts = PROMPTS
+    if args.prompts_file:
+        prompts = [line.strip() for line in args.prompts_file.read_text().splitlines() if line.strip()]
+    tasks = build_sweep(prompts, args.aspect, args.size, args.model)
+    manifest = Manifest(args.manifest)
+
+    print(f"\nSweep: {len(prompts)} prompts x {len(args.aspect)} aspect ratios x {len(args.size)} sizes = {len(tasks)} tasks")
+    if args.resume:
+        total = len(tasks)
+        tasks = pending_tasks(tasks, manifest)
+        print(f"Resuming from {manifest.path}: {total - len(tasks)} already done, {len(tasks)} to run")
+    print(f"Concurrency: {args.concurrency}")
+    print(f"Output: {OUTPUT_DIR}\n")
+
+    rate_limiter.burst = args.concurrency
+    rate_limiter.rate = args.rate
+    rate_limiter.max_rate = max(rate_limiter.max_rate, args.rate)
+    stats = RunStats()
+    print_result = _print_result([0], len(tasks))
+
+    def on_result(result: Result):
+        record_result(manifest, result)
+        print_result(result)
+
+    try:
+        results = asyncio.run(run_sweep(clients.get(api_key), tasks, args.concurrency, not args.fresh, stats, on_result,
+                                      args.deadline))
+    except KeyboardInterrupt:
+        print(f"\nInterrupted. Finished tasks are recorded in {manifest.path}; rerun with --resume to continue.")
+        sys.exit(130)
+    for r in results:
+        stats.record_result(not r.error)
+
+    print(f"\nDone. {sum(len(r.files) for r in results)} images in {OUTPUT_DIR}/")
+    print(stats.summary())
+    if args.metrics:
+        metrics.dump(args.metrics)
+
+
+if __name__ == "__main__":
+    main()
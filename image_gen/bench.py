@@ -0,0 +1,190 @@
+"""
+Offline benchmark suite for the app and CLI, run against the fake backend.
+
+Everything runs in-process on a throwaway outputs directory with
+IMAGE_GEN_BACKEND=fake, so it needs no API key or network and is safe to
+run on any Linux box. Results are written as JSON so runs can be diffed.
+
+Usage:
+  python3 bench.py                        # full suite -> bench_report.json
+  python3 bench.py --quick --out r.json   # smaller sizes, for a fast check
+  python3 bench.py --latency 0.2          # fake model latency in seconds
+
+Benchmarks:
+  generate_latency   /generate -> done latency through the scheduler (p50/p95)
+  status_throughput  GET /status requests per second
+  gallery_throughput GET /gallery requests per second as output count grows
+  run_parallel       CLI prompts per second at several concurrency levels
+  run_parallel_429   same, with the fake injecting 429 bursts (retries, successes)
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+
+def _rate(count: int, seconds: float) -> float:
+    return round(count / seconds, 1) if seconds > 0 else float("inf")
+
+
+# ---------------------------------------------------------------------------
+# Benchmarks (modules are passed in: they must be imported after env setup)
+# ---------------------------------------------------------------------------
+def bench_generate_latency(app, n_jobs: int) -> dict:
+    from metrics import percentile
+
+    client = app.app.test_client()
+    submitted: dict[str, float] = {}
+    for i in range(n_jobs):
+        resp = client.post("/generate", data={"prompt": f"bench latency {i}", "fresh": "1"})
+        submitted[resp.json["job_id"]] = time.monotonic()
+
+    latencies = []
+    pending = dict(submitted)
+    while pending:
+        for job_id, start in list(pending.items()):
+            job = app.jobs.get(job_id)
+            if job and job["status"] != "pending":
+                latencies.append(time.monotonic() - start)
+                del pending[job_id]
+        time.sleep(0.005)
+    return dict(jobs=n_jobs, concurrency=app.scheduler.concurrency,
+                p50_s=round(percentile(latencies, 50), 3), p95_s=round(percentile(latencies, 95), 3),
+                max_s=round(max(latencies), 3))
+
+
+def bench_status_throughput(app, n_requests: int) -> dict:
+    client = app.app.test_client()
+    job_id = client.post("/generate", data={"prompt": "bench status", "fresh": "1"}).json["job_id"]
+    start = time.perf_counter()
+    for _ in range(n_requests):
+        client.get(f"/status/{job_id}")
+    return dict(requests=n_requests, req_per_s=_rate(n_requests, time.perf_counter() - start))
+
+
+def bench_gallery_throughput(app, output_dir: Path, counts: list[int], n_requests: int) -> list[dict]:
+    from fake_backend import canned_png
+
+    client = app.app.test_client()
+    png = canned_png("1:1", 64)
+    existing = 0
+    results = []
+    for count in counts:
+        for i in range(existing, count):
+            (output_dir / f"bench_gallery_{i:06d}.png").write_bytes(png)
+        existing = count
+        start = time.perf_counter()
+        app.gallery_index.sync()
+        sync_s = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for _ in range(n_requests):
+            client.get("/gallery?limit=60")
+        first_page = _rate(n_requests, time.perf_counter() - start)
+
+        latest = client.get("/gallery?limit=1").json["latest"]
+        start = time.perf_counter()
+        for _ in range(n_requests):
+            client.get(f"/gallery?since={latest}")
+        since = _rate(n_requests, time.perf_counter() - start)
+        results.append(dict(outputs=count, index_sync_s=round(sync_s, 3),
+                            first_page_req_per_s=first_page, since_req_per_s=since))
+    return results
+
+
+def bench_run_parallel(generate, levels: list[int], n_prompts: int) -> list[dict]:
+    from fake_backend import FakeClient
+
+    # measure concurrency, not the adaptive limiter's ramp-up
+    generate.rate_limiter.rate = generate.rate_limiter.max_rate = 10_000
+    results = []
+    for level in levels:
+        prompts = [f"bench run_parallel c{level} #{i}" for i in range(n_prompts)]
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            generate.run_parallel(FakeClient(), prompts, "fake", "1K", use_cache=False, concurrency=level)
+        elapsed = time.perf_counter() - start
+        results.append(dict(concurrency=level, prompts=n_prompts, seconds=round(elapsed, 3),
+                            prompts_per_s=_rate(n_prompts, elapsed)))
+    return results
+
+
+def bench_run_parallel_throttled(generate, n_prompts: int, concurrency: int) -> dict:
+    from fake_backend import FakeClient, FakeConfig
+    from rate_limit import AdaptiveRateLimiter
+
+    generate.rate_limiter = AdaptiveRateLimiter(rate=5.0, burst=concurrency)
+    client = FakeClient(FakeConfig(throttle_rate=0.05, throttle_burst=4, seed=1))
+    prompts = [f"bench throttled #{i}" for i in range(n_prompts)]
+    out = io.StringIO()
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(out):
+        generate.run_parallel(client, prompts, "fake", "1K", use_cache=False, concurrency=concurrency)
+    elapsed = time.perf_counter() - start
+    summary = [line for line in out.getvalue().splitlines() if "succeeded" in line]
+    return dict(concurrency=concurrency, prompts=n_prompts, seconds=round(elapsed, 3),
+                model_calls=client.calls, summary=summary[-1] if summary else None)
+
+
+# ---------------------------------------------------------------------------
+# Entry point
+# ---------------------------------------------------------------------------
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmarks against the fake backend")
+    parser.add_argument("--out", type=Path, default=Path("bench_report.json"), help="JSON report path")
+    parser.add_argument("--quick", action="store_true", help="Smaller sizes for a fast smoke run")
+    parser.add_argument("--latency", type=float, default=0.2, help="Fake model latency in seconds (default 0.2)")
+    args = parser.parse_args()
+
+    workdir = Path(tempfile.mkdtemp(prefix="image_gen_bench_"))
+    os.environ.update(
+        IMAGE_GEN_BACKEND="fake",
+        IMAGE_GEN_OUTPUT_DIR=str(workdir),
+        IMAGE_GEN_PERSIST_JOBS="0",
+        IMAGE_GEN_FAKE_LATENCY=str(args.latency),
+        IMAGE_GEN_MAX_QUEUE="10000",
+    )
+    sys.path.insert(0, str(Path(__file__).parent))
+
+    import app
+    import generate
+
+    scale = 1 if args.quick else 4
+    try:
+        report = dict(
+            started=time.strftime("%Y-%m-%dT%H:%M:%S"),
+            python=platform.python_version(),
+            platform=platform.platform(),
+            cpus=os.cpu_count(),
+            fake_latency_s=args.latency,
+            quick=args.quick,
+        )
+        print("generate_latency...")
+        report["generate_latency"] = bench_generate_latency(app, 10 * scale)
+        print("status_throughput...")
+        report["status_throughput"] = bench_status_throughput(app, 500 * scale)
+        print("gallery_throughput...")
+        counts = [100, 1000] if args.quick else [100, 1000, 5000, 20000]
+        report["gallery_throughput"] = bench_gallery_throughput(app, workdir, counts, 50 * scale)
+        print("run_parallel...")
+        report["run_parallel"] = bench_run_parallel(generate, [1, 4, 8, 16], 8 * scale)
+        print("run_parallel_429...")
+        report["run_parallel_429"] = bench_run_parallel_throttled(generate, 8 * scale, 8)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    args.out.write_text(json.dumps(report, indent=2) + "\n")
+    print(json.dumps(report, indent=2))
+    print(f"\nReport written to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
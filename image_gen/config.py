@@ -0,0 +1,28 @@
+"""
+Settings shared by the CLI, the Flask app and their helper modules.
+
+Kept import-free so any module can use it without circular imports through
+``generate.py``.
+"""
+
+import os
+from pathlib import Path
+
+OUTPUT_DIR = Path(os.getenv("IMAGE_GEN_OUTPUT_DIR") or Path(__file__).parent / "outputs")
+OUTPUT_DIR.mkdir(exist_ok=True)
+
+DEFAULT_MODEL = "gemini-3-pro-image-preview"
+
+# "production": job state and queue live in SQLite, shared by all web and
+# generator worker processes (see worker.py); anything else runs in-process
+PRODUCTION = os.getenv("IMAGE_GEN_MODE", "dev") == "production"
+
+
+def env_int(name: str, default: int) -> int:
+    value = os.getenv(name)
+    return int(value) if value else default
+
+
+def env_float(name: str, default: float) -> float:
+    value = os.getenv(name)
+    return float(value) if value else default
@@ -0,0 +1,32 @@
+"""
+Shared SQLite helpers for the image_gen state files.
+
+All state databases live in ``outputs/.state/`` so writes to them don't touch
+the mtime of the outputs directory itself (the gallery watcher relies on it).
+Connections are opened once per thread and reused.
+"""
+
+import sqlite3
+import threading
+from pathlib import Path
+
+from config import OUTPUT_DIR
+
+STATE_DIR = OUTPUT_DIR / ".state"
+STATE_DIR.mkdir(exist_ok=True)
+
+_local = threading.local()
+
+
+def connect(path: Path) -> sqlite3.Connection:
+    """Return this thread's connection to ``path``, opening it on first use."""
+    conns: dict[str, sqlite3.Connection] = _local.__dict__.setdefault("conns", {})
+    key = str(path)
+    conn = conns.get(key)
+    if conn is None:
+        conn = sqlite3.connect(key, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conns[key] = conn
+    return conn
@@ -0,0 +1,159 @@
+"""
+Find and prune near-duplicate outputs using perceptual hashes.
+
+Every output indexed by the gallery gets a 64-bit dHash (perceptual_hash.py).
+Two images whose hashes differ in at most ``--radius`` bits are treated as
+near-duplicates. A cluster is the newest image of a group plus the older
+images within ``--radius`` of it — not everything reachable through a chain
+of near-duplicates, which could pull in images that look nothing alike.
+
+Pruning never moves a protected output: a pinned one (starred in the
+gallery) or the source of a landing-page export. A protected image is
+preferred as the one a cluster keeps.
+
+Usage:
+  # Hash every indexed output that has no hash yet, on all cores:
+  python3 dedupe.py index
+
+  # List clusters of near-duplicates, largest first:
+  python3 dedupe.py cluster --radius 6
+
+  # Keep the newest image of each cluster, move the rest to outputs/.pruned/:
+  python3 dedupe.py prune --radius 6          # dry run
+  python3 dedupe.py prune --radius 6 --yes
+
+The gallery can also hide duplicates without touching any files: GET /gallery?dedupe=1.
+"""
+
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from config import OUTPUT_DIR
+from export import EXPORT_DIR, exported_sources
+from gallery_index import GalleryIndex
+from output_writer import pool_context
+from perceptual_hash import DEFAULT_RADIUS, group, hash_file
+from thumbs import placeholder_path, thumb_path
+
+PRUNED_DIR = OUTPUT_DIR / ".pruned"
+
+
+# ---------------------------------------------------------------------------
+# Hashing
+# ---------------------------------------------------------------------------
+def index_hashes(index: GalleryIndex, workers: int | None = None) -> int:
+    """Hash indexed outputs that have no hash yet, in a process pool. Returns how many were hashed."""
+    names = index.missing_hashes()
+    if not names:
+        return 0
+    paths = [str(OUTPUT_DIR / name) for name in names]
+    hashes = {}
+    with ProcessPoolExecutor(max_workers=workers, mp_context=pool_context()) as pool:
+        for name, value in zip(names, pool.map(hash_file, paths, chunksize=32)):
+            if value is not None:
+                hashes[name] = value
+    index.set_hashes(hashes)
+    return len(hashes)
+
+
+# ---------------------------------------------------------------------------
+# Clustering
+# ---------------------------------------------------------------------------
+def protected(index: GalleryIndex, export_dir: Path = EXPORT_DIR) -> set[str]:
+    """Outputs pruning must not move: pinned ones and export sources (as DiskBudget keeps them)."""
+    return index.pinned() | exported_sources(export_dir)
+
+
+def clusters(hashes: dict[str, tuple[int, float]], radius: int = DEFAULT_RADIUS,
+             keep: set[str] = frozenset()) -> list[list[str]]:
+    """Groups of two or more near-duplicates, largest group first.
+
+    Each group starts with the image to keep (the newest of ``keep``, else
+    the newest); the rest, newest first, are all within ``radius`` of it.
+    ``hashes`` maps name -> (dHash, created), as returned by
+    GalleryIndex.hashes().
+    """
+    preferred = sorted(hashes, key=lambda n: (n in keep, hashes[n][1], n), reverse=True)
+    groups = group(((name, hashes[name][0]) for name in preferred), radius)
+    found = [[members[0], *sorted(members[1:], key=lambda n: (hashes[n][1], n), reverse=True)]
+             for members in groups.values() if len(members) > 1]
+    found.sort(key=len, reverse=True)
+    return found
+
+
+def prune(index: GalleryIndex, groups: list[list[str]], export_dir: Path = EXPORT_DIR) -> int:
+    """Keep the first image of each group; move the others (its near-duplicates) to PRUNED_DIR.
+
+    Protected outputs are never moved. Returns how many moved.
+    """
+    PRUNED_DIR.mkdir(exist_ok=True)
+    keep = protected(index, export_dir)
+    moved = 0
+    for group in groups:
+        for name in group[1:]:
+            if name in keep:
+                continue
+            try:
+                os.replace(OUTPUT_DIR / name, PRUNED_DIR / name)
+            except FileNotFoundError:
+                pass
+            else:
+                moved += 1
+            index.remove(name)
+            for derived in (thumb_path(name), placeholder_path(name)):
+                derived.unlink(missing_ok=True)
+    return moved
+
+
+# ---------------------------------------------------------------------------
+# CLI
+# ---------------------------------------------------------------------------
+def main():
+    parser = argparse.ArgumentParser(description="Find and prune near-duplicate outputs")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Hashing processes (default: all cores)")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("index", help="Hash indexed outputs that have no hash yet")
+    for name, help_text in (("cluster", "List clusters of near-duplicates"),
+                            ("prune", "Keep the newest of each cluster, move the rest to outputs/.pruned/")):
+        cmd = sub.add_parser(name, help=help_text)
+        cmd.add_argument("--radius", type=int, default=DEFAULT_RADIUS,
+                         help=f"Max differing bits out of 64 (default: {DEFAULT_RADIUS})")
+    sub.choices["prune"].add_argument("--yes", action="store_true", help="Move files (default: dry run)")
+    args = parser.parse_args()
+
+    index = GalleryIndex()
+    index.sync()
+    start = time.monotonic()
+    hashed = index_hashes(index, args.workers)
+    if hashed or args.command == "index":
+        print(f"Hashed {hashed} outputs in {time.monotonic() - start:.1f}s")
+    if args.command == "index":
+        return
+
+    keep = protected(index)
+    groups = clusters(index.hashes(), args.radius, keep)
+    redundant = sum(name not in keep for g in groups for name in g[1:])
+    if args.command == "cluster":
+        for group in groups:
+            print(f"{len(group)} images:")
+            for name in group:
+                print(f"  {name}")
+        print(f"{len(groups)} clusters, {redundant} redundant images")
+        return
+
+    if not args.yes:
+        for group in groups:
+            print(f"keep {group[0]}")
+            for name in group[1:]:
+                print(f"  keep {name} (pinned or exported)" if name in keep else f"  prune {name}")
+        print(f"Would move {redundant} images to {PRUNED_DIR} (pass --yes to do it)")
+        return
+    moved = prune(index, groups)
+    print(f"Moved {moved} images to {PRUNED_DIR}")
+
+
+if __name__ == "__main__":
+    main()
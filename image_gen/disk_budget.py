@@ -0,0 +1,165 @@
+"""
+Byte and file-count budget for ``outputs/``, with least-recently-used eviction.
+
+Sizes come from the gallery index, so checking the budget is one aggregate
+query rather than a directory scan. /outputs requests record last-access
+times in memory; they are written to the index in batches, just before each
+check. When the outputs exceed either limit, the least recently accessed
+unpinned outputs (never accessed: oldest first) are deleted until they are
+back under 90% of it. Their thumbnails and resized variants go too, and
+count towards the bytes reclaimed.
+
+Pinned outputs are never evicted: starred ones (POST /pins/<name>) and the
+sources of landing-page exports (export.py's manifest, matched by path
+relative to outputs/).
+
+The app runs the check in a background thread. In production mode the
+worker.py supervisor runs it, once for all processes, and each web process
+only writes its access times to the index on the same interval. To check
+once from the CLI:
+
+  python3 disk_budget.py            # enforce now
+  python3 disk_budget.py --status   # show usage only
+
+    IMAGE_GEN_DISK_MAX_BYTES  outputs size limit          (default 0 = no limit)
+    IMAGE_GEN_DISK_MAX_FILES  outputs count limit         (default 0 = no limit)
+    IMAGE_GEN_DISK_INTERVAL   seconds between checks      (default 30)
+"""
+
+import argparse
+import threading
+import time
+from pathlib import Path
+
+from config import OUTPUT_DIR, env_float, env_int
+from export import EXPORT_DIR, exported_sources
+from gallery_index import GalleryIndex
+import metrics
+from thumbs import placeholder_path, thumb_path
+from variants import remove_variants
+
+MAX_BYTES = env_int("IMAGE_GEN_DISK_MAX_BYTES", 0)
+MAX_FILES = env_int("IMAGE_GEN_DISK_MAX_FILES", 0)
+CHECK_INTERVAL = env_float("IMAGE_GEN_DISK_INTERVAL", 30.0)
+LOW_WATER = 0.9  # evict down to this fraction of a limit, so one save doesn't trigger the next eviction
+
+
+class DiskBudget:
+    def __init__(self, index: GalleryIndex, max_bytes: int = MAX_BYTES, max_files: int = MAX_FILES,
+                 output_dir: Path = OUTPUT_DIR, export_dir: Path = EXPORT_DIR):
+        self.index = index
+        self.max_bytes = max_bytes
+        self.max_files = max_files
+        self.output_dir = output_dir
+        self.export_dir = export_dir
+        self._lock = threading.Lock()
+        self._accessed: dict[str, float] = {}
+        self._thread: threading.Thread | None = None
+        self.reclaimed_bytes = 0
+        self.evicted_files = 0
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.max_bytes or self.max_files)
+
+    def touch(self, name: str):
+        """Note an access; cheap enough for every /outputs request."""
+        if self.enabled:
+            with self._lock:
+                self._accessed[name] = time.time()
+
+    def flush(self):
+        with self._lock:
+            accessed, self._accessed = self._accessed, {}
+        if accessed:
+            self.index.touch(accessed)
+
+    def _over(self, count: int, size: int, fraction: float = 1.0) -> bool:
+        return bool((self.max_files and count > self.max_files * fraction)
+                    or (self.max_bytes and size > self.max_bytes * fraction))
+
+    def enforce(self) -> tuple[int, int]:
+        """Evict until under budget. Returns (files deleted, bytes reclaimed)."""
+        self.flush()
+        count, size = self.index.usage()
+        if not self._over(count, size):
+            return 0, 0
+
+        exported = exported_sources(self.export_dir)
+        files = reclaimed = 0
+        for name, nbytes in self.index.least_recently_used():
+            if not self._over(count, size, LOW_WATER):
+                break
+            if name in exported:
+                continue
+            try:
+                (self.output_dir / name).unlink()
+            except FileNotFoundError:
+                pass
+            self.index.remove(name)
+            derived_bytes = remove_variants(name)
+            for derived in (thumb_path(name), placeholder_path(name)):
+                try:
+                    derived_bytes += derived.stat().st_size
+                    derived.unlink()
+                except FileNotFoundError:
+                    pass
+            count -= 1
+            size -= nbytes
+            files += 1
+            reclaimed += nbytes + derived_bytes
+
+        self.evicted_files += files
+        self.reclaimed_bytes += reclaimed
+        metrics.evicted_files.inc(files)
+        metrics.evicted_bytes.inc(reclaimed)
+        if self._over(count, size):
+            print(f"Disk budget: still over after evicting {files} outputs; the rest are pinned")
+        elif files:
+            print(f"Disk budget: evicted {files} outputs, reclaimed {reclaimed / 1e6:.1f} MB")
+        return files, reclaimed
+
+    def stats(self) -> dict:
+        count, size = self.index.usage()
+        return dict(files=count, bytes=size, max_files=self.max_files, max_bytes=self.max_bytes,
+                    evicted_files=self.evicted_files, reclaimed_bytes=self.reclaimed_bytes)
+
+    def start(self, interval: float = CHECK_INTERVAL, enforce: bool = True):
+        """Check the budget every ``interval`` seconds; without ``enforce``, only flush access times."""
+        if self._thread is not None or not self.enabled:
+            return
+
+        def loop():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.enforce() if enforce else self.flush()
+                except Exception as e:
+                    print(f"Disk budget check failed: {e}")
+
+        self._thread = threading.Thread(target=loop, name="disk-budget", daemon=True)
+        self._thread.start()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Enforce the outputs disk budget")
+    parser.add_argument("--max-bytes", type=int, default=MAX_BYTES, help="Size limit in bytes (0 = none)")
+    parser.add_argument("--max-files", type=int, default=MAX_FILES, help="File count limit (0 = none)")
+    parser.add_argument("--status", action="store_true", help="Only show usage")
+    args = parser.parse_args()
+
+    index = GalleryIndex()
+    index.sync()
+    budget = DiskBudget(index, args.max_bytes, args.max_files)
+    if not args.status:
+        if not budget.enabled:
+            parser.error("no limit set: use --max-bytes/--max-files or IMAGE_GEN_DISK_MAX_BYTES/_FILES")
+        files, reclaimed = budget.enforce()
+        print(f"Evicted {files} outputs, reclaimed {reclaimed / 1e6:.1f} MB")
+    s = budget.stats()
+    max_mb = f"{s['max_bytes'] / 1e6:.0f}" if s["max_bytes"] else "-"
+    print(f"Outputs: {s['files']} files, {s['bytes'] / 1e6:.1f} MB (limits: {s['max_files'] or '-'} files, {max_mb} MB)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+"""
+In-process pub/sub used to push job updates to server-sent-event streams.
+
+Each subscriber gets its own bounded queue. A subscriber that stops reading
+(a stalled browser tab) never blocks publishers: once its queue is full it
+is unsubscribed and marked ``overflowed``, its stream ends, and the browser
+reconnects and re-syncs (a ``queue`` snapshot from /events, then /status
+for each of its jobs) instead of silently missing updates.
+"""
+
+import json
+import queue
+import threading
+
+SUBSCRIBER_QUEUE_SIZE = 256
+
+
+class Subscription(queue.Queue):
+    """One subscriber's queue of (event, data). ``overflowed`` is set once an event could not be queued."""
+
+    def __init__(self, maxsize: int = SUBSCRIBER_QUEUE_SIZE):
+        super().__init__(maxsize=maxsize)
+        self.overflowed = False
+
+
+class EventBus:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers: set[Subscription] = set()
+
+    def subscribe(self) -> Subscription:
+        q = Subscription()
+        with self._lock:
+            self._subscribers.add(q)
+        return q
+
+    def unsubscribe(self, q: Subscription):
+        with self._lock:
+            self._subscribers.discard(q)
+
+    def publish(self, event: str, data: dict):
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for q in subscribers:
+            try:
+                q.put_nowait((event, data))
+            except queue.Full:
+                # it has missed an event: cut it off so its client reconnects and re-syncs
+                q.overflowed = True
+                self.unsubscribe(q)
+
+    def __len__(self) -> int:
+        return len(self._subscribers)
+
+
+def format_sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
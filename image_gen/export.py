@@ -0,0 +1,290 @@
+"""
+Export chosen outputs as responsive assets for the landing page.
+
+Each export writes a set of derivatives of one output into ``public/images/``:
+
+  <name>-<width>.webp / .avif   a width ladder, each within a byte budget
+  <name>.webp                   the widest step, as a drop-in <img src>
+  <name>-mobile.webp            a 9:16 portrait crop for small screens
+  <name>-og.png                 a 1200x630 Open Graph crop (or --og NAME)
+
+WebP/AVIF quality is chosen per derivative: the highest quality whose file
+fits ``width x height x IMAGE_GEN_EXPORT_BPP`` bytes. Derivatives are encoded
+in a long-lived process pool shared by every export (see output_writer.py). Everything written is recorded in
+``public/images/export-manifest.json`` with the source's content hash, so
+re-exporting an unchanged source with unchanged settings does nothing.
+
+Usage:
+  python3 export.py outputs_file.png --name hero-1
+  python3 export.py outputs_file.png --name hero-1 --og og-preview.png --focus 0.6,0.5
+  python3 export.py a.png b.png            # names derived from filenames
+
+Or POST /export from the app (``filename``, ``name``, optional ``og``).
+
+    IMAGE_GEN_EXPORT_DIR      destination            (default ../public/images)
+    IMAGE_GEN_EXPORT_BPP      byte budget per pixel  (default 0.12)
+    IMAGE_GEN_EXPORT_WORKERS  encoder processes      (default: all cores)
+"""
+
+import argparse
+import io
+import json
+import os
+import re
+import threading
+import time
+from dataclasses import asdict, dataclass
+from pathlib import Path
+
+from PIL import Image, features
+
+from config import OUTPUT_DIR, env_float, env_int
+import metrics
+from output_writer import process_pool, write_atomic
+from variants import file_etag
+
+EXPORT_DIR = Path(os.getenv("IMAGE_GEN_EXPORT_DIR", Path(__file__).resolve().parent.parent / "public" / "images"))
+MANIFEST_NAME = "export-manifest.json"
+
+BYTES_PER_PIXEL = env_float("IMAGE_GEN_EXPORT_BPP", 0.12)
+EXPORT_WORKERS = env_int("IMAGE_GEN_EXPORT_WORKERS", os.cpu_count() or 2)
+
+WIDTHS = (640, 1280, 1920, 2560)
+MOBILE_SIZE = (1080, 1920)
+OG_SIZE = (1200, 630)
+QUALITIES = (90, 84, 78, 72, 66, 60, 52, 44, 36)  # tried highest first, by bisection
+FORMATS = ("webp", "avif") if features.check("avif") else ("webp",)
+
+_NAME = re.compile(r"^[a-z0-9][a-z0-9_-]{0,63}$")
+_lock = threading.Lock()
+
+
+class ExportError(ValueError):
+    """Raised for an unusable source or asset name."""
+
+
+@dataclass(frozen=True)
+class Derivative:
+    file: str
+    width: int
+    height: int | None = None  # None: keep the source aspect ratio
+    fmt: str = "webp"
+    budget: int | None = None  # bytes; None for lossless PNG
+
+
+# ---------------------------------------------------------------------------
+# Planning
+# ---------------------------------------------------------------------------
+def _budget(width: int, height: int) -> int:
+    return int(width * height * BYTES_PER_PIXEL)
+
+
+def plan(name: str, size: tuple[int, int], og_name: str | None = None) -> list[Derivative]:
+    """The derivatives to build for a source of ``size``. Nothing is upscaled."""
+    src_w, src_h = size
+    widths = sorted({min(w, src_w) for w in WIDTHS})
+    out = []
+    for w in widths:
+        h = round(src_h * w / src_w)
+        out += [Derivative(f"{name}-{w}.{fmt}", w, fmt=fmt, budget=_budget(w, h)) for fmt in FORMATS]
+    top = widths[-1]
+    out.append(Derivative(f"{name}.webp", top, budget=_budget(top, round(src_h * top / src_w))))
+    mobile_w, mobile_h = _fit(MOBILE_SIZE, size)
+    out.append(Derivative(f"{name}-mobile.webp", mobile_w, mobile_h, budget=_budget(mobile_w, mobile_h)))
+    og_w, og_h = _fit(OG_SIZE, size)
+    out.append(Derivative(og_name or f"{name}-og.png", og_w, og_h, fmt="png"))
+    return out
+
+
+def _fit(target: tuple[int, int], size: tuple[int, int]) -> tuple[int, int]:
+    """``target`` scaled down, keeping its aspect ratio, until a crop of that shape fits in ``size``."""
+    scale = min(1.0, size[0] / target[0], size[1] / target[1])
+    return max(1, round(target[0] * scale)), max(1, round(target[1] * scale))
+
+
+# ---------------------------------------------------------------------------
+# Rendering (worker processes)
+# ---------------------------------------------------------------------------
+def _crop(img: Image.Image, width: int, height: int, focus: tuple[float, float]) -> Image.Image:
+    """Crop to width:height around ``focus`` (fractions of the source), then resize."""
+    aspect = width / height
+    crop_w, crop_h = img.width, img.height
+    if img.width / img.height > aspect:
+        crop_w = round(img.height * aspect)
+    else:
+        crop_h = round(img.width / aspect)
+    left = min(max(0, round(focus[0] * img.width - crop_w / 2)), img.width - crop_w)
+    top = min(max(0, round(focus[1] * img.height - crop_h / 2)), img.height - crop_h)
+    return img.resize((width, height), Image.Resampling.LANCZOS, box=(left, top, left + crop_w, top + crop_h))
+
+
+def _encode(img: Image.Image, fmt: str, quality: int) -> bytes:
+    buf = io.BytesIO()
+    if fmt == "png":
+        img.save(buf, "PNG", optimize=True)
+    else:
+        img.save(buf, fmt.upper(), quality=quality)
+    return buf.getvalue()
+
+
+def render(source: str, d: Derivative, focus: tuple[float, float]) -> tuple[bytes, int | None]:
+    """Build one derivative. Returns (bytes, quality used). Runs in a worker process."""
+    with Image.open(source) as img:
+        img = img.convert("RGB")
+    if d.height is None:
+        if img.width > d.width:
+            img = img.resize((d.width, max(1, round(img.height * d.width / img.width))), Image.Resampling.LANCZOS)
+    else:
+        img = _crop(img, d.width, d.height, focus)
+
+    if d.budget is None:
+        return _encode(img, d.fmt, 0), None
+    # highest quality within budget; fall back to the lowest if none fits
+    lo, hi = 0, len(QUALITIES) - 1
+    best = None
+    while lo <= hi:
+        mid = (lo + hi) // 2
+        data = _encode(img, d.fmt, QUALITIES[mid])
+        if len(data) <= d.budget:
+            best, hi = (data, QUALITIES[mid]), mid - 1
+        else:
+            lo = mid + 1
+    return best or (_encode(img, d.fmt, QUALITIES[-1]), QUALITIES[-1])
+
+
+# ---------------------------------------------------------------------------
+# Export
+# ---------------------------------------------------------------------------
+def load_manifest(out_dir: Path = EXPORT_DIR) -> dict[str, dict]:
+    try:
+        return json.loads((out_dir / MANIFEST_NAME).read_text())
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def source_key(source: Path) -> str:
+    """How the manifest records a source: its path relative to outputs/ (the gallery's name for it), else absolute."""
+    path = source.resolve()
+    try:
+        return path.relative_to(OUTPUT_DIR.resolve()).as_posix()
+    except ValueError:
+        return str(path)
+
+
+def exported_sources(out_dir: Path = EXPORT_DIR) -> set[str]:
+    """Outputs that exported assets were built from, as recorded in the manifest (see source_key)."""
+    return {entry["source"] for entry in load_manifest(out_dir).values()}
+
+
+def _settings(og_name: str | None, focus: tuple[float, float]) -> dict:
+    return dict(widths=list(WIDTHS), formats=list(FORMATS), bpp=BYTES_PER_PIXEL, mobile=list(MOBILE_SIZE),
+                og=list(OG_SIZE), og_name=og_name, focus=list(focus), qualities=list(QUALITIES))
+
+
+def asset_name(source: Path) -> str:
+    """Default asset name for a source file: its stem, lowercased and slugged."""
+    return re.sub(r"[^a-z0-9_-]+", "-", source.stem.lower()).strip("-_")[:64] or "image"
+
+
+def export(sources: list[tuple[Path, str]], og_name: str | None = None, focus: tuple[float, float] = (0.5, 0.5),
+           out_dir: Path = EXPORT_DIR, workers: int = EXPORT_WORKERS, force: bool = False) -> list[dict]:
+    """Export each (source path, asset name). Returns the manifest entries, with ``skipped`` set
+    for sources whose hash and settings match the previous export.
+
+    ``workers`` sizes the export pool when the first export starts it.
+    """
+    if og_name is not None and len(sources) > 1:
+        raise ExportError("og name only applies when exporting one source")
+    for source, name in sources:
+        if not _NAME.match(name):
+            raise ExportError(f"Invalid asset name {name!r}: use lowercase letters, digits, - and _")
+        if not source.is_file():
+            raise ExportError(f"No such output: {source.name}")
+    if og_name is not None and not (og_name.endswith(".png") and _NAME.match(og_name[:-4])):
+        raise ExportError(f"Invalid og name {og_name!r}: expected e.g. og-preview.png")
+
+    with _lock:
+        out_dir.mkdir(parents=True, exist_ok=True)
+        manifest = load_manifest(out_dir)
+        settings = _settings(og_name, focus)
+        entries, work = [], []
+        for source, name in sources:
+            source_hash = file_etag(source)
+            previous = manifest.get(name)
+            if (not force and previous and previous["source_hash"] == source_hash
+                    and previous["settings"] == settings
+                    and all((out_dir / f["file"]).is_file() for f in previous["files"])):
+                entries.append(dict(previous, name=name, skipped=True))
+                continue
+            with Image.open(source) as img:
+                size = img.size
+            entry = dict(name=name, source=source_key(source), source_hash=source_hash, settings=settings,
+                         width=size[0], height=size[1], exported=time.time(), files=[])
+            entries.append(entry)
+            work += [(entry, source, d) for d in plan(name, size, og_name)]
+
+        if work:
+            pool = process_pool("export", workers)
+            # <name>.webp is the widest ladder step again: encode it once
+            renders = {}
+            for _, source, d in work:
+                key = (source, d.width, d.height, d.fmt, d.budget)
+                if key not in renders:
+                    renders[key] = pool.submit(render, str(source), d, focus)
+            for entry, source, d in work:
+                data, quality = renders[(source, d.width, d.height, d.fmt, d.budget)].result()
+                write_atomic(out_dir / d.file, data)
+                metrics.bytes_written.inc(len(data))
+                entry["files"].append(dict(asdict(d), bytes=len(data), quality=quality))
+
+        for entry in entries:
+            if not entry.get("skipped"):
+                manifest[entry["name"]] = entry
+        if work:
+            write_atomic(out_dir / MANIFEST_NAME, json.dumps(manifest, indent=2, sort_keys=True).encode())
+    return entries
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export outputs as responsive landing-page assets")
+    parser.add_argument("sources", nargs="+", help="Output filenames (in outputs/) or paths")
+    parser.add_argument("--name", help="Asset name (one source only; default: from the filename)")
+    parser.add_argument("--og", metavar="FILE", help="Open Graph image filename, e.g. og-preview.png (default: <name>-og.png)")
+    parser.add_argument("--focus", default="0.5,0.5", help="Crop centre as x,y fractions (default: 0.5,0.5)")
+    parser.add_argument("--out", default=str(EXPORT_DIR), help=f"Destination directory (default: {EXPORT_DIR})")
+    parser.add_argument("--workers", type=int, default=EXPORT_WORKERS, help=f"Encoder processes (default: {EXPORT_WORKERS})")
+    parser.add_argument("--force", action="store_true", help="Rebuild even if the source is unchanged")
+    args = parser.parse_args()
+
+    if args.name and len(args.sources) > 1:
+        parser.error("--name needs exactly one source")
+    try:
+        focus = tuple(float(v) for v in args.focus.split(","))
+        assert len(focus) == 2 and all(0 <= v <= 1 for v in focus)
+    except (ValueError, AssertionError):
+        parser.error("--focus must be two fractions, e.g. 0.5,0.4")
+
+    sources = []
+    for src in args.sources:
+        path = Path(src) if os.path.exists(src) else OUTPUT_DIR / src
+        sources.append((path, args.name or asset_name(path)))
+    start = time.monotonic()
+    try:
+        entries = export(sources, og_name=args.og, focus=focus, out_dir=Path(args.out), workers=args.workers,
+                         force=args.force)
+    except ExportError as e:
+        parser.error(str(e))
+    for entry in entries:
+        if entry.get("skipped"):
+            print(f"{entry['name']}: unchanged, skipped")
+            continue
+        total = sum(f["bytes"] for f in entry["files"])
+        print(f"{entry['name']}: {len(entry['files'])} files, {total / 1024:.0f} KB")
+        for f in entry["files"]:
+            quality = f" q{f['quality']}" if f["quality"] else ""
+            print(f"  {f['file']:<32} {f['width']:>5}px {f['bytes'] / 1024:>7.0f} KB{quality}")
+    print(f"Done in {time.monotonic() - start:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+"""
+Local stand-in for the Gemini image API, for benchmarks and offline runs.
+
+``FakeClient`` mimics the parts of ``genai.Client`` this project uses
+(``models.generate_content`` and ``aio.models.generate_content``) and returns
+canned PNG bytes after a configurable latency. It can also inject slow
+tails, transient 503s and bursts of 429s. Like the real client, it honours
+``config.http_options.timeout``: a call that would take longer raises
+TimeoutError once the timeout has passed. Select it with
+``IMAGE_GEN_BACKEND=fake``; tune it with:
+
+    IMAGE_GEN_FAKE_LATENCY       mean seconds per call         (default 0.5)
+    IMAGE_GEN_FAKE_TAIL_PROB     chance of a slow call         (default 0.05)
+    IMAGE_GEN_FAKE_TAIL_FACTOR   slow call = latency x factor  (default 6)
+    IMAGE_GEN_FAKE_ERROR_RATE    chance of a 503               (default 0)
+    IMAGE_GEN_FAKE_THROTTLE_RATE chance a call starts a 429 burst (default 0)
+    IMAGE_GEN_FAKE_THROTTLE_BURST 429s per burst               (default 5)
+    IMAGE_GEN_FAKE_EDGE          long edge of returned images  (default 512)
+"""
+
+import asyncio
+import functools
+import io
+import random
+import threading
+import time
+from dataclasses import dataclass
+
+from google.genai import errors, types
+from PIL import Image
+
+from config import env_float, env_int
+
+ASPECT_RATIOS = {"16:9": (16, 9), "9:16": (9, 16), "1:1": (1, 1)}
+
+
+@dataclass
+class FakeConfig:
+    latency: float = env_float("IMAGE_GEN_FAKE_LATENCY", 0.5)
+    tail_prob: float = env_float("IMAGE_GEN_FAKE_TAIL_PROB", 0.05)
+    tail_factor: float = env_float("IMAGE_GEN_FAKE_TAIL_FACTOR", 6.0)
+    error_rate: float = env_float("IMAGE_GEN_FAKE_ERROR_RATE", 0.0)
+    throttle_rate: float = env_float("IMAGE_GEN_FAKE_THROTTLE_RATE", 0.0)
+    throttle_burst: int = env_int("IMAGE_GEN_FAKE_THROTTLE_BURST", 5)
+    edge: int = env_int("IMAGE_GEN_FAKE_EDGE", 512)
+    seed: int | None = None
+
+
+@functools.lru_cache(maxsize=16)
+def canned_png(aspect_ratio: str, edge: int) -> bytes:
+    w, h = ASPECT_RATIOS.get(aspect_ratio, (1, 1))
+    scale = edge / max(w, h)
+    size = (max(1, round(w * scale)), max(1, round(h * scale)))
+    img = Image.linear_gradient("L").resize(size).convert("RGB")
+    buf = io.BytesIO()
+    img.save(buf, "PNG")
+    return buf.getvalue()
+
+
+def _timeout(config) -> float | None:
+    """The request timeout in seconds, if the config sets one (HttpOptions.timeout is in ms)."""
+    options = getattr(config, "http_options", None)
+    return options.timeout / 1000 if options and options.timeout else None
+
+
+class _FakeModels:
+    def __init__(self, owner: "FakeClient"):
+        self._owner = owner
+
+    def generate_content(self, *, model: str, contents, config=None) -> types.GenerateContentResponse:
+        delay, fail = self._owner._plan()
+        timeout = _timeout(config)
+        if timeout is not None and delay > timeout:
+            time.sleep(timeout)
+            raise TimeoutError("fake request timed out")
+        time.sleep(delay)
+        return self._owner._respond(fail, config)
+
+
+class _FakeAsyncModels:
+    def __init__(self, owner: "FakeClient"):
+        self._owner = owner
+
+    async def generate_content(self, *, model: str, contents, config=None) -> types.GenerateContentResponse:
+        delay, fail = self._owner._plan()
+        timeout = _timeout(config)
+        if timeout is not None and delay > timeout:
+            await asyncio.sleep(timeout)
+            raise TimeoutError("fake request timed out")
+        await asyncio.sleep(delay)
+        return self._owner._respond(fail, config)
+
+
+class _FakeAio:
+    def __init__(self, owner: "FakeClient"):
+        self.models = _FakeAsyncModels(owner)
+
+
+class FakeClient:
+    def __init__(self, config: FakeConfig | None = None):
+        self.config = config or FakeConfig()
+        self.models = _FakeModels(self)
+        self.aio = _FakeAio(self)
+        self._rng = random.Random(self.config.seed)
+        self._lock = threading.Lock()
+        self._throttle_left = 0
+        self.calls = 0
+
+    def _plan(self) -> tuple[float, str | None]:
+        """Pick this call's latency and failure mode."""
+        c = self.config
+        with self._lock:
+            self.calls += 1
+            if self._throttle_left == 0 and self._rng.random() < c.throttle_rate:
+                self._throttle_left = c.throttle_burst
+            if self._throttle_left:
+                self._throttle_left -= 1
+                return c.latency * 0.05, "throttle"
+            delay = c.latency * self._rng.uniform(0.8, 1.2)
+            if self._rng.random() < c.tail_prob:
+                delay = c.latency * c.tail_factor
+            fail = "error" if self._rng.random() < c.error_rate else None
+            return delay, fail
+
+    def _respond(self, fail: str | None, config) -> types.GenerateContentResponse:
+        if fail == "throttle":
+            raise errors.ClientError(429, {"error": {"code": 429, "status": "RESOURCE_EXHAUSTED", "message": "fake quota exceeded"}})
+        if fail == "error":
+            raise errors.ServerError(503, {"error": {"code": 503, "status": "UNAVAILABLE", "message": "fake backend unavailable"}})
+        aspect_ratio = config.image_config.aspect_ratio if config and config.image_config else "1:1"
+        part = types.Part(inline_data=types.Blob(data=canned_png(aspect_ratio, self.config.edge), mime_type="image/png"))
+        return types.GenerateContentResponse(candidates=[types.Candidate(content=types.Content(role="model", parts=[part]))])
+
+    def close(self):
+        pass
@@ -0,0 +1,435 @@
+"""
+Persistent index of generated outputs, backing the /gallery endpoint.
+
+Entries are recorded by ``JobRunner`` as images are saved, so the common
+path never touches the filesystem. A background watcher picks up files that
+were added or removed by other means (the CLI, manual copies): it polls the
+outputs directory's mtime and only rescans when that changes.
+
+Pages are keyset-paginated on (created, name), so fetching any page or the
+entries newer than a ``since`` timestamp is an indexed lookup regardless of
+how many outputs exist.
+
+Each entry keeps the full prompt, parameters and reference ids, taken from
+the caller or from metadata embedded in the file (image_meta.py). Prompts
+are full-text indexed with FTS5 for ``search``. To rebuild the index from
+existing files, run:
+
+  python3 gallery_index.py --backfill
+
+Entries also store a perceptual hash, so ``page(dedupe=True)`` can collapse
+near-duplicates: an entry is hidden when it is within a small Hamming
+distance of a newer entry that is shown — the same groups dedupe.py prunes
+(see perceptual_hash.group).
+
+File sizes, last-access times and pins make the index the size index for the
+outputs disk budget (disk_budget.py), so enforcing it never scans the directory.
+"""
+
+import argparse
+import json
+import os
+import re
+import threading
+import time
+
+from PIL import Image
+
+from config import OUTPUT_DIR
+from db import STATE_DIR, connect
+import image_meta
+from manifest import DEFAULT_MANIFEST, Manifest
+from perceptual_hash import DEFAULT_RADIUS, dhash, from_signed, group, to_signed
+
+IMAGE_SUFFIXES = (".png", ".jpg", ".jpeg", ".webp", ".avif")
+
+DB_PATH = STATE_DIR / "gallery.db"
+WATCH_INTERVAL = 2.0
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS outputs (
+    name TEXT PRIMARY KEY,
+    created REAL NOT NULL,
+    prompt TEXT,
+    aspect_ratio TEXT,
+    size TEXT,
+    width INTEGER,
+    height INTEGER,
+    bytes INTEGER,
+    model TEXT,
+    ref_ids TEXT,
+    dhash INTEGER,
+    accessed REAL,  -- last served through /outputs; NULL: never
+    pinned INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS outputs_created ON outputs (created DESC, name DESC);
+"""
+
+# external-content FTS table over outputs.prompt, kept in sync by triggers
+_FTS_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS outputs_fts USING fts5(
+    prompt, content='outputs', content_rowid='rowid', tokenize='porter unicode61'
+);
+CREATE TRIGGER IF NOT EXISTS outputs_fts_insert AFTER INSERT ON outputs BEGIN
+    INSERT INTO outputs_fts (rowid, prompt) VALUES (new.rowid, new.prompt);
+END;
+CREATE TRIGGER IF NOT EXISTS outputs_fts_delete AFTER DELETE ON outputs BEGIN
+    INSERT INTO outputs_fts (outputs_fts, rowid, prompt) VALUES ('delete', old.rowid, old.prompt);
+END;
+CREATE TRIGGER IF NOT EXISTS outputs_fts_update AFTER UPDATE OF prompt ON outputs BEGIN
+    INSERT INTO outputs_fts (outputs_fts, rowid, prompt) VALUES ('delete', old.rowid, old.prompt);
+    INSERT INTO outputs_fts (rowid, prompt) VALUES (new.rowid, new.prompt);
+END;
+"""
+
+_COLUMNS = ("name", "created", "prompt", "aspect_ratio", "size", "width", "height", "bytes", "model", "ref_ids")
+
+# <slug>[_<ar>_<size>]_<8-hex id>[_<8-hex run id>]_<n>[-<n>]: what's left of the prompt in a filename
+_STEM_SUFFIX = re.compile(r"(_(16x9|9x16|1x1)_[124]K)?(_[0-9a-f]{8}){1,2}_\d+(-\d+)?$")
+
+
+def _read_file(path, with_hash: bool = True) -> tuple[int | None, int | None, dict | None, int | None]:
+    """Dimensions and embedded metadata from the image header, plus (decoding pixels) its dHash."""
+    try:
+        with Image.open(path) as img:
+            width, height, meta = img.width, img.height, image_meta.from_image(img)
+            if not with_hash:
+                return width, height, meta, None
+            img.draft("RGB", (64, 64))  # JPEG: decode at a fraction of full size
+            return width, height, meta, dhash(img)
+    except Exception:
+        return None, None, None, None
+
+
+def _row(row) -> dict:
+    d = dict(row)
+    d["ref_ids"] = json.loads(d["ref_ids"]) if d.get("ref_ids") else []
+    if "dhash" in d:
+        d["dhash"] = f"{from_signed(d['dhash']):016x}" if d["dhash"] is not None else None
+    if "pinned" in d:
+        d["pinned"] = bool(d["pinned"])
+    return d
+
+
+def prompt_from_filename(name: str) -> str:
+    """Best-effort (truncated) prompt for files that predate embedded metadata."""
+    stem = os.path.splitext(name)[0]
+    return _STEM_SUFFIX.sub("", stem).replace("_", " ")
+
+
+def fts_query(text: str) -> str | None:
+    """Turn free text into an FTS5 query: every word must match, the last one as a prefix."""
+    words = re.findall(r"\w+", text.lower())
+    if not words:
+        return None
+    terms = [f'"{w}"' for w in words]
+    terms[-1] += "*"
+    return " ".join(terms)
+
+
+def encode_cursor(created: float, name: str) -> str:
+    return f"{created!r}|{name}"
+
+
+def decode_cursor(cursor: str) -> tuple[float, str]:
+    created, _, name = cursor.partition("|")
+    return float(created), name
+
+
+class GalleryIndex:
+    def __init__(self, db_path=DB_PATH, output_dir=OUTPUT_DIR):
+        self.db_path = db_path
+        self.output_dir = output_dir
+        self._dir_mtime: int | None = None
+        self._watcher: threading.Thread | None = None
+        self._groups_lock = threading.Lock()
+        self._groups: dict[str, int] = {}
+        self._groups_key = None
+        self._migrate()
+
+    def _migrate(self):
+        db = self._db()
+        db.executescript(_SCHEMA)
+        columns = {row["name"] for row in db.execute("PRAGMA table_info(outputs)")}
+        for column, kind in (("model", "TEXT"), ("ref_ids", "TEXT"), ("dhash", "INTEGER"), ("accessed", "REAL"),
+                             ("pinned", "INTEGER NOT NULL DEFAULT 0")):
+            if column not in columns:
+                db.execute(f"ALTER TABLE outputs ADD COLUMN {column} {kind}")
+        db.execute("CREATE INDEX IF NOT EXISTS outputs_lru ON outputs (pinned, COALESCE(accessed, created))")
+        had_fts = db.execute("SELECT 1 FROM sqlite_master WHERE name = 'outputs_fts'").fetchone()
+        db.executescript(_FTS_SCHEMA)
+        if not had_fts:
+            db.execute("INSERT INTO outputs_fts (outputs_fts) VALUES ('rebuild')")
+
+    def _db(self):
+        return connect(self.db_path)
+
+    # -- writes ---------------------------------------------------------------
+    def add(self, name: str, prompt: str | None = None, aspect_ratio: str | None = None,
+            size: str | None = None, created: float | None = None, model: str | None = None,
+            ref_ids: list[str] | None = None, fallback: dict | None = None, compute_hash: bool = True,
+            hash_value: int | None = None):
+        """Record a saved output. Dimensions, size and perceptual hash are read from the file.
+
+        Fields not passed come from the file's embedded metadata, then from
+        ``fallback`` (e.g. a manifest record), then the filename and mtime.
+        A ``hash_value`` computed by the caller (e.g. from the thumbnail)
+        saves decoding the image; without it or ``compute_hash`` a previously
+        stored hash is kept.
+        """
+        path = self.output_dir / name
+        st = path.stat()
+        width, height, meta, read_hash = _read_file(path, with_hash=compute_hash and hash_value is None)
+        hash_value = read_hash if hash_value is None else hash_value
+        known = dict(fallback or {}, **(meta or {}))
+        given = dict(prompt=prompt, aspect_ratio=aspect_ratio, size=size, created=created, model=model, ref_ids=ref_ids)
+        row = {k: v if v is not None else known.get(k) for k, v in given.items()}
+        row["prompt"] = row["prompt"] or prompt_from_filename(name)
+        row["created"] = row["created"] or st.st_mtime
+        # upsert rather than REPLACE, so the FTS update trigger fires
+        self._db().execute(
+            f"INSERT INTO outputs ({', '.join(_COLUMNS)}, dhash) VALUES ({', '.join('?' * (len(_COLUMNS) + 1))}) "
+            "ON CONFLICT (name) DO UPDATE SET "
+            + ", ".join(f"{c} = excluded.{c}" for c in _COLUMNS[1:])
+            + ", dhash = COALESCE(excluded.dhash, outputs.dhash)",
+            (name, row["created"], row["prompt"], row["aspect_ratio"], row["size"], width, height, st.st_size,
+             row["model"], json.dumps(row["ref_ids"] or []), to_signed(hash_value) if hash_value is not None else None),
+        )
+
+    def set_hashes(self, hashes: dict[str, int]):
+        """Store precomputed perceptual hashes (e.g. from a process pool)."""
+        self._db().executemany("UPDATE outputs SET dhash = ? WHERE name = ?",
+                               [(to_signed(h), name) for name, h in hashes.items()])
+
+    def missing_hashes(self) -> list[str]:
+        return [row[0] for row in self._db().execute("SELECT name FROM outputs WHERE dhash IS NULL")]
+
+    def hashes(self) -> dict[str, tuple[int, float]]:
+        """name -> (dHash, created) for every hashed entry."""
+        return {
+            row["name"]: (from_signed(row["dhash"]), row["created"])
+            for row in self._db().execute("SELECT name, created, dhash FROM outputs WHERE dhash IS NOT NULL")
+        }
+
+    def remove(self, name: str):
+        self._db().execute("DELETE FROM outputs WHERE name = ?", (name,))
+
+    def pinned(self) -> set[str]:
+        """Names of pinned entries."""
+        return {row["name"] for row in self._db().execute("SELECT name FROM outputs WHERE pinned = 1")}
+
+    def set_pinned(self, name: str, pinned: bool) -> bool:
+        """Pin or unpin an entry. Returns False if there is no such entry."""
+        cur = self._db().execute("UPDATE outputs SET pinned = ? WHERE name = ?", (int(pinned), name))
+        return cur.rowcount > 0
+
+    def touch(self, accessed: dict[str, float]):
+        """Record last-access times, batched by the caller."""
+        self._db().executemany("UPDATE outputs SET accessed = MAX(COALESCE(accessed, 0), ?) WHERE name = ?",
+                               [(t, name) for name, t in accessed.items()])
+
+    def usage(self) -> tuple[int, int]:
+        """(entry count, total bytes) of indexed outputs."""
+        count, size = self._db().execute("SELECT COUNT(*), TOTAL(bytes) FROM outputs").fetchone()
+        return count, int(size)
+
+    def least_recently_used(self, batch: int = 500):
+        """Yield (name, bytes) of unpinned entries, least recently accessed (or created) first."""
+        last = None
+        while True:
+            where, params = "pinned = 0", []
+            if last is not None:
+                where += " AND (COALESCE(accessed, created), name) > (?, ?)"
+                params += last
+            rows = self._db().execute(
+                f"SELECT name, bytes, COALESCE(accessed, created) AS used FROM outputs WHERE {where} "
+                "ORDER BY used, name LIMIT ?", (*params, batch)).fetchall()
+            if not rows:
+                return
+            for row in rows:
+                yield row["name"], row["bytes"] or 0
+            last = [rows[-1]["used"], rows[-1]["name"]]
+
+    def sync(self):
+        """Reconcile the index with the directory contents."""
+        on_disk = {
+            e.name: e for e in os.scandir(self.output_dir)
+            if e.is_file() and os.path.splitext(e.name)[1].lower() in IMAGE_SUFFIXES
+        }
+        known = {row[0] for row in self._db().execute("SELECT name FROM outputs")}
+        for name in known - on_disk.keys():
+            self.remove(name)
+        for name in on_disk.keys() - known:
+            try:
+                self.add(name)
+            except FileNotFoundError:
+                pass
+
+    def backfill(self, manifest: Manifest | None = None) -> int:
+        """Re-index every output from embedded metadata, manifest records and filenames.
+
+        Returns the number of outputs indexed.
+        """
+        by_file = {}
+        if manifest is not None:
+            for record in manifest.load().values():
+                for f in record.get("files", []):
+                    by_file[f] = record
+        count = 0
+        for entry in os.scandir(self.output_dir):
+            if not entry.is_file() or os.path.splitext(entry.name)[1].lower() not in IMAGE_SUFFIXES:
+                continue
+            existing = self.get(entry.name) or {}
+            fallback = {k: v for k, v in existing.items() if v}
+            if fallback.get("prompt") == prompt_from_filename(entry.name):
+                del fallback["prompt"]
+            record = by_file.get(entry.name)
+            if record:
+                fallback.update(prompt=record["prompt"], model=record["model"],
+                                aspect_ratio=record["aspect_ratio"], size=record["size"])
+            try:
+                # hashing decodes every image; dedupe.py does that in parallel
+                self.add(entry.name, fallback=fallback, compute_hash=False)
+                count += 1
+            except FileNotFoundError:
+                pass
+        self.sync()
+        self._db().execute("INSERT INTO outputs_fts (outputs_fts) VALUES ('rebuild')")
+        return count
+
+    def sync_if_changed(self):
+        """Rescan only if the directory mtime moved since the last check."""
+        mtime = os.stat(self.output_dir).st_mtime_ns
+        if mtime != self._dir_mtime:
+            self._dir_mtime = mtime
+            self.sync()
+
+    def start_watcher(self, interval: float = WATCH_INTERVAL):
+        if self._watcher is not None:
+            return
+
+        def loop():
+            while True:
+                try:
+                    self.sync_if_changed()
+                except Exception as e:
+                    print(f"Gallery index sync failed: {e}")
+                time.sleep(interval)
+
+        self._watcher = threading.Thread(target=loop, name="gallery-watcher", daemon=True)
+        self._watcher.start()
+
+    # -- reads ----------------------------------------------------------------
+    def get(self, name: str) -> dict | None:
+        row = self._db().execute("SELECT * FROM outputs WHERE name = ?", (name,)).fetchone()
+        return _row(row) if row else None
+
+    def page(self, limit: int = 60, cursor: str | None = None, since: float | None = None,
+             dedupe: bool = False, radius: int = DEFAULT_RADIUS) -> tuple[list[dict], str | None]:
+        """Return up to ``limit`` entries, newest first, and the cursor for the next page.
+
+        ``cursor`` continues a previous page; ``since`` restricts to entries
+        created strictly after that timestamp. With ``dedupe``, entries within
+        ``radius`` of a newer shown entry are skipped, and each shown entry
+        reports how many older ones it stands for in ``duplicates``.
+        """
+        limit = max(1, limit)  # LIMIT 0 leaves no last row to continue from; a negative LIMIT means no limit
+        if not dedupe:
+            return self._page(limit, cursor, since)
+
+        groups = self._dedupe_groups(radius)
+        shown: list[dict] = []
+        while True:
+            rows, next_cursor = self._page(limit * 2, cursor, since)
+            for i, row in enumerate(rows):
+                duplicates = groups.get(row["name"], 0) if row["dhash"] is not None else 0
+                if duplicates < 0:
+                    continue
+                row["duplicates"] = duplicates
+                shown.append(row)
+                if len(shown) == limit:
+                    more = i < len(rows) - 1 or next_cursor is not None
+                    return shown, encode_cursor(row["created"], row["name"]) if more else None
+            if next_cursor is None:
+                return shown, None
+            cursor = next_cursor
+
+    def _dedupe_groups(self, radius: int) -> dict[str, int]:
+        """name -> older near-duplicates it stands for, or -1 if it is one itself.
+
+        Regrouped only when the stored hashes change (in any process) or ``radius`` does.
+        """
+        signature = tuple(self._db().execute("SELECT COUNT(dhash), TOTAL(dhash), MAX(rowid) FROM outputs").fetchone())
+        with self._groups_lock:
+            if (signature, radius) != self._groups_key:
+                hashes = self.hashes()
+                newest_first = sorted(hashes, key=lambda n: (hashes[n][1], n), reverse=True)
+                groups = {}
+                for members in group(((n, hashes[n][0]) for n in newest_first), radius).values():
+                    groups[members[0]] = len(members) - 1
+                    groups.update(dict.fromkeys(members[1:], -1))
+                self._groups, self._groups_key = groups, (signature, radius)
+            return self._groups
+
+    def _page(self, limit: int, cursor: str | None, since: float | None) -> tuple[list[dict], str | None]:
+        where, params = [], []
+        if cursor:
+            created, name = decode_cursor(cursor)
+            where.append("(created, name) < (?, ?)")
+            params += [created, name]
+        if since is not None:
+            where.append("created > ?")
+            params.append(since)
+        sql = f"SELECT {', '.join(_COLUMNS)}, dhash, pinned FROM outputs"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY created DESC, name DESC LIMIT ?"
+        rows = [_row(r) for r in self._db().execute(sql, (*params, limit + 1))]
+
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = encode_cursor(rows[-1]["created"], rows[-1]["name"])
+        return rows, next_cursor
+
+    def search(self, text: str, limit: int = 60, aspect_ratio: str | None = None,
+               since: float | None = None) -> list[dict]:
+        """Entries whose prompt matches ``text``, best match (BM25) first."""
+        limit = max(1, limit)
+        query = fts_query(text)
+        if query is None:
+            return []
+        sql = (f"SELECT {', '.join('o.' + c for c in _COLUMNS)}, o.pinned, bm25(outputs_fts) AS score "
+               "FROM outputs_fts JOIN outputs o ON o.rowid = outputs_fts.rowid WHERE outputs_fts MATCH ?")
+        params: list = [query]
+        if aspect_ratio:
+            sql += " AND o.aspect_ratio = ?"
+            params.append(aspect_ratio)
+        if since is not None:
+            sql += " AND o.created > ?"
+            params.append(since)
+        sql += " ORDER BY score, o.created DESC LIMIT ?"
+        return [_row(r) for r in self._db().execute(sql, (*params, limit))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Maintain the gallery/search index")
+    parser.add_argument("--backfill", action="store_true", help="Re-index all outputs from embedded metadata and the manifest")
+    parser.add_argument("--manifest", default=str(DEFAULT_MANIFEST), help="Run manifest to take CLI prompts from")
+    parser.add_argument("--search", metavar="QUERY", help="Search prompts and print the best matches")
+    args = parser.parse_args()
+
+    index = GalleryIndex()
+    if args.backfill:
+        start = time.monotonic()
+        count = index.backfill(Manifest(args.manifest))
+        print(f"Indexed {count} outputs in {time.monotonic() - start:.1f}s")
+    if args.search:
+        for row in index.search(args.search, limit=20):
+            print(f"{row['score']:7.2f}  {row['name']}\n         {row['prompt']}")
+    if not args.backfill and not args.search:
+        parser.print_help()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,185 @@
+"""
+Process-wide Gemini client shared by the Flask app and the CLI.
+
+Building a ``genai.Client`` per job means a fresh HTTP client and a new TLS
+handshake to the API every time. ``clients.get()`` instead returns one
+long-lived client whose httpx pools keep connections alive between jobs,
+sized to the worker concurrency. The client is rebuilt only when the API
+key changes. Long-running processes ``lease`` the client for each job
+instead: the client a key change replaces is closed, with its connection
+pools, as soon as the last job still using it finishes.
+
+``clients.stats()`` reports how many requests reused an existing connection
+versus opening a new one.
+
+The backend is pluggable: anything exposing ``models.generate_content`` and
+``aio.models.generate_content`` like ``genai.Client`` works. Set
+``IMAGE_GEN_BACKEND=fake`` to use the local fake in fake_backend.py, which
+needs no API key or network.
+"""
+
+import asyncio
+import contextlib
+import os
+import threading
+import weakref
+
+import httpx
+from google import genai
+from google.genai import types
+
+from config import DEFAULT_MODEL, env_float, env_int
+
+POOL_SIZE = env_int("IMAGE_GEN_HTTP_POOL", env_int("IMAGE_GEN_CONCURRENCY", 4) + 2)
+ASYNC_POOL_SIZE = env_int("IMAGE_GEN_ASYNC_HTTP_POOL", 128)  # batch.py keeps many requests in flight
+KEEPALIVE_EXPIRY = env_float("IMAGE_GEN_HTTP_KEEPALIVE", 120.0)
+BACKEND = os.getenv("IMAGE_GEN_BACKEND", "gemini")
+
+
+class _ConnectionStats:
+    """Counts requests served on new vs. reused connections."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._seen: weakref.WeakSet = weakref.WeakSet()
+        self.requests = 0
+        self.new_connections = 0
+
+    def record(self, response: httpx.Response):
+        stream = response.extensions.get("network_stream")
+        with self._lock:
+            self.requests += 1
+            if stream is None:
+                return
+            if stream not in self._seen:
+                self._seen.add(stream)
+                self.new_connections += 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return dict(
+                requests=self.requests,
+                new_connections=self.new_connections,
+                reused_connections=self.requests - self.new_connections,
+            )
+
+
+class ClientManager:
+    def __init__(self, pool_size: int = POOL_SIZE, async_pool_size: int = ASYNC_POOL_SIZE, backend: str = BACKEND):
+        self.backend = backend
+        self.pool_size = pool_size
+        self.async_pool_size = async_pool_size
+        self._lock = threading.Lock()
+        self._client: genai.Client | None = None
+        self._api_key: str | None = None
+        self._stats = _ConnectionStats()
+        self._leases: dict[object, int] = {}  # client -> jobs still using it
+        self._transports: dict[object, tuple[httpx.Client, httpx.AsyncClient]] = {}
+
+    @staticmethod
+    def _limits(size: int) -> httpx.Limits:
+        return httpx.Limits(
+            max_connections=size,
+            max_keepalive_connections=size,
+            keepalive_expiry=KEEPALIVE_EXPIRY,
+        )
+
+    def _build(self, api_key: str) -> genai.Client:
+        def on_response(response):
+            self._stats.record(response)
+
+        async def on_response_async(response):
+            self._stats.record(response)
+
+        transports = (
+            httpx.Client(limits=self._limits(self.pool_size), event_hooks={"response": [on_response]}),
+            httpx.AsyncClient(limits=self._limits(self.async_pool_size), event_hooks={"response": [on_response_async]}),
+        )
+        http_options = types.HttpOptions(httpx_client=transports[0], httpx_async_client=transports[1])
+        client = genai.Client(api_key=api_key, http_options=http_options)
+        self._transports[client] = transports
+        return client
+
+    def _close(self, client):
+        """Close a replaced client's connection pools (genai leaves caller-supplied ones open)."""
+        sync_http, async_http = self._transports.pop(client)
+        sync_http.close()
+        try:
+            asyncio.run(async_http.aclose())
+        except Exception as e:
+            # e.g. called from a running event loop; the pool's sockets close when it is collected
+            print(f"Closing the replaced async client failed: {e}")
+
+    @property
+    def needs_api_key(self) -> bool:
+        return self.backend != "fake"
+
+    def get(self, api_key: str | None = None) -> genai.Client:
+        """Return the shared client, (re)building it if the key is new.
+
+        Unleased, the client may be closed by the next key change; one-shot
+        CLIs can hold it, anything that outlives a key change should lease it.
+        """
+        client = self.acquire(api_key)
+        self.release(client)
+        return client
+
+    def acquire(self, api_key: str | None = None) -> genai.Client:
+        """Lease the shared client: it stays open until ``release``, even if the key changes meanwhile."""
+        replaced = None
+        with self._lock:
+            if self.backend == "fake":
+                if self._client is None:
+                    from fake_backend import FakeClient
+                    self._client = FakeClient()
+            else:
+                api_key = api_key or os.getenv("GOOGLE_API_KEY")
+                if not api_key:
+                    raise RuntimeError("GOOGLE_API_KEY not set")
+                if self._client is None or api_key != self._api_key:
+                    if self._client is not None and self._client not in self._leases:
+                        replaced = self._client
+                    self._client = self._build(api_key)
+                    self._api_key = api_key
+            client = self._client
+            self._leases[client] = self._leases.get(client, 0) + 1
+        if replaced is not None:
+            self._close(replaced)
+        return client
+
+    def release(self, client: genai.Client):
+        """End one lease; a client a key change replaced is closed once its last lease ends."""
+        with self._lock:
+            self._leases[client] -= 1
+            if self._leases[client]:
+                return
+            del self._leases[client]
+            replaced = client is not self._client and client in self._transports
+        if replaced:
+            self._close(client)
+
+    @contextlib.contextmanager
+    def lease(self, api_key: str | None = None):
+        """``with clients.lease() as client:`` — ``acquire`` for the block."""
+        client = self.acquire(api_key)
+        try:
+            yield client
+        finally:
+            self.release(client)
+
+    def warm_up(self, model: str = DEFAULT_MODEL):
+        """Open a pooled connection in the background so the first job skips the handshake."""
+        def run():
+            try:
+                with self.lease() as client:
+                    client.models.get(model=model)
+            except Exception as e:
+                print(f"Client warm-up failed: {e}")
+
+        threading.Thread(target=run, name="genai-warmup", daemon=True).start()
+
+    def stats(self) -> dict:
+        return dict(self._stats.snapshot(), pool_size=self.pool_size, async_pool_size=self.async_pool_size)
+
+
+clients = ClientManager()
@@ -14,31 +14,71 @@ Usage:
   # Change resolution (1K, 2K, or 4K):
   python3 generate.py --size 4K
 
+  # Ignore cached results and generate fresh variations:
+  python3 generate.py --fresh
+
+  # Run more prompts at once (rate limiting adapts to 429s either way):
+  python3 generate.py --concurrency 8
+
+  # Continue an interrupted run, retrying only failed or missing prompts:
+  python3 generate.py --resume
+
+  # Print a metrics digest at the end (or write Prometheus text to a file):
+  python3 generate.py --metrics -
+
+  # Give each prompt at most 2 minutes; hedge calls slower than the p95:
+  python3 generate.py --deadline 120 --hedge 95
+
+  # Record a trace of every stage (open in Perfetto, or summarize it):
+  python3 generate.py --trace trace.json && python3 tracing.py trace.json
+
+For large prompt x aspect ratio x size sweeps, use the asyncio engine in
+batch.py instead.
+
 Outputs saved to ./outputs/ with prompt-based filenames.
 """
 
+import math
 import os
 import re
 import sys
+import time
 import argparse
+import threading
+import uuid
 from pathlib import Path
-from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
 
 from dotenv import load_dotenv
 from google import genai
 from google.genai import types
 
+from config import OUTPUT_DIR, DEFAULT_MODEL
+from genai_client import clients
+from hedging import JOB_DEADLINE, DeadlineExceeded, deadline_in, hedger, remaining
+import image_meta
+from manifest import DEFAULT_MANIFEST, Manifest, task_id
+import metrics
+from output_writer import write_image
+from rate_limit import AdaptiveRateLimiter, RetryBudget, backoff_delay, classify_error
+from result_cache import InFlight, ResultCache, cache_key
+from tracing import span, tracer
+
 load_dotenv(Path(__file__).parent / ".env")
 
 # ---------------------------------------------------------------------------
 # Config
 # ---------------------------------------------------------------------------
-OUTPUT_DIR = Path(__file__).parent / "outputs"
-OUTPUT_DIR.mkdir(exist_ok=True)
-
-DEFAULT_MODEL = "gemini-3-pro-image-preview"
 DEFAULT_SIZE = "2K"
 ASPECT_RATIO = "16:9"
+DEFAULT_CONCURRENCY = 4
+MAX_ATTEMPTS = 4
+
+rate_limiter = AdaptiveRateLimiter(burst=DEFAULT_CONCURRENCY)
+retry_budget = RetryBudget()
+
+result_cache = ResultCache()
+in_flight = InFlight()
 
 # ---------------------------------------------------------------------------
 # Prompts — edit / add as many as you want
@@ -70,68 +110,242 @@ def slugify(text: str, max_len: int = 80) -> str:
     return text[:max_len]
 
 
-def generate_one(client: genai.Client, prompt: str, index: int, model: str, size: str = "2K") -> list[str]:
+class RunStats:
+    """Counters for the end-of-run summary."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.succeeded = 0
+        self.failed = 0
+        self.retries = 0
+        self.latencies: list[float] = []
+
+    def record_call(self, seconds: float):
+        with self._lock:
+            self.latencies.append(seconds)
+
+    def record_retry(self):
+        with self._lock:
+            self.retries += 1
+
+    def record_result(self, ok: bool):
+        with self._lock:
+            if ok:
+                self.succeeded += 1
+            else:
+                self.failed += 1
+
+    def percentile(self, p: float) -> float | None:
+        with self._lock:
+            latencies = list(self.latencies)
+        return metrics.percentile(latencies, p)
+
+    def summary(self) -> str:
+        line = f"{self.succeeded} succeeded, {self.failed} failed, {self.retries} retries"
+        if self.latencies:
+            line += f", model latency p50 {self.percentile(50):.1f}s / p95 {self.percentile(95):.1f}s"
+        return line
+
+
+def generation_config(aspect_ratio: str, size: str, timeout: float | None = None) -> types.GenerateContentConfig:
+    """Request config; ``timeout`` (seconds) aborts the HTTP request if the model hasn't answered by then."""
+    return types.GenerateContentConfig(
+        response_modalities=["IMAGE"],
+        image_config=types.ImageConfig(
+            aspect_ratio=aspect_ratio,
+            image_size=size,
+        ),
+        http_options=types.HttpOptions(timeout=math.ceil(timeout * 1000)) if timeout else None,  # ms, never early
+    )
+
+
+def call_model(client: genai.Client, model: str, contents, aspect_ratio: str, size: str,
+               label: str = "", stats: RunStats | None = None, deadline: float | None = None):
+    """Call the model under the shared rate limiter, retrying throttles and transient errors.
+
+    Nothing runs past ``deadline`` (time.monotonic()): each request gets the
+    time left as its timeout, and DeadlineExceeded is raised once it's gone.
+    Slow requests may be hedged (hedging.py).
+    """
+
+    def request(timeout: float | None):
+        with metrics.model_calls_in_flight.track(), metrics.model_call_seconds.time(size=size):
+            return client.models.generate_content(
+                model=model,
+                contents=contents,
+                config=generation_config(aspect_ratio, size, timeout),
+            )
+
+    retry_budget.record_attempt()
+    attempt = 0
+    while True:
+        remaining(deadline)
+        with span("rate_limit_wait", "model"):
+            rate_limiter.acquire()
+        start = time.monotonic()
+        try:
+            response = hedger.call(request, size, deadline, before_hedge=rate_limiter.acquire)
+        except DeadlineExceeded:
+            raise
+        except Exception as e:
+            retryable, throttled = classify_error(e)
+            if throttled:
+                rate_limiter.on_throttle()
+            if not retryable or attempt + 1 >= MAX_ATTEMPTS or not retry_budget.try_spend():
+                raise
+            delay = backoff_delay(attempt)
+            left = remaining(deadline)
+            if left is not None and delay >= left:
+                raise DeadlineExceeded(f"Deadline exceeded: no time left to retry after: {e}") from e
+            print(f"  {label}Retrying in {delay:.1f}s after: {e}")
+            metrics.model_retries.inc()
+            if stats:
+                stats.record_retry()
+            with span("retry_backoff", "model", attempt=attempt + 1):
+                time.sleep(delay)
+            attempt += 1
+            continue
+        rate_limiter.on_success()
+        if stats:
+            stats.record_call(time.monotonic() - start)
+        return response
+
+
+def generate_one(client: genai.Client, prompt: str, index: int, model: str, size: str = "2K", use_cache: bool = True,
+                 stats: RunStats | None = None, deadline: float | None = JOB_DEADLINE) -> list[str]:
     """Generate image for a single prompt. Returns list of saved file paths."""
+    return generate_task(client, prompt, index, model, size, use_cache, stats, deadline)[0]
+
+
+def generate_task(client: genai.Client, prompt: str, index: int, model: str, size: str = "2K", use_cache: bool = True,
+                  stats: RunStats | None = None, deadline: float | None = JOB_DEADLINE) -> tuple[list[str], str | None]:
+    """Generate image for a single prompt. Returns (saved file paths, error).
+
+    With ``use_cache``, identical earlier requests are served from the result
+    cache and identical concurrent ones wait for the first to finish.
+    ``deadline`` is in seconds from the model call's start (None or 0: no limit).
+    """
+    key = cache_key(model, prompt, ASPECT_RATIO, size)
+    if not use_cache:
+        return _generate_uncached(client, prompt, index, model, size, None, stats, deadline)
+
+    cached = result_cache.get(key)
+    if cached is not None:
+        print(f"  [{index}] Cached: {prompt[:80]}...")
+        return [str(OUTPUT_DIR / f) for f in cached], None
+
+    future: Future = Future()
+    existing = in_flight.claim(key, future)
+    if existing is not None:
+        print(f"  [{index}] Waiting on identical in-flight request: {prompt[:80]}...")
+        return existing.result()
+    outcome: tuple[list[str], str | None] = ([], None)
+    try:
+        outcome = _generate_uncached(client, prompt, index, model, size, key, stats, deadline)
+    finally:
+        future.set_result(outcome)
+        in_flight.release(key)
+    return outcome
+
+
+def _generate_uncached(client: genai.Client, prompt: str, index: int, model: str, size: str, key: str | None,
+                       stats: RunStats | None = None, deadline: float | None = None) -> tuple[list[str], str | None]:
     saved = []
-    slug = slugify(prompt)
+    error = None
+    # the task id tells apart prompts that share a truncated slug; the run id keeps a
+    # --fresh rerun of the same prompt from overwriting the earlier variation
+    stem = f"{slugify(prompt)}_{task_id(model, prompt, ASPECT_RATIO, size)[:8]}_{uuid.uuid4().hex[:8]}"
 
     print(f"  [{index}] Generating ({size}): {prompt[:80]}...")
 
     try:
-        response = client.models.generate_content(
-            model=model,
-            contents=prompt,
-            config=types.GenerateContentConfig(
-                response_modalities=["IMAGE"],
-                image_config=types.ImageConfig(
-                    aspect_ratio=ASPECT_RATIO,
-                    image_size=size,
-                ),
-            ),
-        )
+        with span("calling_model", size=size):
+            response = call_model(client, model, prompt, ASPECT_RATIO, size, f"[{index}] ", stats, deadline_in(deadline))
 
+        meta = image_meta.record(prompt, model, ASPECT_RATIO, size)
         img_count = 0
-        for part in response.parts:
-            if part.inline_data is not None:
-                image = part.as_image()
-                filename = f"{slug}_{img_count}.png"
-                filepath = OUTPUT_DIR / filename
-                image.save(str(filepath))
-                saved.append(str(filepath))
-                print(f"  [{index}] Saved: {filename}")
-                img_count += 1
+        with span("saving"):
+            for part in response.parts:
+                if part.inline_data is not None:
+                    filepath = write_image(part.inline_data.data, part.inline_data.mime_type, f"{stem}_{img_count}",
+                                           metadata=meta)
+                    saved.append(str(filepath))
+                    print(f"  [{index}] Saved: {filepath.name}")
+                    img_count += 1
 
         if img_count == 0:
             # Check if there was text instead (sometimes model responds with text)
-            for part in response.parts:
-                if part.text is not None:
-                    print(f"  [{index}] Model returned text instead: {part.text[:120]}")
+            text = "".join(part.text for part in response.parts if part.text is not None)
+            error = text or "No image returned"
+            metrics.results.inc(outcome="text_only")
+            print(f"  [{index}] Model returned text instead: {error[:120]}")
+        else:
+            metrics.results.inc(outcome="success")
+
+        if key:
+            result_cache.put(key, [Path(p).name for p in saved])
 
     except Exception as e:
+        error = str(e)
+        metrics.record_error(e)
         print(f"  [{index}] Error: {e}")
 
-    return saved
+    return saved, error
+
 
+def run_parallel(client: genai.Client, prompts: list[str], model: str, size: str = "2K", use_cache: bool = True,
+                 concurrency: int = DEFAULT_CONCURRENCY, manifest: Manifest | None = None, resume: bool = False,
+                 deadline: float | None = JOB_DEADLINE):
+    """Run all prompts in parallel using threads, collecting results as they finish.
 
-def run_parallel(client: genai.Client, prompts: list[str], model: str, size: str = "2K"):
-    """Run all prompts in parallel using threads."""
-    print(f"\nGenerating {len(prompts)} prompts")
+    Each finished prompt is appended to ``manifest``; with ``resume``, prompts
+    the manifest already records as done are skipped.
+    """
+    tasks = list(enumerate(prompts))
+    if manifest and resume:
+        completed = manifest.completed()
+        tasks = [(i, p) for i, p in tasks if task_id(model, p, ASPECT_RATIO, size) not in completed]
+        print(f"\nResuming from {manifest.path}: {len(prompts) - len(tasks)} already done")
+
+    print(f"\nGenerating {len(tasks)} prompts")
     print(f"Model: {model}")
     print(f"Resolution: {size}")
     print(f"Aspect ratio: {ASPECT_RATIO}")
+    print(f"Concurrency: {concurrency}")
     print(f"Output: {OUTPUT_DIR}\n")
 
-    all_saved = []
-    with ThreadPoolExecutor(max_workers=4) as executor:
-        futures = {
-            executor.submit(generate_one, client, p, i, model, size): i
-            for i, p in enumerate(prompts)
-        }
-        for future in futures:
-            result = future.result()
-            all_saved.extend(result)
+    stats = RunStats()
+    rate_limiter.burst = concurrency
+
+    def run(i: int, prompt: str) -> tuple[list[str], str | None]:
+        start = time.monotonic()
+        with span("prompt", index=i, size=size):
+            saved, error = generate_task(client, prompt, i, model, size, use_cache, stats, deadline)
+        if manifest:
+            manifest.append(task_id(model, prompt, ASPECT_RATIO, size), prompt=prompt, model=model,
+                            aspect_ratio=ASPECT_RATIO, size=size, files=[Path(f).name for f in saved],
+                            latency=time.monotonic() - start, error=error)
+        return saved, error
 
+    all_saved = []
+    executor = ThreadPoolExecutor(max_workers=concurrency)
+    try:
+        futures = {executor.submit(run, i, p): i for i, p in tasks}
+        for done, future in enumerate(as_completed(futures), start=1):
+            saved, _ = future.result()
+            stats.record_result(bool(saved))
+            all_saved.extend(saved)
+            print(f"  [{futures[future]}] Finished ({done}/{len(futures)})")
+    except KeyboardInterrupt:
+        print("\nInterrupted — finishing in-flight prompts, dropping the rest (use --resume to continue)")
+        executor.shutdown(wait=True, cancel_futures=True)
+        raise
+    executor.shutdown()
+
+    conn = clients.stats()
     print(f"\nDone. {len(all_saved)} images saved to {OUTPUT_DIR}/")
+    print(stats.summary())
+    print(f"HTTP: {conn['requests']} requests, {conn['reused_connections']} on reused connections")
 
 
 def main():
@@ -140,24 +354,40 @@ def main():
     parser.add_argument("--prompt", type=str, help="Run a custom prompt")
     parser.add_argument("--model", type=str, default=DEFAULT_MODEL, help=f"Model (default: {DEFAULT_MODEL})")
     parser.add_argument("--size", type=str, default=DEFAULT_SIZE, choices=["1K", "2K", "4K"], help="Resolution (default: 2K)")
+    parser.add_argument("--fresh", action="store_true", help="Skip the result cache and generate new variations")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY, help=f"Parallel requests (default: {DEFAULT_CONCURRENCY})")
+    parser.add_argument("--manifest", type=Path, default=DEFAULT_MANIFEST, help="Run manifest (JSONL) to record results in")
+    parser.add_argument("--resume", action="store_true", help="Skip prompts the manifest records as done")
+    parser.add_argument("--metrics", type=str, metavar="FILE", help="Dump metrics at the end: a file (Prometheus text) or - for a summary")
+    parser.add_argument("--deadline", type=float, default=JOB_DEADLINE, help=f"Seconds per prompt, retries included (default: {JOB_DEADLINE:g}, 0 = none)")
+    parser.add_argument("--hedge", type=float, metavar="P", default=hedger.percentile, help="Hedge model calls slower than this latency percentile (default: off)")
+    parser.add_argument("--trace", type=Path, metavar="FILE", help="Append a trace of every job stage to FILE (see tracing.py)")
     args = parser.parse_args()
+    hedger.percentile = args.hedge
+    if args.trace:
+        tracer.enable(args.trace)
 
     api_key = os.getenv("GOOGLE_API_KEY")
-    if not api_key or api_key == "your-key-here":
+    if clients.needs_api_key and (not api_key or api_key == "your-key-here"):
         print("Set your GOOGLE_API_KEY in image_gen/.env")
         sys.exit(1)
 
-    client = genai.Client(api_key=api_key)
+    client = clients.get(api_key)
 
     if args.prompt:
-        generate_one(client, args.prompt, 99, args.model, args.size)
+        generate_one(client, args.prompt, 99, args.model, args.size, not args.fresh, deadline=args.deadline)
     elif args.index is not None:
         if 0 <= args.index < len(PROMPTS):
-            generate_one(client, PROMPTS[args.index], args.index, args.model, args.size)
+            generate_one(client, PROMPTS[args.index], args.index, args.model, args.size, not args.fresh,
+                         deadline=args.deadline)
         else:
             print(f"Index {args.index} out of range (0-{len(PROMPTS) - 1})")
     else:
-        run_parallel(client, PROMPTS, args.model, args.size)
+        run_parallel(client, PROMPTS, args.model, args.size, not args.fresh, args.concurrency,
+                     Manifest(args.manifest), args.resume, args.deadline)
+
+    if args.metrics:
+        metrics.dump(args.metrics)
 
 
 if __name__ == "__main__":
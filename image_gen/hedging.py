@@ -0,0 +1,214 @@
+"""
+Deadlines and hedged requests for model calls.
+
+A deadline bounds the time one job may spend on its model call, retries
+included. Every request is sent with the time still remaining as its HTTP
+timeout, so a hung upstream call is aborted instead of holding a worker
+forever, and the job fails with ``DeadlineExceeded``.
+
+Hedging trims the latency tail. When a call has been running longer than a
+chosen percentile of recent call latencies for its image size, an identical
+second request is sent, and whichever finishes first is used. The other one
+is dropped: cancelled in asyncio code; in threads, its result is discarded
+when it returns, which happens within the same deadline. A hedged call
+with no deadline gets IMAGE_GEN_HEDGE_TIMEOUT as one, so a hung request
+can't hold a hedge thread forever. A budget caps hedges relative to first
+attempts, so hedging can't double quota use.
+
+    IMAGE_GEN_JOB_DEADLINE       seconds per job for model calls, retries included  (default 300, 0 = none)
+    IMAGE_GEN_HEDGE_PERCENTILE   hedge calls slower than this percentile, e.g. 95  (default 0 = off)
+    IMAGE_GEN_HEDGE_BUDGET       hedges allowed per first attempt                   (default 0.1)
+    IMAGE_GEN_HEDGE_MIN_SAMPLES  latencies recorded before hedging starts           (default 20)
+    IMAGE_GEN_HEDGE_TIMEOUT      deadline for hedged calls that have none, seconds  (default 600)
+"""
+
+import asyncio
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Awaitable, Callable, TypeVar
+
+from config import env_float, env_int
+import metrics
+from rate_limit import RetryBudget
+from tracing import span
+
+JOB_DEADLINE = env_float("IMAGE_GEN_JOB_DEADLINE", 300.0)
+HEDGE_PERCENTILE = env_float("IMAGE_GEN_HEDGE_PERCENTILE", 0.0)
+HEDGE_BUDGET = env_float("IMAGE_GEN_HEDGE_BUDGET", 0.1)
+HEDGE_MIN_SAMPLES = env_int("IMAGE_GEN_HEDGE_MIN_SAMPLES", 20)
+HEDGE_TIMEOUT = env_float("IMAGE_GEN_HEDGE_TIMEOUT", 600.0)
+HISTORY_SIZE = 500  # latencies kept per image size
+
+T = TypeVar("T")
+
+
+class DeadlineExceeded(TimeoutError):
+    """A job ran out of time for its model call(s)."""
+
+
+def deadline_in(seconds: float | None) -> float | None:
+    """Monotonic deadline ``seconds`` from now; None or 0 means no deadline."""
+    return time.monotonic() + seconds if seconds else None
+
+
+def remaining(deadline: float | None) -> float | None:
+    """Seconds left before ``deadline`` (None: unbounded). Raises DeadlineExceeded once it has passed."""
+    if deadline is None:
+        return None
+    left = deadline - time.monotonic()
+    if left <= 0:
+        raise DeadlineExceeded("Deadline exceeded waiting for the model")
+    return left
+
+
+def _wait_time(deadline: float | None, cap: float | None = None) -> float | None:
+    """How long to block: until ``deadline``, but at most ``cap``."""
+    left = None if deadline is None else max(0.0, deadline - time.monotonic())
+    if cap is None:
+        return left
+    return cap if left is None else min(cap, left)
+
+
+class LatencyHistory:
+    """Recent successful call latencies, per key (image size)."""
+
+    def __init__(self, size: int = HISTORY_SIZE):
+        self.size = size
+        self._lock = threading.Lock()
+        self._samples: dict[str, deque[float]] = {}
+
+    def record(self, key: str, seconds: float):
+        with self._lock:
+            self._samples.setdefault(key, deque(maxlen=self.size)).append(seconds)
+
+    def percentile(self, key: str, p: float, min_samples: int = 1) -> float | None:
+        with self._lock:
+            samples = list(self._samples.get(key, ()))
+        if len(samples) < max(1, min_samples):
+            return None
+        return metrics.percentile(samples, p)
+
+
+class Hedger:
+    def __init__(self, percentile: float = HEDGE_PERCENTILE, budget: float = HEDGE_BUDGET,
+                 min_samples: int = HEDGE_MIN_SAMPLES, history: LatencyHistory | None = None):
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.budget = RetryBudget(ratio=budget, min_retries=0)
+        self.history = history or LatencyHistory()
+        self._pool: ThreadPoolExecutor | None = None
+        self._lock = threading.Lock()
+
+    def hedge_delay(self, key: str) -> float | None:
+        """How long a call may run before it is hedged, or None if hedging is off or there's too little history."""
+        if not self.percentile:
+            return None
+        return self.history.percentile(key, self.percentile, self.min_samples)
+
+    def _get_pool(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(max_workers=64, thread_name_prefix="hedge")
+            return self._pool
+
+    def _timed(self, fn: Callable[[float | None], T], key: str, deadline: float | None,
+               before: Callable[[], None] | None = None) -> T:
+        if before is not None:
+            before()
+        timeout = remaining(deadline)
+        start = time.monotonic()
+        with span("model_request", "model", size=key, hedge=before is not None):
+            result = fn(timeout)
+        self.history.record(key, time.monotonic() - start)
+        return result
+
+    def call(self, fn: Callable[[float | None], T], key: str, deadline: float | None = None,
+             before_hedge: Callable[[], None] | None = None) -> T:
+        """Run ``fn(timeout)`` — one request, given its HTTP timeout in seconds — within ``deadline``.
+
+        ``key`` groups latencies (the image size). ``before_hedge`` runs before
+        a hedge request is sent, e.g. to take a rate-limiter token.
+        """
+        self.budget.record_attempt()
+        delay = self.hedge_delay(key)
+        try:
+            if delay is None:
+                return self._timed(fn, key, deadline)
+            return self._hedged(fn, key, deadline, delay, before_hedge)
+        except DeadlineExceeded:
+            raise
+        except Exception as e:
+            if deadline is not None and time.monotonic() >= deadline:
+                raise DeadlineExceeded("Deadline exceeded waiting for the model") from e
+            raise
+
+    def _hedged(self, fn, key: str, deadline: float | None, delay: float, before_hedge) -> T:
+        # the losing request keeps its thread until it returns: make sure it does
+        deadline = deadline or deadline_in(HEDGE_TIMEOUT)
+        pool = self._get_pool()
+        primary = pool.submit(self._timed, fn, key, deadline)
+        futures = [primary]
+        done, _ = wait(futures, timeout=_wait_time(deadline, delay))
+        if not done and (deadline is None or time.monotonic() < deadline) and self.budget.try_spend():
+            metrics.model_hedges.inc(outcome="sent")
+            futures.append(pool.submit(self._timed, fn, key, deadline, before_hedge))
+
+        pending, error = set(futures), None
+        while pending:
+            done, pending = wait(pending, timeout=_wait_time(deadline), return_when=FIRST_COMPLETED)
+            if not done:
+                raise DeadlineExceeded("Deadline exceeded waiting for the model")
+            for future in done:
+                if future.exception() is None:
+                    if future is not primary:
+                        metrics.model_hedges.inc(outcome="won")
+                    return future.result()
+                error = error or future.exception()
+        raise error
+
+    async def call_async(self, fn: Callable[[float | None], Awaitable[T]], key: str, deadline: float | None = None,
+                         before_hedge: Callable[[], Awaitable[None]] | None = None) -> T:
+        """Async counterpart of ``call``; the losing request is cancelled."""
+        self.budget.record_attempt()
+        delay = self.hedge_delay(key)
+
+        async def timed(before=None) -> T:
+            if before is not None:
+                await before()
+            timeout = remaining(deadline)
+            start = time.monotonic()
+            result = await fn(timeout)
+            self.history.record(key, time.monotonic() - start)
+            return result
+
+        primary = asyncio.ensure_future(timed())
+        tasks = [primary]
+        try:
+            if delay is not None:
+                done, _ = await asyncio.wait(tasks, timeout=_wait_time(deadline, delay))
+                if not done and (deadline is None or time.monotonic() < deadline) and self.budget.try_spend():
+                    metrics.model_hedges.inc(outcome="sent")
+                    tasks.append(asyncio.ensure_future(timed(before_hedge)))
+
+            pending, error = set(tasks), None
+            while pending:
+                done, pending = await asyncio.wait(pending, timeout=_wait_time(deadline), return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    raise DeadlineExceeded("Deadline exceeded waiting for the model")
+                for task in done:
+                    if task.exception() is None:
+                        if task is not primary:
+                            metrics.model_hedges.inc(outcome="won")
+                        return task.result()
+                    error = error or task.exception()
+            if deadline is not None and time.monotonic() >= deadline and not isinstance(error, DeadlineExceeded):
+                raise DeadlineExceeded("Deadline exceeded waiting for the model") from error
+            raise error
+        finally:
+            for task in tasks:
+                task.cancel()
+
+
+hedger = Hedger()
@@ -0,0 +1,62 @@
+"""
+Generation metadata embedded in output files.
+
+Every output carries a small JSON record (prompt, model, aspect ratio, size,
+reference ids, creation time), so the history can be rebuilt from the files
+alone — see ``python3 gallery_index.py --backfill``. PNGs, which are written
+exactly as the model returned them, get the record as an iTXt chunk spliced
+in after the header. That needs no decode or re-encode. Re-encoded WebP,
+AVIF and JPEG outputs carry it in the EXIF ImageDescription tag.
+"""
+
+import json
+import struct
+import time
+import zlib
+
+META_KEY = "image_gen"
+EXIF_IMAGE_DESCRIPTION = 0x010E
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+_IHDR_END = len(PNG_SIGNATURE) + 4 + 4 + 13 + 4  # length, type, data, crc
+
+
+def record(prompt: str, model: str, aspect_ratio: str, size: str, ref_ids: list[str] | None = None, **extra) -> dict:
+    return dict(prompt=prompt, model=model, aspect_ratio=aspect_ratio, size=size,
+                ref_ids=list(ref_ids or []), created=time.time(), **extra)
+
+
+def embed_png(data: bytes, meta: dict) -> bytes:
+    """Return PNG bytes with ``meta`` added as an iTXt chunk; non-PNG data is returned unchanged."""
+    if not data.startswith(PNG_SIGNATURE) or data[12:16] != b"IHDR":
+        return data
+    # keyword, null, compression flag + method, empty language tag and translated keyword, UTF-8 text
+    body = META_KEY.encode("latin-1") + b"\0\0\0\0\0" + json.dumps(meta).encode("utf-8")
+    chunk = struct.pack(">I", len(body)) + b"iTXt" + body + struct.pack(">I", zlib.crc32(b"iTXt" + body))
+    return data[:_IHDR_END] + chunk + data[_IHDR_END:]
+
+
+def exif_bytes(meta: dict) -> bytes:
+    """EXIF block carrying ``meta`` for encoders that take ``exif=``."""
+    from PIL import Image
+
+    exif = Image.Exif()
+    exif[EXIF_IMAGE_DESCRIPTION] = json.dumps(meta)  # ensure_ascii keeps it valid EXIF ASCII
+    return exif.tobytes()
+
+
+def from_image(img) -> dict | None:
+    """Read the record from an opened PIL image, or None if it has none."""
+    raw = img.info.get(META_KEY)
+    if raw is None:
+        try:
+            raw = img.getexif().get(EXIF_IMAGE_DESCRIPTION)
+        except Exception:
+            raw = None
+    if not raw:
+        return None
+    try:
+        meta = json.loads(raw)
+    except (TypeError, ValueError):
+        return None
+    return meta if isinstance(meta, dict) and "prompt" in meta else None
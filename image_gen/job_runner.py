@@ -0,0 +1,129 @@
+"""
+Runs one app generation job: model call, saving, indexing and status updates.
+
+Shared by the Flask app (jobs run on its in-process scheduler threads) and
+by worker.py (jobs claimed from the shared queue in production mode), so a
+job behaves the same wherever it runs.
+"""
+
+import time
+
+from google import genai
+
+from config import DEFAULT_MODEL
+from gallery_index import GalleryIndex
+from genai_client import ClientManager
+from generate import generation_config, result_cache, slugify
+from hedging import JOB_DEADLINE, DeadlineExceeded, deadline_in, hedger
+import image_meta
+from job_store import STAGE_CALLING_MODEL, STAGE_SAVING, JobStore
+import metrics
+from output_writer import write_image
+import refs
+from result_cache import InFlight
+from thumbs import build_thumbnail
+from tracing import span, tracer
+
+
+class JobRunner:
+    def __init__(self, jobs: JobStore, gallery_index: GalleryIndex, in_flight: InFlight | None = None):
+        self.jobs = jobs
+        self.gallery_index = gallery_index
+        self.in_flight = in_flight
+
+    def run_leased(self, clients: ClientManager, job_id: str, prompt: str, aspect_ratio: str,
+                   ref_ids: list[str] | None = None, key: str | None = None, submitted: float | None = None,
+                   size: str = "4K"):
+        """``run`` on the shared client, leased for the whole job so a key change can't close it mid-call."""
+        try:
+            client = clients.acquire()
+        except RuntimeError as e:  # no API key any more
+            metrics.record_error(e)
+            self.jobs.update(job_id, status="error", error=str(e))
+            if key and self.in_flight is not None:
+                self.in_flight.release(key)
+            return
+        try:
+            self.run(client, job_id, prompt, aspect_ratio, ref_ids, key, submitted, size)
+        finally:
+            clients.release(client)
+
+    def run(self, client: genai.Client, job_id: str, prompt: str, aspect_ratio: str, ref_ids: list[str] | None = None,
+            key: str | None = None, submitted: float | None = None, size: str = "4K"):
+        """Generate one job's images at ``size`` and update its status. ``submitted`` is a time.time() stamp.
+
+        The model call gets JOB_DEADLINE seconds from when the job starts
+        running; past that the job fails instead of holding its worker.
+        """
+        jobs = self.jobs
+        if submitted is not None:
+            now = time.time()
+            metrics.job_stage_seconds.observe(max(0.0, now - submitted), stage="queued")
+            tracer.complete("queued", submitted, now, job_id=job_id)
+        deadline = deadline_in(JOB_DEADLINE)
+        try:
+            jobs.update(job_id, stage=STAGE_CALLING_MODEL)
+            contents: list = [prompt]
+            # processed refs are loaded only now, so queued jobs don't hold image bytes
+            contents.extend(refs.load_part(ref_id) for ref_id in ref_ids or [])
+
+            def request(timeout: float | None):
+                with metrics.model_calls_in_flight.track(), metrics.model_call_seconds.time(size=size):
+                    return client.models.generate_content(
+                        model=DEFAULT_MODEL,
+                        contents=contents,
+                        config=generation_config(aspect_ratio, size, timeout),
+                    )
+
+            with metrics.job_stage_seconds.time(stage=STAGE_CALLING_MODEL), \
+                    span(STAGE_CALLING_MODEL, job_id=job_id, size=size):
+                response = hedger.call(request, size, deadline)
+
+            jobs.update(job_id, stage=STAGE_SAVING)
+            saving_started = time.monotonic()
+            saved = []
+            slug = slugify(prompt)
+            meta = image_meta.record(prompt, DEFAULT_MODEL, aspect_ratio, size, ref_ids, job_id=job_id)
+            img_count = 0
+            with span(STAGE_SAVING, job_id=job_id):
+                for part in response.parts:
+                    if part.inline_data is not None:
+                        filename = write_image(part.inline_data.data, part.inline_data.mime_type, f"{slug}_{job_id[:8]}_{img_count}",
+                                               metadata=meta).name
+                        # the thumbnail decode also yields the dHash, so indexing reads only the header
+                        hash_value = None
+                        try:
+                            with span("thumbnail", "io"):
+                                _, hash_value = build_thumbnail(filename)
+                        except Exception as e:
+                            print(f"Thumbnail failed for {filename}: {e}")
+                        with span("index", "io"):
+                            self.gallery_index.add(filename, prompt=prompt, aspect_ratio=aspect_ratio, size=size,
+                                                   created=meta["created"], model=DEFAULT_MODEL, ref_ids=ref_ids,
+                                                   compute_hash=hash_value is None, hash_value=hash_value)
+                        saved.append(filename)
+                        img_count += 1
+
+            if not saved:
+                text_resp = ""
+                for part in response.parts:
+                    if part.text is not None:
+                        text_resp += part.text
+                metrics.results.inc(outcome="text_only")
+                jobs.update(job_id, status="error", error=text_resp or "No image returned")
+            else:
+                if key:
+                    result_cache.put(key, saved)
+                metrics.job_stage_seconds.observe(time.monotonic() - saving_started, stage=STAGE_SAVING)
+                metrics.results.inc(outcome="success")
+                jobs.update(job_id, status="done", images=saved)
+
+        except DeadlineExceeded as e:
+            metrics.record_error(e)
+            jobs.update(job_id, status="error", error=f"Timed out after {JOB_DEADLINE:g}s waiting for the model")
+        except Exception as e:
+            metrics.record_error(e)
+            jobs.update(job_id, status="error", error=str(e))
+        finally:
+            if key and self.in_flight is not None:
+                self.in_flight.release(key)
@@ -0,0 +1,355 @@
+"""
+Job records for the Flask app, with eviction and optional persistence.
+
+Records are compact slotted dataclasses holding only what /status reports —
+reference images and other job inputs live with the scheduled callable and
+are dropped once it runs. Finished jobs are evicted after a TTL and whenever
+the store grows past a count limit, oldest first. Fan-out children are
+evicted with their parent, never before it, so the parent keeps its images.
+
+Every change is published on an optional EventBus as a ``job`` event, so
+/events streams can push it to browsers as it happens.
+
+A fan-out submission is a parent job whose ``children`` are ordinary jobs.
+Whenever a child changes, the parent is re-derived from its children (see
+``rollup``): its ``images`` grow as each child finishes, so clients see
+partial results, and it finishes once every child has.
+
+With persistence on, every change is also written to a SQLite file so
+/status keeps working across restarts. Jobs that were still pending when
+the previous process died are marked failed on startup.
+
+``SharedJobStore`` is the production-mode variant: job state lives only in
+SQLite (WAL), so any web worker can create or report on any job and
+generator worker processes can update it. Each web process relays changes
+to its own EventBus with ``publish_changes``.
+
+    IMAGE_GEN_JOB_TTL      seconds to keep finished jobs (default 24h)
+    IMAGE_GEN_MAX_JOBS     max finished jobs kept        (default 500)
+    IMAGE_GEN_PERSIST_JOBS 1 to persist to outputs/.state/jobs.db (default 1)
+"""
+
+import contextlib
+import dataclasses
+import json
+import os
+import threading
+import time
+from dataclasses import dataclass, field
+
+from config import env_float, env_int
+from db import STATE_DIR, connect
+from events import EventBus
+
+DB_PATH = STATE_DIR / "jobs.db"
+SHARED_DB_PATH = STATE_DIR / "shared_jobs.db"
+JOB_TTL = env_float("IMAGE_GEN_JOB_TTL", 24 * 3600)
+MAX_JOBS = env_int("IMAGE_GEN_MAX_JOBS", 500)
+PERSIST_JOBS = os.getenv("IMAGE_GEN_PERSIST_JOBS", "1") == "1"
+
+FINISHED = ("done", "error", "cancelled")
+
+# Progress stages reported alongside status while a job is pending
+STAGE_QUEUED = "queued"
+STAGE_CALLING_MODEL = "calling_model"
+STAGE_SAVING = "saving"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    data TEXT NOT NULL,
+    finished REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_finished ON jobs (finished);
+"""
+
+_SHARED_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    data TEXT NOT NULL,
+    finished REAL,
+    version INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_finished ON jobs (finished);
+CREATE INDEX IF NOT EXISTS jobs_version ON jobs (version);
+CREATE TABLE IF NOT EXISTS meta (id INTEGER PRIMARY KEY CHECK (id = 0), version INTEGER NOT NULL);
+INSERT OR IGNORE INTO meta VALUES (0, 0);
+"""
+
+
+@dataclass(slots=True)
+class Job:
+    id: str
+    prompt: str
+    aspect_ratio: str
+    size: str = "4K"
+    status: str = "pending"
+    stage: str = STAGE_QUEUED
+    images: list[str] = field(default_factory=list)
+    error: str | None = None
+    cached: bool = False
+    ref_ids: list[str] = field(default_factory=list)
+    created: float = field(default_factory=time.time)
+    finished: float | None = None
+    parent: str | None = None
+    children: list[str] = field(default_factory=list)
+    completed: int = 0  # fan-out parents: children finished so far
+    draft: str | None = None  # finalize jobs: the preview output they upscale
+
+    def to_dict(self) -> dict:
+        d = dataclasses.asdict(self)
+        del d["id"], d["created"], d["finished"]
+        if self.parent is None:
+            del d["parent"]
+        if not self.children:
+            del d["children"], d["completed"]
+        if self.draft is None:
+            del d["draft"]
+        return d
+
+
+def _settle(job: Job):
+    """Stamp a job that just reached a final status."""
+    if job.status in FINISHED:
+        job.stage = job.status
+        if job.finished is None:
+            job.finished = time.time()
+
+
+def rollup(parent: Job, children: list[Job | None]):
+    """Derive a fan-out parent's status and partial results from its children.
+
+    Children that were already evicted (None) count as finished without images.
+    """
+    live = [c for c in children if c is not None]
+    running = [c for c in live if c.status not in FINISHED]
+    done = [c for c in live if c.status == "done"]
+    parent.images = [image for c in done for image in c.images]
+    parent.completed = len(children) - len(running)
+    if running:
+        parent.status = "pending"
+        parent.stage = STAGE_QUEUED if all(c.stage == STAGE_QUEUED for c in running) else STAGE_CALLING_MODEL
+    elif done:
+        parent.status, parent.error = "done", None
+    elif live and all(c.status == "cancelled" for c in live):
+        parent.status, parent.error = "cancelled", None
+    else:
+        parent.status = "error"
+        parent.error = next((c.error for c in live if c.error), "All variants failed")
+    _settle(parent)
+
+
+class JobStore:
+    def __init__(self, ttl: float = JOB_TTL, max_jobs: int = MAX_JOBS, db_path=DB_PATH if PERSIST_JOBS else None,
+                 bus: EventBus | None = None):
+        self.ttl = ttl
+        self.max_jobs = max_jobs
+        self.db_path = db_path
+        self.bus = bus
+        self._lock = threading.Lock()
+        self._jobs: dict[str, Job] = {}
+        if db_path is not None:
+            self._db().executescript(_SCHEMA)
+            self._load()
+
+    def _db(self):
+        return connect(self.db_path)
+
+    def _load(self):
+        """Restore persisted jobs, failing any that were interrupted mid-flight."""
+        cutoff = time.time() - self.ttl
+        self._db().execute("DELETE FROM jobs WHERE finished < ?", (cutoff,))
+        for row in self._db().execute("SELECT data FROM jobs"):
+            job = Job(**json.loads(row["data"]))
+            if job.status not in FINISHED:
+                job.status = "error"
+                job.error = "Interrupted by a server restart"
+                job.finished = time.time()
+                self._save(job)
+            self._jobs[job.id] = job
+
+    def _publish(self, job_id: str, snapshot: dict):
+        if self.bus is not None:
+            self.bus.publish("job", dict(snapshot, job_id=job_id))
+
+    def _save(self, job: Job):
+        if self.db_path is not None:
+            self._db().execute(
+                "INSERT OR REPLACE INTO jobs VALUES (?, ?, ?)",
+                (job.id, json.dumps(dataclasses.asdict(job)), job.finished),
+            )
+
+    def create(self, job_id: str, prompt: str, aspect_ratio: str, **fields) -> Job:
+        job = Job(id=job_id, prompt=prompt, aspect_ratio=aspect_ratio, **fields)
+        if job.status in FINISHED:
+            job.stage = job.status
+            job.finished = job.created
+        with self._lock:
+            self._jobs[job_id] = job
+            self._save(job)
+            self._evict()
+            snapshot = job.to_dict()
+        self._publish(job_id, snapshot)
+        return job
+
+    def update(self, job_id: str, **fields):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return
+            for name, value in fields.items():
+                setattr(job, name, value)
+            _settle(job)
+            self._save(job)
+            snapshot = job.to_dict()
+            parent = self._jobs.get(job.parent) if job.parent else None
+            if parent is not None:
+                rollup(parent, [self._jobs.get(c) for c in parent.children])
+                self._save(parent)
+                parent_snapshot = parent.to_dict()
+        self._publish(job_id, snapshot)
+        if parent is not None:
+            self._publish(parent.id, parent_snapshot)
+
+    def get(self, job_id: str) -> dict | None:
+        """Snapshot of the job as returned by /status, or None if unknown."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return job.to_dict() if job else None
+
+    def delete(self, job_id: str):
+        with self._lock:
+            self._jobs.pop(job_id, None)
+            if self.db_path is not None:
+                self._db().execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+
+    def __len__(self) -> int:
+        return len(self._jobs)
+
+    def _evict(self):
+        """Drop finished jobs past the TTL, then the oldest beyond ``max_jobs``. Caller holds the lock.
+
+        Children of a live parent are left alone; they go when the parent does.
+        """
+        now = time.time()
+        finished = sorted((j for j in self._jobs.values() if j.finished is not None and j.parent not in self._jobs),
+                          key=lambda j: j.finished)
+        excess = len(finished) - self.max_jobs
+        stale = [j for i, j in enumerate(finished) if i < excess or now - j.finished > self.ttl]
+        ids = [job_id for j in stale for job_id in (j.id, *j.children)]
+        for job_id in ids:
+            self._jobs.pop(job_id, None)
+        if ids and self.db_path is not None:
+            self._db().executemany("DELETE FROM jobs WHERE id = ?", [(job_id,) for job_id in ids])
+
+
+class SharedJobStore:
+    """JobStore interface backed only by SQLite, safe to share between processes.
+
+    Every write bumps a store-wide ``version`` counter (never reused, even
+    when rows are deleted), so ``publish_changes`` can find what changed
+    since it last looked with one indexed query.
+    """
+
+    def __init__(self, ttl: float = JOB_TTL, max_jobs: int = MAX_JOBS, db_path=SHARED_DB_PATH):
+        self.ttl = ttl
+        self.max_jobs = max_jobs
+        self.db_path = db_path
+        self._db().executescript(_SHARED_SCHEMA)
+        self._seen_version = self._db().execute("SELECT version FROM meta").fetchone()[0]
+
+    def _db(self):
+        return connect(self.db_path)
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        db = self._db()
+        # IMMEDIATE takes the write lock up front, so read-modify-write can't interleave
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            yield db
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+
+    def _save(self, job: Job):
+        """Write a job under a new version. Caller holds a transaction."""
+        db = self._db()
+        version = db.execute("UPDATE meta SET version = version + 1 RETURNING version").fetchone()[0]
+        db.execute(
+            "INSERT OR REPLACE INTO jobs VALUES (?, ?, ?, ?)",
+            (job.id, json.dumps(dataclasses.asdict(job)), job.finished, version),
+        )
+
+    def _load_job(self, job_id: str) -> Job | None:
+        row = self._db().execute("SELECT data FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return Job(**json.loads(row["data"])) if row else None
+
+    def create(self, job_id: str, prompt: str, aspect_ratio: str, **fields) -> Job:
+        job = Job(id=job_id, prompt=prompt, aspect_ratio=aspect_ratio, **fields)
+        if job.status in FINISHED:
+            job.stage = job.status
+            job.finished = job.created
+        with self._transaction():
+            self._save(job)
+        self._evict()
+        return job
+
+    def update(self, job_id: str, **fields):
+        with self._transaction():
+            job = self._load_job(job_id)
+            if job is None:
+                return
+            for name, value in fields.items():
+                setattr(job, name, value)
+            _settle(job)
+            self._save(job)
+            parent = self._load_job(job.parent) if job.parent else None
+            if parent is not None:
+                rollup(parent, [self._load_job(c) for c in parent.children])
+                self._save(parent)
+
+    def get(self, job_id: str) -> dict | None:
+        job = self._load_job(job_id)
+        return job.to_dict() if job else None
+
+    def delete(self, job_id: str):
+        self._db().execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+
+    def fail_pending(self, job_id: str, error: str):
+        """Mark a job failed unless it already finished (used when its worker dies)."""
+        job = self.get(job_id)
+        if job and job["status"] not in FINISHED:
+            self.update(job_id, status="error", error=error)
+
+    def __len__(self) -> int:
+        return self._db().execute("SELECT COUNT(*) FROM jobs").fetchone()[0]
+
+    def publish_changes(self, bus: EventBus) -> int:
+        """Publish a ``job`` event for every job changed since the last call. Returns the count."""
+        rows = self._db().execute(
+            "SELECT id, data, version FROM jobs WHERE version > ? ORDER BY version", (self._seen_version,)
+        ).fetchall()
+        for row in rows:
+            job = Job(**json.loads(row["data"]))
+            bus.publish("job", dict(job.to_dict(), job_id=job.id))
+            self._seen_version = row["version"]
+        return len(rows)
+
+    def _evict(self):
+        """Drop finished jobs past the TTL, then the oldest beyond ``max_jobs``; children go with their parent."""
+        # finished jobs that aren't children of a job still stored
+        roots = ("finished IS NOT NULL AND (json_extract(data, '$.parent') IS NULL "
+                 "OR json_extract(data, '$.parent') NOT IN (SELECT id FROM jobs))")
+        with self._transaction() as db:
+            rows = db.execute(
+                f"SELECT data FROM jobs WHERE {roots} AND (finished < ? OR id IN "
+                f"(SELECT id FROM jobs WHERE {roots} ORDER BY finished DESC LIMIT -1 OFFSET ?))",
+                (time.time() - self.ttl, self.max_jobs),
+            ).fetchall()
+            ids = []
+            for row in rows:
+                job = json.loads(row["data"])
+                ids += [job["id"], *job["children"]]
+            db.executemany("DELETE FROM jobs WHERE id = ?", [(job_id,) for job_id in ids])
@@ -0,0 +1,71 @@
+"""
+JSONL run manifest, so long sweeps can be resumed.
+
+Each finished task appends one line: its id, prompt and params, status
+(``done`` / ``error``), output files, latency and error. Lines are flushed
+as they are written, so a crash or Ctrl-C loses at most the tasks still in
+flight; a line torn by a crash is skipped on load, and the next append
+starts on a fresh line. On ``--resume`` the manifest is replayed (last line per task wins)
+and tasks that are done — with their files still on disk — are skipped.
+
+Task ids are content-based (model, prompt, aspect ratio, size), so the same
+manifest can be shared across runs and prompt lists.
+"""
+
+import json
+import os
+import threading
+import time
+from pathlib import Path
+
+from config import OUTPUT_DIR
+from result_cache import cache_key
+
+DEFAULT_MANIFEST = OUTPUT_DIR / "manifest.jsonl"
+
+
+def task_id(model: str, prompt: str, aspect_ratio: str, size: str) -> str:
+    return cache_key(model, prompt, aspect_ratio, size)[:12]
+
+
+class Manifest:
+    def __init__(self, path: Path = DEFAULT_MANIFEST):
+        self.path = Path(path)
+        self._lock = threading.Lock()
+
+    def load(self) -> dict[str, dict]:
+        """Latest record per task id. Skips lines that aren't a task record, e.g. one torn by a crash."""
+        records: dict[str, dict] = {}
+        if not self.path.exists():
+            return records
+        with open(self.path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                    records[record["task_id"]] = record
+                except (json.JSONDecodeError, KeyError, TypeError):
+                    continue
+        return records
+
+    def completed(self) -> set[str]:
+        """Ids of tasks that finished successfully and whose outputs still exist."""
+        return {
+            tid for tid, r in self.load().items()
+            if r.get("status") == "done" and all((OUTPUT_DIR / f).is_file() for f in r.get("files", []))
+        }
+
+    def append(self, tid: str, *, prompt: str, model: str, aspect_ratio: str, size: str,
+               files: list[str], latency: float, error: str | None = None):
+        record = dict(
+            task_id=tid, prompt=prompt, model=model, aspect_ratio=aspect_ratio, size=size,
+            status="error" if error or not files else "done",
+            files=files, latency=round(latency, 3), error=error, finished_at=time.time(),
+        )
+        line = json.dumps(record) + "\n"
+        with self._lock:
+            with open(self.path, "ab+") as f:
+                if f.seek(0, os.SEEK_END):
+                    f.seek(-1, os.SEEK_END)
+                    if f.read(1) != b"\n":
+                        line = "\n" + line  # don't glue this record onto a torn line
+                f.write(line.encode("utf-8"))
@@ -0,0 +1,451 @@
+"""
+In-process metrics in the Prometheus text exposition format.
+
+The Flask app serves them at ``/metrics``; the CLIs can dump them at the end
+of a run with ``--metrics FILE`` (``-`` for stdout). There are three kinds:
+counters, gauges (set directly, or read from a callback at scrape time) and
+histograms with fixed buckets. Each takes label values as keyword arguments:
+
+    metrics.model_call_seconds.observe(12.3, size="4K")
+    with metrics.codec_seconds.time(op="thumbnail"):
+        ...
+
+In production mode, model calls, encodes and disk writes happen in
+worker.py processes, and requests are spread over several web processes.
+Every one of them publishes a snapshot of its metrics to
+``outputs/.state/metrics.db`` every few seconds, and the web process that
+serves /metrics adds the others' snapshots to its own (``render_shared``).
+Counters and histograms are summed across every process that ever ran, so
+totals stay monotonic across restarts. Gauges count only processes that
+published recently, so a dead worker's in-flight calls don't linger.
+Callback gauges aren't published: they read state all processes share, so
+the scraping process reports them itself.
+
+    IMAGE_GEN_METRICS_INTERVAL  seconds between worker snapshots  (default 5)
+"""
+
+import contextlib
+import json
+import math
+import threading
+import time
+from typing import Callable, Iterator
+
+from google.genai import errors
+
+from config import env_float
+from db import STATE_DIR, connect
+
+LATENCY_BUCKETS = (0.5, 1, 2, 5, 10, 15, 20, 30, 45, 60, 90, 120, 180)
+FAST_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+
+LabelKey = tuple[tuple[str, str], ...]
+
+
+def _key(labels: dict) -> LabelKey:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(key: LabelKey, extra: dict | None = None) -> str:
+    pairs = list(key) + list((extra or {}).items())
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str):
+        self.name = name
+        self.help = help
+        self._lock = threading.Lock()
+
+    def samples(self) -> Iterator[tuple[str, LabelKey, float, dict | None]]:
+        raise NotImplementedError
+
+    def state(self) -> list:
+        """JSON-serializable values, for merging into another process's metrics with ``absorb``."""
+        raise NotImplementedError
+
+    def absorb(self, state: list):
+        raise NotImplementedError
+
+    def copy(self) -> "_Metric":
+        """A metric with the same definition and a copy of the current values."""
+        other = self._empty()
+        other.absorb(self.state())
+        return other
+
+    def _empty(self) -> "_Metric":
+        return type(self)(self.name, self.help)
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for name, key, value, extra in self.samples():
+            lines.append(f"{name}{_format_labels(key, extra)} {_format_value(value)}")
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help: str):
+        super().__init__(name, help)
+        self._values: dict[LabelKey, float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = _key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        with self._lock:
+            return self._values.get(_key(labels), 0)
+
+    def samples(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            yield self.name, key, value, None
+
+    def state(self) -> list:
+        return [[list(map(list, key)), value] for _, key, value, _ in self.samples()]
+
+    def absorb(self, state: list):
+        with self._lock:
+            for pairs, value in state:
+                key = tuple(map(tuple, pairs))
+                self._values[key] = self._values.get(key, 0) + value
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str):
+        super().__init__(name, help)
+        self._values: dict[LabelKey, float] = {}
+        self._fn: Callable[[], float] | None = None
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[_key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels):
+        key = _key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def set_function(self, fn: Callable[[], float]):
+        """Read the (unlabelled) value from ``fn`` at scrape time instead."""
+        self._fn = fn
+
+    @property
+    def is_callback(self) -> bool:
+        return self._fn is not None
+
+    @contextlib.contextmanager
+    def track(self, **labels):
+        """Count the block as in progress while it runs."""
+        self.inc(**labels)
+        try:
+            yield
+        finally:
+            self.dec(**labels)
+
+    def samples(self):
+        if self._fn is not None:
+            try:
+                yield self.name, (), float(self._fn()), None
+            except Exception as e:
+                print(f"Gauge {self.name} callback failed: {e}")
+            return
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            yield self.name, key, value, None
+
+    def state(self) -> list:
+        return [[list(map(list, key)), value] for _, key, value, _ in self.samples()]
+
+    def absorb(self, state: list):
+        with self._lock:
+            for pairs, value in state:
+                key = tuple(map(tuple, pairs))
+                self._values[key] = self._values.get(key, 0) + value
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, buckets: tuple[float, ...] = LATENCY_BUCKETS):
+        super().__init__(name, help)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        # label key -> [per-bucket counts..., sum]
+        self._values: dict[LabelKey, list[float]] = {}
+
+    def observe(self, value: float, **labels):
+        key = _key(labels)
+        with self._lock:
+            series = self._values.get(key)
+            if series is None:
+                series = self._values[key] = [0] * len(self.buckets) + [0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+                    break
+            series[-1] += value
+
+    @contextlib.contextmanager
+    def time(self, **labels):
+        """Observe the wall-clock duration of the block."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def snapshot(self) -> dict[LabelKey, tuple[list[int], float]]:
+        """Per label set: (cumulative bucket counts, sum)."""
+        with self._lock:
+            items = sorted(self._values.items())
+        out = {}
+        for key, series in items:
+            cumulative, running = [], 0
+            for count in series[:-1]:
+                running += count
+                cumulative.append(running)
+            out[key] = (cumulative, series[-1])
+        return out
+
+    def state(self) -> list:
+        with self._lock:
+            return [[list(map(list, key)), list(series)] for key, series in sorted(self._values.items())]
+
+    def absorb(self, state: list):
+        with self._lock:
+            for pairs, series in state:
+                if len(series) != len(self.buckets) + 1:
+                    continue  # bucket layout changed between versions
+                key = tuple(map(tuple, pairs))
+                current = self._values.setdefault(key, [0] * len(self.buckets) + [0.0])
+                for i, value in enumerate(series):
+                    current[i] += value
+
+    def _empty(self) -> "Histogram":
+        return Histogram(self.name, self.help, self.buckets[:-1])
+
+    def quantile(self, q: float, **labels) -> float | None:
+        """Estimate a quantile by interpolating within buckets."""
+        snap = self.snapshot().get(_key(labels))
+        if not snap or not snap[0][-1]:
+            return None
+        cumulative, _ = snap
+        rank = q * cumulative[-1]
+        lower, prev = 0.0, 0
+        for bound, count in zip(self.buckets, cumulative):
+            if count >= rank:
+                if bound == math.inf:
+                    return lower
+                return lower + (bound - lower) * ((rank - prev) / (count - prev) if count > prev else 1)
+            lower, prev = bound, count
+        return lower
+
+    def samples(self):
+        for key, (cumulative, total) in self.snapshot().items():
+            for bound, count in zip(self.buckets, cumulative):
+                yield f"{self.name}_bucket", key, count, {"le": _format_value(bound)}
+            yield f"{self.name}_sum", key, total, None
+            yield f"{self.name}_count", key, cumulative[-1], None
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: list[_Metric] = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, help: str) -> Counter:
+        return self.register(Counter(name, help))
+
+    def gauge(self, name: str, help: str) -> Gauge:
+        return self.register(Gauge(name, help))
+
+    def histogram(self, name: str, help: str, buckets: tuple[float, ...] = LATENCY_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, help, buckets))
+
+    def render(self) -> str:
+        return "\n".join(m.render() for m in self._metrics) + "\n"
+
+    def state(self, callbacks: bool = True) -> dict[str, list]:
+        """Every metric's ``state()``; without ``callbacks``, gauges read from a callback are left out."""
+        return {m.name: m.state() for m in self._metrics
+                if callbacks or not (isinstance(m, Gauge) and m.is_callback)}
+
+    def merged(self, states: list[tuple[dict[str, list], bool]]) -> "Registry":
+        """A copy of this registry plus other processes' ``state()`` values; (state, include gauges) pairs."""
+        out = Registry()
+        for m in self._metrics:
+            copy = out.register(m.copy())
+            for state, gauges in states:
+                if m.name in state and (gauges or not isinstance(m, Gauge)):
+                    copy.absorb(state[m.name])
+        return out
+
+    def summary(self) -> str:
+        """Short human-readable digest: counters, gauges and histogram p50/p95."""
+        lines = []
+        for m in self._metrics:
+            if isinstance(m, Histogram):
+                for key, (cumulative, total) in m.snapshot().items():
+                    count = cumulative[-1]
+                    if not count:
+                        continue
+                    labels = dict(key)
+                    p50, p95 = m.quantile(0.5, **labels), m.quantile(0.95, **labels)
+                    lines.append(f"  {m.name}{_format_labels(key)}: n={count} avg {total / count:.3f}s "
+                                 f"p50 {p50:.3f}s p95 {p95:.3f}s")
+            else:
+                for name, key, value, _ in m.samples():
+                    if value:
+                        lines.append(f"  {name}{_format_labels(key)}: {_format_value(value)}")
+        return "\n".join(lines)
+
+
+def percentile(values, p: float) -> float | None:
+    """Nearest-rank ``p``th percentile (0-100) of raw samples, or None if there are none."""
+    ordered = sorted(values)
+    if not ordered:
+        return None
+    return ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))]
+
+
+def error_type(exc: BaseException) -> str:
+    """Low-cardinality label for an error: ``http_<code>`` for API errors, else the class name."""
+    if isinstance(exc, errors.APIError) and exc.code:
+        return f"http_{exc.code}"
+    return type(exc).__name__
+
+
+def dump(path: str):
+    """Write the current metrics to ``path`` (Prometheus text), or print a summary for ``-``."""
+    if path == "-":
+        print("\nMetrics:")
+        print(registry.summary() or "  (none recorded)")
+        return
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(registry.render())
+    print(f"Metrics written to {path}")
+
+
+# ---------------------------------------------------------------------------
+# Metrics shared by the app and the CLIs
+# ---------------------------------------------------------------------------
+registry = Registry()
+
+model_call_seconds = registry.histogram(
+    "image_gen_model_call_seconds", "Latency of one generate_content call, by image size")
+model_calls_in_flight = registry.gauge(
+    "image_gen_model_calls_in_flight", "generate_content calls currently waiting on the API")
+model_retries = registry.counter(
+    "image_gen_model_retries_total", "Model calls retried after a throttle or transient error")
+model_hedges = registry.counter(
+    "image_gen_model_hedges_total", "Hedge requests for slow model calls, by outcome (sent, won)")
+job_stage_seconds = registry.histogram(
+    "image_gen_job_stage_seconds", "Time app jobs spend in each stage (queued, calling_model, saving)")
+codec_seconds = registry.histogram(
+    "image_gen_codec_seconds", "Image decode/encode time, by operation", FAST_BUCKETS)
+disk_write_seconds = registry.histogram(
+    "image_gen_disk_write_seconds", "Time to write one output image to disk", FAST_BUCKETS)
+bytes_written = registry.counter(
+    "image_gen_bytes_written_total", "Bytes of output images written to disk")
+results = registry.counter(
+    "image_gen_results_total", "Finished generations by outcome (success, text_only, error)")
+errors_total = registry.counter(
+    "image_gen_errors_total", "Failed generations by error type")
+evicted_files = registry.counter(
+    "image_gen_evicted_files_total", "Outputs deleted by the disk budget")
+evicted_bytes = registry.counter(
+    "image_gen_evicted_bytes_total", "Bytes reclaimed by the disk budget")
+
+jobs_running = registry.gauge("image_gen_jobs_running", "App jobs currently running on a scheduler worker")
+queue_depth = registry.gauge("image_gen_queue_depth", "App jobs waiting in the scheduler queue")
+jobs_stored = registry.gauge("image_gen_jobs_stored", "Jobs held in the app's job store")
+output_bytes = registry.gauge("image_gen_output_bytes", "Total size of indexed outputs")
+
+
+def record_error(exc: BaseException):
+    results.inc(outcome="error")
+    errors_total.inc(type=error_type(exc))
+
+
+# ---------------------------------------------------------------------------
+# Sharing across processes (production mode)
+# ---------------------------------------------------------------------------
+SHARED_DB = STATE_DIR / "metrics.db"
+PUBLISH_INTERVAL = env_float("IMAGE_GEN_METRICS_INTERVAL", 5.0)
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS worker_metrics (
+    worker  TEXT PRIMARY KEY,
+    updated REAL NOT NULL,
+    state   TEXT NOT NULL
+);
+"""
+
+
+def _shared_db():
+    db = connect(SHARED_DB)
+    db.executescript(_SCHEMA)
+    return db
+
+
+_publishing_as: str | None = None  # this process's snapshot, left out of its own render_shared
+
+
+def publish(worker: str):
+    """Store this process's metrics under ``worker``, replacing its previous snapshot."""
+    _shared_db().execute("INSERT OR REPLACE INTO worker_metrics (worker, updated, state) VALUES (?, ?, ?)",
+                         (worker, time.time(), json.dumps(registry.state(callbacks=False))))
+
+
+def start_publishing(worker: str, interval: float = PUBLISH_INTERVAL) -> threading.Thread:
+    global _publishing_as
+    _publishing_as = worker
+
+    def loop():
+        while True:
+            try:
+                publish(worker)
+            except Exception as e:
+                print(f"Publishing metrics failed: {e}")
+            time.sleep(interval)
+
+    thread = threading.Thread(target=loop, name="metrics-publisher", daemon=True)
+    thread.start()
+    return thread
+
+
+def render_shared(interval: float = PUBLISH_INTERVAL) -> str:
+    """This process's metrics plus every other process's published snapshot, in the text exposition format."""
+    live_after = time.time() - 3 * interval
+    states = [
+        (json.loads(row["state"]), row["updated"] >= live_after)
+        for row in _shared_db().execute("SELECT updated, state FROM worker_metrics WHERE worker IS NOT ?",
+                                        (_publishing_as,))
+    ]
+    return registry.merged(states).render()
@@ -0,0 +1,146 @@
+"""
+Writes model image outputs to disk.
+
+By default the bytes returned by the model (``part.inline_data.data``) are
+written as-is — no decode, no PNG re-encode — through a temp file that is
+linked into place, so readers never see a half-written image. An existing
+output is never replaced: if the name is taken, a ``-1``, ``-2``, ...
+suffix is added. That is what lets /outputs serve files as immutable.
+
+Setting an output format re-encodes instead. That work runs in a small
+process pool so it neither blocks request threads on the GIL nor competes
+with them for it. Pools are long-lived and shared (export.py has its own
+in the same registry); their workers are started by a fork server, not
+forked from the threaded app:
+
+    IMAGE_GEN_OUTPUT_FORMAT   original (default) | webp | avif | jpeg
+    IMAGE_GEN_OUTPUT_QUALITY  quality for avif/jpeg (default 90; webp is lossless)
+    IMAGE_GEN_ENCODE_WORKERS  encoder processes     (default 2)
+
+Either way, generation metadata (see image_meta.py) is embedded in the file:
+as a PNG chunk spliced into the raw bytes, or as EXIF when re-encoding.
+"""
+
+import io
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from config import OUTPUT_DIR, env_int
+import image_meta
+import metrics
+from tracing import span
+
+OUTPUT_FORMAT = os.getenv("IMAGE_GEN_OUTPUT_FORMAT", "original").lower()
+OUTPUT_QUALITY = env_int("IMAGE_GEN_OUTPUT_QUALITY", 90)
+ENCODE_WORKERS = env_int("IMAGE_GEN_ENCODE_WORKERS", 2)
+
+MIME_EXTENSIONS = {"image/png": ".png", "image/jpeg": ".jpg", "image/webp": ".webp"}
+FORMAT_EXTENSIONS = {"webp": ".webp", "avif": ".avif", "jpeg": ".jpg"}
+
+if OUTPUT_FORMAT != "original" and OUTPUT_FORMAT not in FORMAT_EXTENSIONS:
+    raise ValueError(f"IMAGE_GEN_OUTPUT_FORMAT must be original, webp, avif or jpeg, not {OUTPUT_FORMAT!r}")
+
+_pools: dict[str, ProcessPoolExecutor] = {}
+_pool_lock = threading.Lock()
+
+
+def write_atomic(path: Path, data: bytes):
+    """Write ``data`` to a temp file beside ``path`` and rename it into place."""
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    try:
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+    finally:
+        tmp.unlink(missing_ok=True)
+
+
+def write_new(path: Path, data: bytes) -> Path:
+    """Like write_atomic, but never replaces a file: on a name clash, writes ``<stem>-N<ext>``. Returns the path used."""
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    try:
+        with open(tmp, "wb") as f:
+            f.write(data)
+        candidate, n = path, 0
+        while True:
+            try:
+                os.link(tmp, candidate)  # unlike os.replace, fails if the name exists
+                return candidate
+            except FileExistsError:
+                n += 1
+                candidate = path.with_name(f"{path.stem}-{n}{path.suffix}")
+    finally:
+        tmp.unlink(missing_ok=True)
+
+
+def _encode(data: bytes, fmt: str, quality: int, exif: bytes | None = None) -> bytes:
+    """Re-encode image bytes. Runs in a worker process."""
+    from PIL import Image
+
+    extra = {"exif": exif} if exif else {}
+    with Image.open(io.BytesIO(data)) as img:
+        if fmt == "jpeg" and img.mode not in ("RGB", "L"):
+            img = img.convert("RGB")
+        buf = io.BytesIO()
+        if fmt == "webp":
+            img.save(buf, "WEBP", lossless=True, method=4, **extra)
+        elif fmt == "avif":
+            img.save(buf, "AVIF", quality=quality, **extra)
+        else:
+            img.save(buf, "JPEG", quality=quality, optimize=True, **extra)
+        return buf.getvalue()
+
+
+def pool_context():
+    """Start method for process pools: forkserver, or spawn where there is none.
+
+    Never fork: the app has request, scheduler and watcher threads, and a
+    child forked while one of them holds a lock (logging, SQLite, imports)
+    can hang on it. Workers re-run the main script as ``__mp_main__``, so
+    every entry point must be safe to import: worker.py and the CLIs keep
+    their work under ``if __name__ == "__main__"``, and ``python3 app.py``
+    hands over to serve.py.
+    """
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+
+
+def process_pool(name: str = "encode", workers: int = ENCODE_WORKERS) -> ProcessPoolExecutor:
+    """The shared process pool ``name``, created with ``workers`` processes on first use."""
+    with _pool_lock:
+        if name not in _pools:
+            _pools[name] = ProcessPoolExecutor(max_workers=workers, mp_context=pool_context())
+        return _pools[name]
+
+
+def run_in_pool(fn, *args):
+    """Run a picklable, module-level ``fn`` in the encoder pool and return its result."""
+    return process_pool().submit(fn, *args).result()
+
+
+def output_extension(mime_type: str | None, fmt: str = OUTPUT_FORMAT) -> str:
+    if fmt != "original":
+        return FORMAT_EXTENSIONS[fmt]
+    return MIME_EXTENSIONS.get(mime_type or "", ".png")
+
+
+def write_image(data: bytes, mime_type: str | None, stem: str, fmt: str = OUTPUT_FORMAT,
+                quality: int = OUTPUT_QUALITY, output_dir: Path = OUTPUT_DIR, metadata: dict | None = None) -> Path:
+    """Save one model output as ``<stem><ext>`` (or ``<stem>-N<ext>`` if taken) and return its path.
+
+    ``metadata`` (an ``image_meta.record``) is embedded in the file.
+    """
+    if fmt != "original":
+        exif = image_meta.exif_bytes(metadata) if metadata else None
+        with metrics.codec_seconds.time(op=f"encode_{fmt}"), span("encode", "io", format=fmt):
+            data = run_in_pool(_encode, data, fmt, quality, exif)
+    elif metadata:
+        data = image_meta.embed_png(data, metadata)
+    path = output_dir / f"{stem}{output_extension(mime_type, fmt)}"
+    with metrics.disk_write_seconds.time(), span("disk_write", "io", bytes=len(data)):
+        path = write_new(path, data)
+    metrics.bytes_written.inc(len(data))
+    return path
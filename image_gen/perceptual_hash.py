@@ -0,0 +1,117 @@
+"""
+Perceptual hashes and a BK-tree for near-duplicate lookups.
+
+``dhash`` is a 64-bit difference hash: the image is shrunk to 9x8 grayscale
+and each bit records whether a pixel is brighter than its right neighbour.
+Re-encodes, resizes and small edits change only a few bits, so near
+duplicates are hashes within a small Hamming distance of each other.
+
+``BKTree`` answers "every hash within distance r of h" without comparing
+against every stored hash, by pruning subtrees with the triangle inequality.
+
+``group`` turns that into near-duplicate groups around a kept image.
+"""
+
+from typing import Any, Hashable, Iterable, Iterator
+
+from PIL import Image
+
+HASH_BITS = 64
+DEFAULT_RADIUS = 6  # bits out of 64; ~10% — same composition, different render
+
+
+def dhash(img: Image.Image) -> int:
+    small = img.convert("L").resize((9, 8), Image.Resampling.BOX)
+    px = small.tobytes()
+    value = 0
+    for row in range(8):
+        for col in range(8):
+            value = (value << 1) | (px[row * 9 + col] > px[row * 9 + col + 1])
+    return value
+
+
+def hash_file(path) -> int | None:
+    """dHash of an image file, or None if it can't be read. Picklable, for process pools."""
+    try:
+        with Image.open(path) as img:
+            img.draft("RGB", (64, 64))  # JPEG: decode at a fraction of full size
+            return dhash(img)
+    except Exception:
+        return None
+
+
+def hamming(a: int, b: int) -> int:
+    return (a ^ b).bit_count()
+
+
+def to_signed(value: int) -> int:
+    """Fit an unsigned 64-bit hash into SQLite's signed INTEGER."""
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+def from_signed(value: int) -> int:
+    return value & ((1 << 64) - 1)
+
+
+class BKTree:
+    """Metric tree over Hamming distance. Items with identical hashes share a node."""
+
+    def __init__(self):
+        # node: [hash, items, {distance: child}]
+        self._root: list | None = None
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def add(self, value: int, item: Any):
+        self._size += 1
+        if self._root is None:
+            self._root = [value, [item], {}]
+            return
+        node = self._root
+        while True:
+            d = hamming(value, node[0])
+            if d == 0:
+                node[1].append(item)
+                return
+            child = node[2].get(d)
+            if child is None:
+                node[2][d] = [value, [item], {}]
+                return
+            node = child
+
+    def search(self, value: int, radius: int) -> Iterator[tuple[int, Any]]:
+        """Yield (distance, item) for every stored item within ``radius`` of ``value``."""
+        if self._root is None:
+            return
+        stack = [self._root]
+        while stack:
+            node = stack.pop()
+            d = hamming(value, node[0])
+            if d <= radius:
+                for item in node[1]:
+                    yield d, item
+            for child_d, child in node[2].items():
+                if d - radius <= child_d <= d + radius:
+                    stack.append(child)
+
+
+def group(items: Iterable[tuple[Hashable, int]], radius: int = DEFAULT_RADIUS) -> dict[Hashable, list[Hashable]]:
+    """Group (key, hash) pairs, given in order of preference, around representatives.
+
+    Each item joins the nearest representative within ``radius`` (the earlier
+    one on ties) or else becomes one. Every member is within ``radius`` of its
+    group's representative, so a chain A~B~C never puts A and C together when
+    they are further apart. Returns representative -> [representative, *members].
+    """
+    reps = BKTree()
+    groups: dict[Hashable, list[Hashable]] = {}
+    for rank, (key, value) in enumerate(items):
+        best = min(reps.search(value, radius), default=None)
+        if best is None:
+            reps.add(value, (rank, key))
+            groups[key] = [key]
+        else:
+            groups[best[1][1]].append(key)
+    return groups
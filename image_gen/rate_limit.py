@@ -0,0 +1,102 @@
+"""
+Adaptive rate limiting and retry helpers for model calls.
+
+``AdaptiveRateLimiter`` is a token bucket whose refill rate adapts AIMD-style:
+it halves when the API pushes back (429 / RESOURCE_EXHAUSTED) and creeps back
+up by a small step after each success. ``RetryBudget`` caps retries to a
+fraction of first attempts, so an outage doesn't turn into a retry storm.
+"""
+
+import asyncio
+import random
+import threading
+import time
+
+from google.genai import errors
+
+THROTTLE_CODES = (429,)
+TRANSIENT_CODES = (500, 502, 503, 504)
+
+
+def classify_error(exc: BaseException) -> tuple[bool, bool]:
+    """Return (retryable, throttled) for an exception from a model call."""
+    if isinstance(exc, errors.APIError):
+        throttled = exc.code in THROTTLE_CODES or exc.status == "RESOURCE_EXHAUSTED"
+        return throttled or exc.code in TRANSIENT_CODES, throttled
+    if isinstance(exc, (TimeoutError, ConnectionError)):
+        return True, False
+    # httpx transport errors (timeouts, resets) surface as-is from the SDK
+    if type(exc).__module__.startswith(("httpx", "httpcore")):
+        return True, False
+    return False, False
+
+
+def backoff_delay(attempt: int, base: float = 1.0, cap: float = 30.0) -> float:
+    """Full-jitter exponential backoff for the given 0-based retry attempt."""
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+class AdaptiveRateLimiter:
+    def __init__(self, rate: float = 1.0, min_rate: float = 0.05, max_rate: float = 10.0,
+                 burst: float = 4.0, increase: float = 0.05):
+        self.rate = rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.burst = burst
+        self.increase = increase
+        self._tokens = burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float):
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def _take(self) -> float:
+        """Take a token if available; otherwise return seconds until one is."""
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0.0
+            return (1 - self._tokens) / self.rate
+
+    def acquire(self):
+        while (wait := self._take()) > 0:
+            time.sleep(wait)
+
+    async def acquire_async(self):
+        while (wait := self._take()) > 0:
+            await asyncio.sleep(wait)
+
+    def on_success(self):
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + self.increase)
+
+    def on_throttle(self):
+        with self._lock:
+            self.rate = max(self.min_rate, self.rate / 2)
+            self._tokens = min(self._tokens, 0.0)  # drain the bucket so everyone waits
+
+
+class RetryBudget:
+    """Allows at most ``ratio`` retries per first attempt, plus ``min_retries``."""
+
+    def __init__(self, ratio: float = 0.2, min_retries: int = 3):
+        self.ratio = ratio
+        self.min_retries = min_retries
+        self._attempts = 0
+        self._retries = 0
+        self._lock = threading.Lock()
+
+    def record_attempt(self):
+        with self._lock:
+            self._attempts += 1
+
+    def try_spend(self) -> bool:
+        with self._lock:
+            if self._retries >= self.min_retries + self.ratio * self._attempts:
+                return False
+            self._retries += 1
+            return True
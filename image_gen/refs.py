@@ -0,0 +1,100 @@
+"""
+Reference-image ingestion: streamed uploads, downscaling and a hash cache.
+
+Uploads are streamed to disk in chunks (hashing as they go) and rejected
+once they pass ``MAX_REF_BYTES``. Each new image is decoded once, downscaled
+so its longest edge is at most ``MAX_REF_EDGE`` and re-encoded as WebP under
+``outputs/.refs/<ref_id>.webp``, where ``ref_id`` is the hash of the original
+upload. Uploading the same file again — or passing its ``ref_id`` — skips
+decoding entirely, and jobs send the small processed bytes upstream instead
+of the full-resolution original.
+
+    IMAGE_GEN_REF_MAX_BYTES  upload size cap      (default 20 MB)
+    IMAGE_GEN_REF_MAX_EDGE   longest edge, pixels (default 1536)
+"""
+
+import hashlib
+import io
+import os
+import re
+import uuid
+from typing import BinaryIO
+
+from google.genai import types
+from PIL import Image
+
+from config import OUTPUT_DIR, env_int
+import metrics
+from output_writer import write_atomic
+
+REF_DIR = OUTPUT_DIR / ".refs"
+REF_DIR.mkdir(exist_ok=True)
+
+MAX_REF_BYTES = env_int("IMAGE_GEN_REF_MAX_BYTES", 20 * 1024 * 1024)
+MAX_REF_EDGE = env_int("IMAGE_GEN_REF_MAX_EDGE", 1536)
+REF_QUALITY = 88
+CHUNK_SIZE = 64 * 1024
+
+_REF_ID = re.compile(r"^[0-9a-f]{32}$")
+
+
+class RefError(ValueError):
+    """Raised for uploads that are too large, unreadable, or unknown ref ids."""
+
+
+def ref_path(ref_id: str):
+    if not _REF_ID.match(ref_id):
+        raise RefError(f"Invalid ref_id {ref_id!r}")
+    return REF_DIR / f"{ref_id}.webp"
+
+
+def exists(ref_id: str) -> bool:
+    try:
+        return ref_path(ref_id).is_file()
+    except RefError:
+        return False
+
+
+def _normalize(src, dest):
+    try:
+        with Image.open(src) as img:
+            img.draft("RGB", (MAX_REF_EDGE, MAX_REF_EDGE))  # JPEG: decode at reduced scale
+            img = img.convert("RGBA" if "A" in img.getbands() else "RGB")
+    except Exception as e:
+        raise RefError(f"Unreadable image: {e}") from e
+    img.thumbnail((MAX_REF_EDGE, MAX_REF_EDGE), Image.Resampling.LANCZOS)
+    buf = io.BytesIO()
+    img.save(buf, "WEBP", quality=REF_QUALITY, method=4)
+    write_atomic(dest, buf.getvalue())
+
+
+def ingest(stream: BinaryIO, max_bytes: int = MAX_REF_BYTES) -> str:
+    """Stream an upload to disk, normalize it if unseen, and return its ref_id."""
+    digest = hashlib.sha256()
+    tmp = REF_DIR / f".upload-{uuid.uuid4().hex}.tmp"
+    try:
+        size = 0
+        with open(tmp, "wb") as f:
+            while chunk := stream.read(CHUNK_SIZE):
+                size += len(chunk)
+                if size > max_bytes:
+                    raise RefError(f"Reference image exceeds {max_bytes // (1024 * 1024)} MB")
+                digest.update(chunk)
+                f.write(chunk)
+        ref_id = digest.hexdigest()[:32]
+        dest = ref_path(ref_id)
+        if not dest.is_file():
+            with metrics.codec_seconds.time(op="ref"):
+                _normalize(tmp, dest)
+        return ref_id
+    finally:
+        tmp.unlink(missing_ok=True)
+
+
+def load_part(ref_id: str) -> types.Part:
+    """The processed reference as a content part for the model."""
+    path = ref_path(ref_id)
+    if not path.is_file():
+        raise RefError(f"Unknown ref_id {ref_id}")
+    os.utime(path)  # mark as recently used
+    return types.Part.from_bytes(data=path.read_bytes(), mime_type="image/webp")
@@ -0,0 +1,133 @@
+"""
+Content-addressed cache of generation results, plus in-flight coalescing.
+
+A result is keyed by a hash of everything that determines the request sent
+to the model: model, prompt, aspect ratio, image size and the content hashes
+of any reference images. Cached entries point at files already in
+``outputs/``; an entry whose files have since been deleted is dropped on
+lookup.
+
+Eviction only forgets cache entries — the images themselves stay in the
+gallery. It is bounded by age and by the total bytes of referenced outputs:
+
+    IMAGE_GEN_CACHE_MAX_AGE    seconds (default 30 days, 0 = no limit)
+    IMAGE_GEN_CACHE_MAX_BYTES  bytes   (default 0 = no limit)
+"""
+
+import hashlib
+import json
+import threading
+import time
+
+from config import OUTPUT_DIR, env_float, env_int
+from db import STATE_DIR, connect
+
+DB_PATH = STATE_DIR / "results.db"
+CACHE_MAX_AGE = env_float("IMAGE_GEN_CACHE_MAX_AGE", 30 * 24 * 3600)
+CACHE_MAX_BYTES = env_int("IMAGE_GEN_CACHE_MAX_BYTES", 0)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    key TEXT PRIMARY KEY,
+    files TEXT NOT NULL,
+    bytes INTEGER NOT NULL,
+    created REAL NOT NULL,
+    last_hit REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS results_last_hit ON results (last_hit);
+"""
+
+
+def content_hash(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def cache_key(model: str, prompt: str, aspect_ratio: str, image_size: str, ref_hashes: list[str] | None = None) -> str:
+    """Hash of every input that affects the generated image."""
+    payload = json.dumps([model, prompt, aspect_ratio, image_size, list(ref_hashes or [])])
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResultCache:
+    def __init__(self, db_path=DB_PATH, max_age: float = CACHE_MAX_AGE, max_bytes: int = CACHE_MAX_BYTES):
+        self.db_path = db_path
+        self.max_age = max_age
+        self.max_bytes = max_bytes
+        self._db().executescript(_SCHEMA)
+
+    def _db(self):
+        return connect(self.db_path)
+
+    def get(self, key: str) -> list[str] | None:
+        """Return the cached output filenames for ``key``, or None on a miss."""
+        row = self._db().execute("SELECT files, created FROM results WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        files = json.loads(row["files"])
+        expired = self.max_age and time.time() - row["created"] > self.max_age
+        if expired or not all((OUTPUT_DIR / f).is_file() for f in files):
+            self._db().execute("DELETE FROM results WHERE key = ?", (key,))
+            return None
+        self._db().execute("UPDATE results SET last_hit = ? WHERE key = ?", (time.time(), key))
+        return files
+
+    def put(self, key: str, files: list[str]):
+        """Record output filenames (relative to OUTPUT_DIR) for ``key``."""
+        if not files:
+            return
+        size = sum((OUTPUT_DIR / f).stat().st_size for f in files)
+        now = time.time()
+        self._db().execute(
+            "INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?)",
+            (key, json.dumps(files), size, now, now),
+        )
+        self.evict()
+
+    def evict(self) -> int:
+        """Drop expired entries, then least-recently-hit ones over the byte budget."""
+        db = self._db()
+        removed = 0
+        if self.max_age:
+            removed += db.execute("DELETE FROM results WHERE created < ?", (time.time() - self.max_age,)).rowcount
+        if self.max_bytes:
+            total = db.execute("SELECT COALESCE(SUM(bytes), 0) FROM results").fetchone()[0]
+            for row in db.execute("SELECT key, bytes FROM results ORDER BY last_hit").fetchall():
+                if total <= self.max_bytes:
+                    break
+                db.execute("DELETE FROM results WHERE key = ?", (row["key"],))
+                total -= row["bytes"]
+                removed += 1
+        return removed
+
+
+class InFlight:
+    """Tracks work in progress by cache key so identical requests can share it.
+
+    The first caller ``claim``s a key with an owner token (a job id, a Future);
+    later callers get that token back and attach to it instead of starting a
+    duplicate. The owner ``release``s the key once its result is recorded.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._owners: dict[str, object] = {}
+
+    def claim(self, key: str, owner: object) -> object | None:
+        """Register ``owner`` for ``key``; return the existing owner if there is one."""
+        with self._lock:
+            existing = self._owners.get(key)
+            if existing is not None:
+                return existing
+            self._owners[key] = owner
+            return None
+
+    def release(self, key: str):
+        with self._lock:
+            self._owners.pop(key, None)
+
+    def release_owner(self, owner: object):
+        """Release whatever key ``owner`` holds, e.g. when its job is cancelled."""
+        with self._lock:
+            for key, current in list(self._owners.items()):
+                if current == owner:
+                    del self._owners[key]
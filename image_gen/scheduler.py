@@ -0,0 +1,127 @@
+"""
+Bounded worker pool with a priority queue for generation jobs.
+
+A fixed number of worker threads pull jobs off a bounded queue, so a burst of
+submissions can't start unbounded concurrent model calls. Interactive
+single-prompt jobs are served before batch work; within a priority, jobs run
+in submission order. Queued jobs can be cancelled and report their position;
+``on_change`` is called whenever queue positions shift.
+
+    IMAGE_GEN_CONCURRENCY  worker threads     (default 4)
+    IMAGE_GEN_MAX_QUEUE    queued jobs limit  (default 32)
+"""
+
+import heapq
+import itertools
+import math
+import threading
+import time
+from typing import Callable
+
+from config import env_int
+
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BATCH = 10
+
+CONCURRENCY = env_int("IMAGE_GEN_CONCURRENCY", 4)
+MAX_QUEUE = env_int("IMAGE_GEN_MAX_QUEUE", 32)
+
+
+class QueueFull(Exception):
+    """Raised by ``submit`` when the queue is at capacity."""
+
+    def __init__(self, retry_after: int):
+        super().__init__(f"Queue is full, retry in {retry_after}s")
+        self.retry_after = retry_after
+
+
+class JobScheduler:
+    def __init__(self, concurrency: int = CONCURRENCY, max_queue: int = MAX_QUEUE):
+        self.concurrency = concurrency
+        self.max_queue = max_queue
+        self._cond = threading.Condition()
+        self._heap: list[tuple[int, int, str, Callable[[], None]]] = []
+        self._seq = itertools.count()
+        self._running: set[str] = set()
+        self._workers: list[threading.Thread] = []
+        self._avg_duration = 30.0  # seconds, moving average used for Retry-After
+        self.on_change: Callable[[], None] | None = None
+
+    def _changed(self):
+        if self.on_change is not None:
+            try:
+                self.on_change()
+            except Exception as e:
+                print(f"Scheduler on_change failed: {e}")
+
+    def _start_workers(self):
+        while len(self._workers) < self.concurrency:
+            t = threading.Thread(target=self._worker, name=f"gen-worker-{len(self._workers)}", daemon=True)
+            self._workers.append(t)
+            t.start()
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                while not self._heap:
+                    self._cond.wait()
+                _, _, job_id, fn = heapq.heappop(self._heap)
+                self._running.add(job_id)
+            self._changed()
+            start = time.monotonic()
+            try:
+                fn()
+            except Exception as e:
+                print(f"Job {job_id} raised: {e}")
+            finally:
+                with self._cond:
+                    self._running.discard(job_id)
+                    self._avg_duration = 0.8 * self._avg_duration + 0.2 * (time.monotonic() - start)
+
+    def submit(self, job_id: str, fn: Callable[[], None], priority: int = PRIORITY_INTERACTIVE):
+        """Queue ``fn`` to run on a worker. Raises QueueFull at capacity."""
+        with self._cond:
+            if len(self._heap) >= self.max_queue:
+                raise QueueFull(self._retry_after())
+            heapq.heappush(self._heap, (priority, next(self._seq), job_id, fn))
+            self._start_workers()
+            self._cond.notify()
+        self._changed()
+
+    def cancel(self, job_id: str) -> bool:
+        """Remove a queued job. Returns False if it isn't queued (running or unknown)."""
+        with self._cond:
+            for i, entry in enumerate(self._heap):
+                if entry[2] == job_id:
+                    self._heap.pop(i)
+                    heapq.heapify(self._heap)
+                    break
+            else:
+                return False
+        self._changed()
+        return True
+
+    def is_running(self, job_id: str) -> bool:
+        with self._cond:
+            return job_id in self._running
+
+    def position(self, job_id: str) -> int | None:
+        """1-based position in the queue, or None if the job isn't queued."""
+        with self._cond:
+            for pos, entry in enumerate(sorted(self._heap), start=1):
+                if entry[2] == job_id:
+                    return pos
+        return None
+
+    def positions(self) -> dict[str, int]:
+        """1-based queue position of every queued job."""
+        with self._cond:
+            return {entry[2]: pos for pos, entry in enumerate(sorted(self._heap), start=1)}
+
+    def stats(self) -> dict:
+        with self._cond:
+            return dict(queued=len(self._heap), running=len(self._running), concurrency=self.concurrency)
+
+    def _retry_after(self) -> int:
+        waves = math.ceil((len(self._heap) + 1) / self.concurrency)
+        return max(1, math.ceil(waves * self._avg_duration))
@@ -0,0 +1,25 @@
+"""
+Development server for the Flask UI. ``python3 app.py`` hands over to this.
+
+Process-pool workers re-run the main script before they start (see
+output_writer.pool_context). app.py must not be that script: creating its
+job store marks jobs left unfinished as interrupted, which would fail the
+running ones. This script imports the app only when it is run.
+
+Usage:
+    cd image_gen && python3 serve.py    # or python3 app.py
+"""
+
+import os
+
+
+def main():
+    from app import app, clients
+
+    if os.getenv("GOOGLE_API_KEY") and clients.needs_api_key:
+        clients.warm_up()
+    app.run(debug=True, port=5000)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+"""
+Cross-process job queue for production mode, in SQLite (WAL).
+
+Web workers enqueue job payloads. Generator processes (worker.py) claim
+them atomically, in priority order and then submission order. It answers the
+same queue questions as JobScheduler — ``position``, ``positions``, ``cancel``,
+``is_running``, ``stats`` — so any web worker can report on any job.
+
+Identical non-fresh requests coalesce onto the queued or running entry with
+the same cache key, across all web workers. Entries claimed by a process that
+has since died are removed by ``reap`` so their jobs can be failed.
+
+    IMAGE_GEN_MAX_QUEUE  queued jobs limit  (default 32)
+"""
+
+import json
+import math
+import os
+import time
+
+from db import STATE_DIR, connect
+from scheduler import MAX_QUEUE, PRIORITY_INTERACTIVE, QueueFull
+
+DB_PATH = STATE_DIR / "queue.db"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS queue (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    job_id TEXT NOT NULL UNIQUE,
+    priority INTEGER NOT NULL,
+    payload TEXT NOT NULL,
+    key TEXT,
+    worker INTEGER,  -- pid of the claiming process; NULL while queued
+    claimed REAL
+);
+CREATE INDEX IF NOT EXISTS queue_order ON queue (worker, priority, seq);
+CREATE UNIQUE INDEX IF NOT EXISTS queue_key ON queue (key) WHERE key IS NOT NULL;
+CREATE TABLE IF NOT EXISTS meta (id INTEGER PRIMARY KEY CHECK (id = 0), avg_duration REAL NOT NULL);
+INSERT OR IGNORE INTO meta VALUES (0, 30.0);
+"""
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class SharedQueue:
+    def __init__(self, max_queue: int = MAX_QUEUE, db_path=DB_PATH):
+        self.max_queue = max_queue
+        self.db_path = db_path
+        self._db().executescript(_SCHEMA)
+
+    def _db(self):
+        return connect(self.db_path)
+
+    def submit(self, job_id: str, payload: dict, priority: int = PRIORITY_INTERACTIVE, key: str | None = None) -> str | None:
+        """Enqueue a job. Returns the id of an existing job with the same ``key`` instead, if any.
+
+        Raises QueueFull at capacity.
+        """
+        db = self._db()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            if key is not None:
+                row = db.execute("SELECT job_id FROM queue WHERE key = ?", (key,)).fetchone()
+                if row:
+                    db.execute("COMMIT")
+                    return row["job_id"]
+            queued, running = self._counts()
+            if queued >= self.max_queue:
+                raise QueueFull(self._retry_after(queued, running))
+            db.execute(
+                "INSERT INTO queue (job_id, priority, payload, key) VALUES (?, ?, ?, ?)",
+                (job_id, priority, json.dumps(payload), key),
+            )
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        return None
+
+    def claim(self, worker: int | None = None) -> tuple[str, dict] | None:
+        """Atomically take the next queued job for this process. Returns (job_id, payload) or None."""
+        row = self._db().execute(
+            "UPDATE queue SET worker = ?, claimed = ? WHERE seq = "
+            "(SELECT seq FROM queue WHERE worker IS NULL ORDER BY priority, seq LIMIT 1) "
+            "RETURNING job_id, payload",
+            (worker or os.getpid(), time.time()),
+        ).fetchone()
+        return (row["job_id"], json.loads(row["payload"])) if row else None
+
+    def finish(self, job_id: str):
+        """Remove a claimed job and fold its run time into the Retry-After estimate."""
+        db = self._db()
+        row = db.execute("DELETE FROM queue WHERE job_id = ? RETURNING claimed", (job_id,)).fetchone()
+        if row and row["claimed"]:
+            db.execute("UPDATE meta SET avg_duration = 0.8 * avg_duration + 0.2 * ?", (time.time() - row["claimed"],))
+
+    def cancel(self, job_id: str) -> bool:
+        """Remove a queued job. Returns False if it isn't queued (running or unknown)."""
+        cur = self._db().execute("DELETE FROM queue WHERE job_id = ? AND worker IS NULL", (job_id,))
+        return cur.rowcount > 0
+
+    def is_running(self, job_id: str) -> bool:
+        row = self._db().execute("SELECT 1 FROM queue WHERE job_id = ? AND worker IS NOT NULL", (job_id,)).fetchone()
+        return row is not None
+
+    def position(self, job_id: str) -> int | None:
+        """1-based position in the queue, or None if the job isn't queued."""
+        db = self._db()
+        me = db.execute("SELECT priority, seq FROM queue WHERE job_id = ? AND worker IS NULL", (job_id,)).fetchone()
+        if me is None:
+            return None
+        ahead = db.execute(
+            "SELECT COUNT(*) FROM queue WHERE worker IS NULL AND (priority < ? OR (priority = ? AND seq < ?))",
+            (me["priority"], me["priority"], me["seq"]),
+        ).fetchone()[0]
+        return ahead + 1
+
+    def positions(self) -> dict[str, int]:
+        """1-based queue position of every queued job."""
+        rows = self._db().execute("SELECT job_id FROM queue WHERE worker IS NULL ORDER BY priority, seq")
+        return {row["job_id"]: pos for pos, row in enumerate(rows, start=1)}
+
+    def reap(self) -> list[str]:
+        """Drop entries claimed by processes that no longer exist. Returns their job ids."""
+        db = self._db()
+        dead = [
+            row["job_id"] for row in db.execute("SELECT job_id, worker FROM queue WHERE worker IS NOT NULL")
+            if not _pid_alive(row["worker"])
+        ]
+        db.executemany("DELETE FROM queue WHERE job_id = ?", [(job_id,) for job_id in dead])
+        return dead
+
+    def _counts(self) -> tuple[int, int]:
+        row = self._db().execute(
+            "SELECT COUNT(*) - COUNT(worker) AS queued, COUNT(worker) AS running FROM queue"
+        ).fetchone()
+        return row["queued"], row["running"]
+
+    def stats(self) -> dict:
+        queued, running = self._counts()
+        workers = self._db().execute("SELECT COUNT(DISTINCT worker) FROM queue").fetchone()[0]
+        return dict(queued=queued, running=running, busy_workers=workers)
+
+    def _retry_after(self, queued: int, running: int) -> int:
+        avg = self._db().execute("SELECT avg_duration FROM meta").fetchone()[0]
+        waves = math.ceil((queued + 1) / max(1, running))
+        return max(1, math.ceil(waves * avg))
@@ -0,0 +1,91 @@
+"""
+Shared test setup.
+
+Modules read their settings from the environment at import time, so the
+environment is pointed at a scratch outputs directory and the fake model
+backend before anything from image_gen is imported.
+"""
+
+import os
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+import pytest
+
+OUTPUT_DIR = Path(tempfile.mkdtemp(prefix="image_gen_test_"))
+os.environ.update(
+    IMAGE_GEN_OUTPUT_DIR=str(OUTPUT_DIR),
+    IMAGE_GEN_EXPORT_DIR=str(OUTPUT_DIR / "export"),
+    IMAGE_GEN_BACKEND="fake",
+    IMAGE_GEN_FAKE_LATENCY="0",
+    IMAGE_GEN_PERSIST_JOBS="0",
+)
+os.environ.pop("IMAGE_GEN_TRACE", None)
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from PIL import Image  # noqa: E402
+
+
+def make_image(directory: Path, name: str, color=(128, 64, 32), size=(64, 36), pattern: int | None = None) -> Path:
+    """Write a small image. ``pattern`` seeds a layout of blocks on a gradient, so images can be told apart by their hash."""
+    img = Image.new("RGB", size, color)
+    if pattern is not None:
+        img = Image.blend(img, Image.linear_gradient("L").rotate(90).resize(size).convert("RGB"), 0.3)
+        bw, bh = size[0] // 8, size[1] // 4
+        for i in range(32):
+            if (i * 7 + pattern) % 11 < 5:
+                x, y = i % 8 * bw, i // 8 * bh
+                img.paste((255 - color[0], 255 - color[1], 255 - color[2]), (x, y, x + bw, y + bh))
+    path = directory / name
+    path.parent.mkdir(parents=True, exist_ok=True)
+    img.save(path)
+    return path
+
+
+@pytest.fixture(scope="session")
+def output_dir() -> Path:
+    return OUTPUT_DIR
+
+
+@pytest.fixture
+def index(tmp_path):
+    from gallery_index import GalleryIndex
+
+    return GalleryIndex(db_path=tmp_path / "gallery.db", output_dir=tmp_path)
+
+
+@pytest.fixture(scope="session")
+def client():
+    import app
+
+    return app.app.test_client()
+
+
+@pytest.fixture
+def held_scheduler(client, monkeypatch):
+    """Swap the app's scheduler for one whose only worker is busy, so submitted jobs stay queued."""
+    import app
+    from scheduler import JobScheduler
+
+    release = threading.Event()
+    scheduler = JobScheduler(concurrency=1, max_queue=4)
+    scheduler.submit("blocker", release.wait)
+    while not scheduler.is_running("blocker"):
+        time.sleep(0.001)
+    monkeypatch.setattr(app, "scheduler", scheduler)
+    yield scheduler
+    for job_id in scheduler.positions():
+        scheduler.cancel(job_id)
+    release.set()
+
+
+def wait_for(predicate, timeout: float = 10.0):
+    """Poll ``predicate`` until it returns something truthy, and return that."""
+    deadline = time.monotonic() + timeout
+    while not (result := predicate()):
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+    return result
@@ -0,0 +1,60 @@
+import pytest
+
+from conftest import make_image
+
+
+@pytest.fixture(scope="module")
+def files(output_dir):
+    make_image(output_dir, "served.png", pattern=3)
+    (output_dir / "broken.png").write_bytes(b"not an image")
+    (output_dir / "notes.txt").write_text("hello")
+    (output_dir / ".state").mkdir(exist_ok=True)
+    make_image(output_dir / ".state", "hidden.png")
+
+
+def test_output_path_accepts_only_visible_images(files, output_dir):
+    from app import _output_path
+
+    assert _output_path("served.png") == output_dir / "served.png"
+    for name in ("missing.png", "notes.txt", ".state/hidden.png", ".state/gallery.db", "../served.png"):
+        assert _output_path(name) is None, name
+
+
+def test_serve_output_is_immutable_with_etag(files, client):
+    resp = client.get("/outputs/served.png")
+    assert resp.status_code == 200
+    assert resp.headers["ETag"]
+    assert "immutable" in resp.headers["Cache-Control"]
+    again = client.get("/outputs/served.png", headers={"If-None-Match": resp.headers["ETag"]})
+    assert again.status_code == 304
+
+
+def test_serve_thumb_builds_a_webp(files, client):
+    resp = client.get("/thumbs/served.png")
+    assert resp.status_code == 200
+    assert resp.mimetype == "image/webp"
+
+
+@pytest.mark.parametrize("name", [".state/gallery.db", ".state/hidden.png", "notes.txt", "broken.png",
+                                  "missing.png", "../served.png"])
+def test_serve_thumb_rejects_non_outputs(files, client, name):
+    assert client.get(f"/thumbs/{name}").status_code == 404
+
+
+@pytest.mark.parametrize("name", [".state/gallery.db", "notes.txt", "missing.png"])
+def test_serve_output_rejects_non_outputs(files, client, name):
+    assert client.get(f"/outputs/{name}").status_code == 404
+
+
+def test_thumbnails_are_keyed_by_relative_path_and_extension(output_dir, client):
+    from thumbs import thumb_path
+
+    make_image(output_dir, "twin.png", color=(250, 10, 10))
+    make_image(output_dir, "twin.jpg", color=(10, 10, 250))
+    make_image(output_dir, "sub/twin.png", color=(10, 250, 10))
+    paths = {thumb_path(name) for name in ("twin.png", "twin.jpg", "sub/twin.png")}
+    assert len(paths) == 3
+
+    bodies = [client.get(f"/thumbs/{name}").data for name in ("twin.png", "twin.jpg", "sub/twin.png")]
+    assert len(set(bodies)) == 3
+    assert all(path.is_file() for path in paths)
@@ -0,0 +1,69 @@
+import asyncio
+
+import pytest
+
+import batch
+from batch import Task, build_sweep, run_sweep
+from fake_backend import FakeClient, FakeConfig
+from rate_limit import AdaptiveRateLimiter
+
+
+@pytest.fixture(autouse=True)
+def unthrottled(monkeypatch):
+    monkeypatch.setattr(batch, "rate_limiter", AdaptiveRateLimiter(rate=1000, max_rate=1000, burst=100))
+
+
+def _client(latency: float = 0.0) -> FakeClient:
+    return FakeClient(FakeConfig(latency=latency, tail_prob=0, error_rate=0, throttle_rate=0, seed=1))
+
+
+def test_build_sweep_is_the_deduplicated_cross_product_in_order():
+    tasks = build_sweep(["a", "b", "a"], ["16:9", "1:1"], ["1K"])
+    assert [(t.prompt, t.aspect_ratio, t.size) for t in tasks] == [
+        ("a", "16:9", "1K"), ("a", "1:1", "1K"), ("b", "16:9", "1K"), ("b", "1:1", "1K")]
+
+
+def test_run_sweep_keeps_at_most_concurrency_requests_in_flight():
+    client = _client(latency=0.02)
+    generate_content = client.aio.models.generate_content
+    in_flight, peak = 0, 0
+
+    async def counting(**kwargs):
+        nonlocal in_flight, peak
+        in_flight += 1
+        peak = max(peak, in_flight)
+        try:
+            return await generate_content(**kwargs)
+        finally:
+            in_flight -= 1
+
+    client.aio.models.generate_content = counting
+    tasks = build_sweep([f"batch concurrency {i}" for i in range(8)], ["1:1"], ["1K"])
+    results = asyncio.run(run_sweep(client, tasks, concurrency=3, use_cache=False))
+    assert peak == 3
+    assert sorted(r.task.prompt for r in results) == sorted(t.prompt for t in tasks)
+    assert all(r.files and not r.error for r in results)
+
+
+def test_repeat_sweep_is_cached_and_fresh_runs_get_new_filenames(output_dir):
+    tasks = build_sweep(["batch cache check"], ["16:9", "9:16"], ["1K"])
+    first = asyncio.run(run_sweep(_client(), tasks))
+    assert not any(r.cached for r in first)
+
+    client = _client()
+    again = asyncio.run(run_sweep(client, tasks))
+    assert all(r.cached for r in again) and client.calls == 0
+    assert {r.task: r.files for r in again} == {r.task: r.files for r in first}
+
+    fresh = asyncio.run(run_sweep(_client(), tasks, use_cache=False))
+    for before, after in zip(sorted(first, key=lambda r: r.task.id), sorted(fresh, key=lambda r: r.task.id)):
+        assert after.files != before.files
+        assert all(name.startswith(before.task.stem + "_") for name in before.files + after.files)
+        assert all((output_dir / name).is_file() for name in before.files + after.files)
+
+
+def test_task_stem_identifies_the_task_not_the_run():
+    task = Task("A misty harbour at dawn", "16:9", "2K")
+    assert task.stem == Task("A misty harbour at dawn", "16:9", "2K").stem
+    assert task.stem.endswith(f"_16x9_2K_{task.id[:8]}")
+    assert task.stem != Task("A misty harbour at dawn", "16:9", "4K").stem
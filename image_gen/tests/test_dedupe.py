@@ -0,0 +1,94 @@
+from conftest import make_image
+from perceptual_hash import hamming, hash_file
+
+
+def test_thumbnail_hash_matches_full_image_hash(output_dir):
+    from thumbs import build_thumbnail
+
+    for pattern in range(4):
+        path = make_image(output_dir, f"hash_{pattern}.png", size=(1600, 900), pattern=pattern)
+        _, thumb_hash = build_thumbnail(path.name)
+        assert hamming(thumb_hash, hash_file(path)) <= 2
+
+
+def test_add_with_hash_value_does_not_decode(index, tmp_path, monkeypatch):
+    import gallery_index
+
+    make_image(tmp_path, "a.png")
+    monkeypatch.setattr(gallery_index, "dhash", lambda img: (_ for _ in ()).throw(AssertionError("decoded")))
+    index.add("a.png", hash_value=0x0123456789ABCDEF)
+    assert index.get("a.png")["dhash"] == "0123456789abcdef"
+
+
+# A ~ B ~ C: each step flips 4 bits, so A and C are 8 apart — beyond radius 6.
+A, B, C = 0, 0b1111, 0b1111_1111
+FAR = (1 << 64) - 1
+
+
+def test_clusters_do_not_chain():
+    from dedupe import clusters
+
+    hashes = {"a.png": (A, 3.0), "b.png": (B, 2.0), "c.png": (C, 1.0), "far.png": (FAR, 0.5)}
+    assert clusters(hashes, radius=6) == [["a.png", "b.png"]]
+
+
+def test_clusters_keep_the_newest_and_group_around_it():
+    from dedupe import clusters
+
+    hashes = {"old.png": (B, 1.0), "new.png": (A, 5.0), "mid.png": (0b11, 3.0), "other.png": (FAR, 4.0)}
+    assert clusters(hashes, radius=6) == [["new.png", "mid.png", "old.png"]]
+
+
+def test_prune_moves_only_near_duplicates_of_the_kept_image(index, tmp_path, monkeypatch):
+    import dedupe
+
+    monkeypatch.setattr(dedupe, "OUTPUT_DIR", tmp_path)
+    monkeypatch.setattr(dedupe, "PRUNED_DIR", tmp_path / ".pruned")
+    for name, value, created in (("a.png", A, 3.0), ("b.png", B, 2.0), ("c.png", C, 1.0)):
+        make_image(tmp_path, name)
+        index.add(name, created=created, hash_value=value)
+
+    moved = dedupe.prune(index, dedupe.clusters(index.hashes(), radius=6))
+    assert moved == 1
+    assert sorted(p.name for p in tmp_path.glob("*.png")) == ["a.png", "c.png"]
+    assert index.get("b.png") is None
+
+
+def test_gallery_dedupe_does_not_chain(index, tmp_path):
+    for name, value, created in (("a.png", A, 3.0), ("b.png", B, 2.0), ("c.png", C, 1.0)):
+        make_image(tmp_path, name)
+        index.add(name, created=created, hash_value=value)
+
+    rows, cursor = index.page(dedupe=True, radius=6)
+    assert [(row["name"], row["duplicates"]) for row in rows] == [("a.png", 1), ("c.png", 0)]
+    assert cursor is None
+
+
+def test_clusters_prefer_keeping_a_protected_image():
+    from dedupe import clusters
+
+    hashes = {"new.png": (A, 3.0), "pinned.png": (B, 2.0), "old.png": (0b11, 1.0)}
+    assert clusters(hashes, radius=6, keep={"pinned.png"}) == [["pinned.png", "new.png", "old.png"]]
+
+
+def test_prune_never_moves_pinned_or_exported_outputs(index, tmp_path, monkeypatch):
+    import json
+
+    import dedupe
+
+    monkeypatch.setattr(dedupe, "OUTPUT_DIR", tmp_path)
+    monkeypatch.setattr(dedupe, "PRUNED_DIR", tmp_path / ".pruned")
+    export_dir = tmp_path / "export"
+    export_dir.mkdir()
+    (export_dir / "export-manifest.json").write_text(json.dumps({"hero": {"source": "exported.png"}}))
+    for name, value, created in (("new.png", A, 4.0), ("pinned.png", B, 3.0), ("exported.png", 0b11, 2.0),
+                                 ("dup.png", 0b111, 1.0)):
+        make_image(tmp_path, name)
+        index.add(name, created=created, hash_value=value)
+    index.set_pinned("pinned.png", True)
+    index.set_pinned("new.png", True)
+
+    groups = dedupe.clusters(index.hashes(), radius=6, keep=dedupe.protected(index, export_dir))
+    assert groups[0][0] == "new.png"
+    assert dedupe.prune(index, groups, export_dir) == 1
+    assert sorted(p.name for p in tmp_path.glob("*.png")) == ["exported.png", "new.png", "pinned.png"]
@@ -0,0 +1,87 @@
+import json
+
+import pytest
+
+from conftest import make_image
+from disk_budget import DiskBudget
+from thumbs import placeholder_path, thumb_path
+
+
+@pytest.fixture
+def outputs(index, tmp_path):
+    """Five indexed outputs, created a, b, c, d, e (oldest first), each with a thumbnail."""
+    names = [f"budget_{c}.png" for c in "abcde"]
+    for i, name in enumerate(names):
+        make_image(tmp_path, name, pattern=i)
+        index.add(name, created=1000.0 + i, compute_hash=False)
+        for derived in (thumb_path(name), placeholder_path(name)):
+            derived.parent.mkdir(parents=True, exist_ok=True)
+            derived.write_bytes(b"x")
+    return names
+
+
+def _budget(index, tmp_path, **limits) -> DiskBudget:
+    return DiskBudget(index, output_dir=tmp_path, export_dir=tmp_path / "export", **limits)
+
+
+def test_under_budget_evicts_nothing(index, tmp_path, outputs):
+    assert _budget(index, tmp_path, max_files=5).enforce() == (0, 0)
+    assert index.usage()[0] == 5
+
+
+def test_evicts_least_recently_used_down_to_low_water(index, tmp_path, outputs):
+    budget = _budget(index, tmp_path, max_files=4)  # over at 5; low water is 3.6, so keep 3
+    budget.touch("budget_a.png")  # the oldest, but just viewed
+    files, reclaimed = budget.enforce()
+    assert files == 2 and reclaimed > 0
+    gone = {"budget_b.png", "budget_c.png"}
+    for name in outputs:
+        assert (tmp_path / name).exists() == (name not in gone), name
+        assert (index.get(name) is not None) == (name not in gone), name
+        assert thumb_path(name).exists() == (name not in gone), name
+        assert placeholder_path(name).exists() == (name not in gone), name
+
+
+def test_pinned_and_exported_outputs_are_never_evicted(index, tmp_path, outputs):
+    index.set_pinned("budget_a.png", True)
+    (tmp_path / "export").mkdir()
+    (tmp_path / "export" / "export-manifest.json").write_text(json.dumps({"hero": {"source": "budget_b.png"}}))
+    files, _ = _budget(index, tmp_path, max_files=1).enforce()
+    assert files == 3
+    assert sorted(p.name for p in tmp_path.glob("budget_*.png")) == ["budget_a.png", "budget_b.png"]
+
+
+def test_byte_limit(index, tmp_path, outputs):
+    count, size = index.usage()
+    files, reclaimed = _budget(index, tmp_path, max_bytes=size - 1).enforce()
+    assert files >= 1
+    left = index.usage()
+    assert left[0] == count - files
+    assert left[1] <= (size - 1) * 0.9
+    assert reclaimed == size - left[1] + 2 * files  # plus each one's 1-byte thumbnail and placeholder
+
+
+def test_eviction_removes_variants_and_counts_their_bytes(index, tmp_path, outputs):
+    import variants
+
+    for name in outputs:
+        variants.variant_path(name, 160, "webp").write_bytes(b"v" * 100)
+        variants.variant_path(name, None, "avif").write_bytes(b"v" * 50)
+    sizes = {name: (tmp_path / name).stat().st_size for name in outputs}
+    files, reclaimed = _budget(index, tmp_path, max_files=4).enforce()
+    assert files == 2
+    assert reclaimed == sizes["budget_a.png"] + sizes["budget_b.png"] + 2 * (150 + 2)
+    for name in outputs:
+        assert variants.variant_path(name, 160, "webp").exists() == (name not in ("budget_a.png", "budget_b.png"))
+    assert list(variants.VARIANT_DIR.glob(f"{variants._variant_prefix('budget_a.png')}.*")) == []
+
+
+def test_export_sources_match_by_relative_path(index, tmp_path, outputs, output_dir):
+    from export import source_key
+
+    assert source_key(output_dir / "sub" / "budget_a.png") == "sub/budget_a.png"
+    (tmp_path / "export").mkdir()
+    # another directory's budget_a.png was exported, not this one
+    (tmp_path / "export" / "export-manifest.json").write_text(json.dumps({"hero": {"source": "sub/budget_a.png"}}))
+    _budget(index, tmp_path, max_files=4).enforce()
+    assert not (tmp_path / "budget_a.png").exists()
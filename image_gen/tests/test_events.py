@@ -0,0 +1,28 @@
+from events import SUBSCRIBER_QUEUE_SIZE, EventBus
+
+
+def test_full_subscriber_is_cut_off_others_keep_receiving():
+    bus = EventBus()
+    stalled, reader = bus.subscribe(), bus.subscribe()
+    for i in range(SUBSCRIBER_QUEUE_SIZE + 1):
+        bus.publish("job", {"n": i})
+        reader.get_nowait()
+    assert stalled.overflowed and not reader.overflowed
+    assert len(bus) == 1
+    bus.publish("job", {"n": "after"})
+    assert reader.get_nowait() == ("job", {"n": "after"})
+
+
+def test_event_stream_starts_with_a_queue_snapshot_and_ends_on_overflow(client):
+    import app
+
+    resp = client.get("/events", buffered=False)
+    chunks = iter(resp.response)
+    assert next(chunks).startswith(b"retry:")
+    assert next(chunks).startswith(b"event: queue\n")  # subscribes before yielding this
+    for i in range(SUBSCRIBER_QUEUE_SIZE + 1):
+        app.events.publish("job", {"job_id": "x", "n": i})
+    rest = list(chunks)  # finishes instead of waiting for more events
+    assert len(rest) <= SUBSCRIBER_QUEUE_SIZE
+    assert len(app.events) == 0
+    resp.close()
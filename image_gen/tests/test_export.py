@@ -0,0 +1,25 @@
+from conftest import make_image
+
+
+def test_export_endpoint_writes_derivatives_then_skips_unchanged(client, output_dir):
+    import export
+    import output_writer
+
+    make_image(output_dir, "export_src.png", size=(800, 450), pattern=5)
+    resp = client.post("/export", data={"filename": "export_src.png", "name": "hero-test"})
+    assert resp.status_code == 200, resp.get_json()
+    entry = resp.get_json()
+    assert not entry.get("skipped")
+    assert entry["source"] == "export_src.png"  # relative to outputs/, as the gallery names it
+    for f in entry["files"]:
+        assert (export.EXPORT_DIR / f["file"]).stat().st_size == f["bytes"]
+    assert output_writer.process_pool("export")._mp_context.get_start_method() != "fork"
+
+    again = client.post("/export", data={"filename": "export_src.png", "name": "hero-test"}).get_json()
+    assert again["skipped"]
+
+
+def test_export_endpoint_rejects_bad_names(client, output_dir):
+    make_image(output_dir, "export_src2.png")
+    assert client.post("/export", data={"filename": "export_src2.png", "name": "Bad Name"}).status_code == 400
+    assert client.post("/export", data={"filename": "missing.png", "name": "x"}).status_code == 404
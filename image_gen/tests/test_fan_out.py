@@ -0,0 +1,126 @@
+import time
+
+from conftest import wait_for
+from job_store import Job, JobStore, SharedJobStore, rollup
+from scheduler import QueueFull
+
+
+def _children(*states):
+    return [Job(id=f"c{i}", prompt="p", aspect_ratio="1:1", status=status, stage=stage, images=images,
+                error=error, parent="p")
+            for i, (status, stage, images, error) in enumerate(states)]
+
+
+def test_rollup_partial_results_while_children_run():
+    parent = Job(id="p", prompt="p", aspect_ratio="1:1", children=["c0", "c1", "c2"])
+    rollup(parent, _children(("done", "done", ["a.png"], None), ("pending", "calling_model", [], None),
+                             ("pending", "queued", [], None)))
+    assert (parent.status, parent.stage, parent.images, parent.completed) == ("pending", "calling_model", ["a.png"], 1)
+    assert parent.finished is None
+
+
+def test_rollup_done_if_any_child_succeeded():
+    parent = Job(id="p", prompt="p", aspect_ratio="1:1", children=["c0", "c1"])
+    rollup(parent, _children(("error", "error", [], "boom"), ("done", "done", ["b.png"], None)))
+    assert (parent.status, parent.images, parent.error) == ("done", ["b.png"], None)
+    assert parent.finished is not None
+
+
+def test_rollup_all_failed_or_cancelled():
+    parent = Job(id="p", prompt="p", aspect_ratio="1:1", children=["c0", "c1"])
+    rollup(parent, _children(("error", "error", [], "boom"), ("cancelled", "cancelled", [], None)))
+    assert (parent.status, parent.error) == ("error", "boom")
+    parent = Job(id="p", prompt="p", aspect_ratio="1:1", children=["c0", "c1"])
+    rollup(parent, _children(("cancelled", "cancelled", [], None), ("cancelled", "cancelled", [], None)))
+    assert parent.status == "cancelled"
+
+
+def _fan_out_store(store, n_children: int = 2, finish: bool = True):
+    children = [f"child{i}" for i in range(n_children)]
+    store.create("parent", "p", "1:1", children=children)
+    for child in children:
+        store.create(child, "p", "1:1", parent="parent")
+    for child in children[:-1]:
+        store.update(child, status="done", images=[f"{child}.png"])
+    if finish:
+        store.update(children[-1], status="done", images=[f"{children[-1]}.png"])
+    return children
+
+
+def test_finished_children_of_a_live_parent_are_not_evicted(tmp_path):
+    for store in (JobStore(max_jobs=1), SharedJobStore(max_jobs=1, db_path=tmp_path / "shared.db")):
+        _fan_out_store(store, 3, finish=False)
+        for i in range(3):
+            store.create(f"other{i}", "p", "1:1", status="done")
+        assert store.get("child0")["status"] == "done"
+        store.update("child2", status="done", images=["child2.png"])
+        assert store.get("parent")["images"] == ["child0.png", "child1.png", "child2.png"]
+
+
+def test_parent_and_children_are_evicted_together(tmp_path):
+    for store in (JobStore(ttl=0.01, max_jobs=10), SharedJobStore(ttl=0.01, max_jobs=10, db_path=tmp_path / "s.db")):
+        children = _fan_out_store(store)
+        time.sleep(0.02)
+        store.create("trigger", "p", "1:1")
+        assert [store.get(job_id) for job_id in ["parent", *children]] == [None] * 3
+        assert store.get("trigger") is not None
+
+
+def test_fan_out_collects_every_childs_images(client):
+    resp = client.post("/generate", data={"prompt": "fan out test", "aspect_ratio": ["16:9", "1:1"], "samples": 2,
+                                          "size": "1K"})
+    body = resp.get_json()
+    assert len(body["children"]) == 4
+    parent = wait_for(lambda: (s := client.get(f"/status/{body['job_id']}").get_json())["status"] == "done" and s)
+    assert parent["completed"] == 4
+    assert len(parent["images"]) == 4
+    ratios = sorted(client.get(f"/status/{c}").get_json()["aspect_ratio"] for c in body["children"])
+    assert ratios == ["16:9", "16:9", "1:1", "1:1"]
+
+
+def test_cancel_fan_out_cancels_queued_children(client, held_scheduler):
+    body = client.post("/generate", data={"prompt": "cancel me", "aspect_ratio": ["16:9", "1:1"], "size": "1K"}).get_json()
+    assert set(held_scheduler.positions()) == set(body["children"])
+    resp = client.delete(f"/jobs/{body['job_id']}").get_json()
+    assert sorted(resp["cancelled"]) == sorted(body["children"])
+    assert resp["status"] == "cancelled"
+    assert held_scheduler.positions() == {}
+    assert client.delete(f"/jobs/{body['job_id']}").status_code == 409
+
+
+class _FillingScheduler:
+    """Accepts two jobs, then is full. The first was already picked up by a worker, so it can't be cancelled."""
+
+    def __init__(self):
+        self.submitted = []
+
+    def submit(self, job_id, fn, priority=0):
+        if len(self.submitted) == 2:
+            raise QueueFull(7)
+        self.submitted.append(job_id)
+
+    def cancel(self, job_id):
+        return job_id != self.submitted[0]
+
+    def position(self, job_id):
+        return None
+
+
+def test_fan_out_queue_full_keeps_only_children_already_running(client, monkeypatch):
+    import app
+
+    scheduler = _FillingScheduler()
+    monkeypatch.setattr(app, "scheduler", scheduler)
+    created = []
+    create = app.jobs.create
+    monkeypatch.setattr(app.jobs, "create", lambda job_id, *a, **kw: created.append(job_id) or create(job_id, *a, **kw))
+    resp = client.post("/generate", data={"prompt": "too many", "aspect_ratio": ["16:9", "1:1"], "samples": 2,
+                                          "size": "1K"})
+    assert resp.status_code == 429
+    assert resp.headers["Retry-After"] == "7"
+    parent, *children = created
+    running = scheduler.submitted[0]
+    assert app.jobs.get(running) is not None
+    assert [c for c in children if c != running and app.jobs.get(c) is not None] == []
+    assert app.jobs.get(parent) is None
+    app.jobs.update(running, status="done", images=["late.png"])  # the worker finishing it is harmless
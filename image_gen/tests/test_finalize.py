@@ -0,0 +1,58 @@
+import pytest
+
+from conftest import make_image, wait_for
+
+
+def _done(client, job_id):
+    return wait_for(lambda: (s := client.get(f"/status/{job_id}").get_json())["status"] == "done" and s)
+
+
+@pytest.fixture(scope="module")
+def draft(client):
+    body = client.post("/generate", data={"prompt": "a lighthouse draft", "aspect_ratio": "1:1", "size": "1K"}).get_json()
+    return _done(client, body["job_id"])["images"][0]
+
+
+@pytest.mark.parametrize("size", ["2K", "4K"])
+def test_rerun_reuses_the_drafts_inputs_at_a_larger_size(client, draft, size):
+    body = client.post("/finalize", data={"image": draft, "size": size, "mode": "rerun"}).get_json()
+    job = _done(client, body["job_id"])
+    assert (job["prompt"], job["aspect_ratio"], job["size"], job["draft"]) == ("a lighthouse draft", "1:1", size, draft)
+    assert job["ref_ids"] == []
+
+
+def test_reference_mode_passes_the_draft_as_a_reference(client, draft):
+    import refs
+
+    body = client.post("/finalize", data={"image": draft, "size": "2K", "fresh": "1"}).get_json()
+    job = _done(client, body["job_id"])
+    assert len(job["ref_ids"]) == 1
+    assert refs.exists(job["ref_ids"][0])
+    assert job["images"] and job["images"] != [draft]
+
+
+def test_draft_without_a_recorded_prompt_is_rejected(client, output_dir):
+    import app
+
+    make_image(output_dir, "no_metadata.png")
+    app.gallery_index.add("no_metadata.png")
+    resp = client.post("/finalize", data={"image": "no_metadata.png"})
+    assert resp.status_code == 422
+    assert "no recorded prompt" in resp.get_json()["error"]
+
+
+def test_draft_whose_references_are_gone_is_rejected(client, output_dir):
+    import app
+
+    gone = "0" * 32
+    make_image(output_dir, "lost_refs.png")
+    app.gallery_index.add("lost_refs.png", prompt="lost refs", aspect_ratio="1:1", size="1K", ref_ids=[gone])
+    resp = client.post("/finalize", data={"image": "lost_refs.png", "mode": "rerun"})
+    assert resp.status_code == 422
+    assert resp.get_json()["missing_ref_ids"] == [gone]
+
+
+def test_unknown_image_and_bad_params(client, draft):
+    assert client.post("/finalize", data={"image": "missing.png"}).status_code == 404
+    assert client.post("/finalize", data={"image": draft, "mode": "upscale"}).status_code == 400
+    assert client.post("/finalize", data={"image": draft, "size": "8K"}).status_code == 400
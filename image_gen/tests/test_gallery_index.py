@@ -0,0 +1,85 @@
+import pytest
+
+from conftest import make_image
+
+
+@pytest.fixture
+def filled(index, tmp_path):
+    for i in range(7):
+        make_image(tmp_path, f"img_{i}.png", color=(i * 30, 80, 160))
+        index.add(f"img_{i}.png", prompt=f"prompt {i}", created=1000.0 + i)
+    return index
+
+
+def test_pages_cover_every_entry_newest_first(filled):
+    names, cursor = [], None
+    while True:
+        rows, cursor = filled.page(limit=3, cursor=cursor)
+        names += [row["name"] for row in rows]
+        if cursor is None:
+            break
+    assert names == [f"img_{i}.png" for i in reversed(range(7))]
+
+
+def test_since_returns_only_newer_entries(filled):
+    rows, cursor = filled.page(limit=10, since=1004.0)
+    assert [row["name"] for row in rows] == ["img_6.png", "img_5.png"]
+    assert cursor is None
+
+
+def test_since_pages_through_every_newer_entry(filled):
+    names, cursor = [], None
+    while True:
+        rows, cursor = filled.page(limit=2, cursor=cursor, since=1001.0)
+        names += [row["name"] for row in rows]
+        if cursor is None:
+            break
+    assert names == [f"img_{i}.png" for i in (6, 5, 4, 3, 2)]
+
+
+@pytest.mark.parametrize("limit", [0, -5])
+@pytest.mark.parametrize("dedupe", [False, True])
+def test_non_positive_limit_returns_one_entry(filled, limit, dedupe):
+    rows, cursor = filled.page(limit=limit, dedupe=dedupe)
+    assert [row["name"] for row in rows] == ["img_6.png"]
+    assert cursor is not None
+
+
+def test_invalid_cursor_raises_value_error(filled):
+    with pytest.raises(ValueError):
+        filled.page(cursor="not-a-cursor")
+
+
+def test_dedupe_hides_older_near_duplicates(index, tmp_path):
+    make_image(tmp_path, "old.png", pattern=1)
+    make_image(tmp_path, "new.png", pattern=1)
+    make_image(tmp_path, "other.png", color=(20, 200, 20), pattern=6)
+    index.add("old.png", created=1.0)
+    index.add("new.png", created=2.0)
+    index.add("other.png", created=3.0)
+    rows, _ = index.page(dedupe=True)
+    assert [(row["name"], row["duplicates"]) for row in rows] == [("other.png", 0), ("new.png", 1)]
+
+
+@pytest.mark.parametrize("limit", ["0", "-5", "100000"])
+def test_gallery_endpoint_clamps_limit(client, output_dir, limit):
+    import app
+
+    for i in range(2):
+        make_image(output_dir, f"gallery_{i}.png", pattern=i)
+        app.gallery_index.add(f"gallery_{i}.png")
+    for dedupe in ("0", "1"):
+        resp = client.get(f"/gallery?limit={limit}&dedupe={dedupe}")
+        assert resp.status_code == 200
+
+
+@pytest.mark.parametrize("name", [
+    "hello_world_0a1b2c3d_0.png",                       # app job
+    "hello_world_0a1b2c3d_9f8e7d6c_1.png",              # generate.py run
+    "hello_world_16x9_1K_0a1b2c3d_9f8e7d6c_0.webp",     # batch.py run
+    "hello_world_0a1b2c3d_0-2.png",                     # name clash suffix
+])
+def test_prompt_from_filename_strips_generated_suffixes(name):
+    from gallery_index import prompt_from_filename
+
+    assert prompt_from_filename(name) == "hello world"
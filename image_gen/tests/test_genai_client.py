@@ -0,0 +1,38 @@
+from genai_client import ClientManager
+
+
+def _transports(manager, client):
+    return manager._transports[client]
+
+
+def test_key_change_closes_an_unleased_client():
+    manager = ClientManager(backend="gemini")
+    old = manager.get("key-1")
+    sync_http, async_http = _transports(manager, old)
+    new = manager.get("key-2")
+    assert new is not old
+    assert sync_http.is_closed and async_http.is_closed
+    assert manager.get("key-2") is new
+
+
+def test_leased_client_stays_open_until_its_last_lease_ends():
+    manager = ClientManager(backend="gemini")
+    with manager.lease("key-1") as old:
+        second = manager.acquire("key-1")
+        assert second is old
+        sync_http, _ = _transports(manager, old)
+        new = manager.get("key-2")
+        assert new is not old
+        assert not sync_http.is_closed
+    assert not sync_http.is_closed  # the second lease is still running
+    manager.release(old)
+    assert sync_http.is_closed
+    assert not _transports(manager, new)[0].is_closed
+
+
+def test_fake_backend_needs_no_key_and_is_never_closed(monkeypatch):
+    monkeypatch.delenv("GOOGLE_API_KEY", raising=False)
+    manager = ClientManager(backend="fake")
+    with manager.lease() as client:
+        assert manager.get() is client
+    assert manager._leases == {}
@@ -0,0 +1,109 @@
+import asyncio
+import time
+
+import pytest
+
+from fake_backend import FakeClient, FakeConfig
+from generate import generation_config
+from hedging import DeadlineExceeded, Hedger, deadline_in
+import metrics
+
+
+def _hedger(budget: float = 1.0) -> Hedger:
+    hedger = Hedger(percentile=50, budget=budget, min_samples=1)
+    hedger.history.record("1K", 0.2)  # calls slower than 0.2s get hedged
+    return hedger
+
+
+def _tail_then_fast() -> FakeClient:
+    """First call takes 2s (a tail); once a hedge is about to be sent, calls take ~0.05s."""
+    return FakeClient(FakeConfig(latency=0.05, tail_prob=1.0, tail_factor=40, error_rate=0, throttle_rate=0, seed=1))
+
+
+def _request(client: FakeClient, timeouts: list):
+    def request(timeout):
+        timeouts.append(timeout)
+        return client.models.generate_content(model="m", contents=["p"], config=generation_config("1:1", "1K", timeout))
+    return request
+
+
+def test_hedge_wins_against_a_slow_primary():
+    client, timeouts = _tail_then_fast(), []
+    hedger = _hedger()
+    sent = metrics.model_hedges.value(outcome="sent")
+    start = time.monotonic()
+    response = hedger.call(_request(client, timeouts), "1K",
+                           before_hedge=lambda: setattr(client.config, "tail_prob", 0.0))
+    elapsed = time.monotonic() - start
+    assert response.parts[0].inline_data is not None
+    assert 0.2 <= elapsed < 1.0
+    assert client.calls == 2
+    assert metrics.model_hedges.value(outcome="sent") == sent + 1
+    # no deadline was given, but neither request may run unbounded
+    assert all(t is not None and t <= 600 for t in timeouts)
+
+
+def test_no_hedge_without_history_or_budget():
+    client = FakeClient(FakeConfig(latency=0.3, tail_prob=0, error_rate=0, throttle_rate=0, seed=1))
+    cold = Hedger(percentile=50, budget=1.0, min_samples=5)
+    cold.history.record("1K", 0.01)
+    cold.call(_request(client, []), "1K")
+    assert client.calls == 1
+
+    broke = _hedger(budget=0.0)
+    broke.call(_request(client, []), "1K")
+    assert client.calls == 2
+
+
+def test_budget_caps_hedges_per_attempt():
+    hedger = _hedger(budget=0.5)
+    client = FakeClient(FakeConfig(latency=0.3, tail_prob=0, error_rate=0, throttle_rate=0, seed=1))
+    for _ in range(4):
+        hedger.call(_request(client, []), "1K")
+    assert client.calls == 4 + 2  # one hedge per two first attempts
+
+
+def test_deadline_exceeded_fires_on_time():
+    client = FakeClient(FakeConfig(latency=2.0, tail_prob=0, error_rate=0, throttle_rate=0, seed=1))
+    for hedger in (Hedger(percentile=0), _hedger()):
+        start = time.monotonic()
+        with pytest.raises(DeadlineExceeded):
+            hedger.call(_request(client, []), "1K", deadline_in(0.3))
+        assert time.monotonic() - start < 1.0
+
+
+def test_call_async_hedge_wins_and_loser_is_cancelled():
+    client = _tail_then_fast()
+    hedger = _hedger()
+
+    async def request(timeout):
+        return await client.aio.models.generate_content(model="m", contents=["p"],
+                                                         config=generation_config("1:1", "1K", timeout))
+
+    async def before_hedge():
+        client.config.tail_prob = 0.0
+
+    async def run():
+        start = time.monotonic()
+        await hedger.call_async(request, "1K", before_hedge=before_hedge)
+        elapsed = time.monotonic() - start
+        await asyncio.sleep(0)
+        pending = [t for t in asyncio.all_tasks() if t is not asyncio.current_task()]
+        return elapsed, pending
+
+    elapsed, pending = asyncio.run(run())
+    assert elapsed < 1.0
+    assert pending == []
+
+
+def test_call_async_deadline():
+    client = FakeClient(FakeConfig(latency=2.0, tail_prob=0, error_rate=0, throttle_rate=0, seed=1))
+
+    async def request(timeout):
+        return await client.aio.models.generate_content(model="m", contents=["p"],
+                                                         config=generation_config("1:1", "1K", timeout))
+
+    start = time.monotonic()
+    with pytest.raises(DeadlineExceeded):
+        asyncio.run(_hedger().call_async(request, "1K", deadline_in(0.3)))
+    assert time.monotonic() - start < 1.0
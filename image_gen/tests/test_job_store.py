@@ -0,0 +1,87 @@
+import os
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import pytest
+
+from job_store import Job, JobStore, SharedJobStore
+
+IMAGE_GEN_DIR = Path(__file__).resolve().parent.parent
+
+
+@pytest.fixture(params=["memory", "shared"])
+def make_store(request, tmp_path):
+    def make(**kwargs):
+        if request.param == "shared":
+            return SharedJobStore(db_path=tmp_path / "shared.db", **kwargs)
+        return JobStore(db_path=None, **kwargs)
+    return make
+
+
+def test_job_records_are_slotted():
+    job = Job(id="j", prompt="p", aspect_ratio="1:1")
+    assert not hasattr(job, "__dict__")
+    with pytest.raises(AttributeError):
+        job.reference_bytes = b"..."
+    assert set(job.to_dict()) == {"prompt", "aspect_ratio", "size", "status", "stage", "images", "error", "cached",
+                                  "ref_ids"}
+
+
+def test_finished_jobs_expire_after_the_ttl(make_store):
+    store = make_store(ttl=0.05)
+    store.create("done", "p", "1:1", status="done")
+    store.create("running", "p", "1:1")
+    time.sleep(0.1)
+    store.create("trigger", "p", "1:1")
+    assert store.get("done") is None
+    assert store.get("running")["status"] == "pending"
+
+
+def test_oldest_finished_jobs_go_past_the_count_limit(make_store):
+    store = make_store(max_jobs=2)
+    store.create("running", "p", "1:1")
+    for i in range(4):
+        store.create(f"done{i}", "p", "1:1", status="done")
+        time.sleep(0.002)  # distinct finish times
+    assert [store.get(f"done{i}") is not None for i in range(4)] == [False, False, True, True]
+    assert store.get("running") is not None
+    assert len(store) == 3
+
+
+def test_restart_marks_interrupted_jobs_failed_and_keeps_finished_ones(tmp_path):
+    db_path = tmp_path / "jobs.db"
+    before = JobStore(db_path=db_path, ttl=60)
+    before.create("running", "p", "1:1")
+    before.create("done", "p", "1:1", status="done", images=["a.png"])
+    before.create("expired", "p", "1:1", status="done")
+    before._db().execute("UPDATE jobs SET finished = finished - 3600 WHERE id = 'expired'")
+
+    after = JobStore(db_path=db_path, ttl=60)
+    running = after.get("running")
+    assert (running["status"], running["error"]) == ("error", "Interrupted by a server restart")
+    assert after.get("done")["images"] == ["a.png"]
+    assert after.get("expired") is None
+    # a third store over the same file sees the failure that was written, not a pending job
+    assert JobStore(db_path=db_path, ttl=60).get("running")["status"] == "error"
+
+
+def _run(code: str, tmp_path) -> str:
+    env = dict(os.environ, IMAGE_GEN_OUTPUT_DIR=str(tmp_path))
+    out = subprocess.run([sys.executable, "-c", code], cwd=IMAGE_GEN_DIR, env=env, capture_output=True, text=True,
+                         check=True, timeout=60)
+    return out.stdout.strip().splitlines()[-1]
+
+
+def test_pool_workers_rerun_serve_py_not_app_py(tmp_path):
+    # the main script a spawn/forkserver worker re-runs, as seen while `python3 app.py` serves
+    code = ("import runpy, flask; from multiprocessing import spawn; "
+            "flask.Flask.run = lambda self, **kw: print(spawn.get_preparation_data('w')['init_main_from_path']); "
+            "runpy.run_path('app.py', run_name='__main__')")
+    assert _run(code, tmp_path) == str(IMAGE_GEN_DIR / "serve.py")
+
+    # ...and re-running serve.py that way loads neither the app nor its job store
+    code = ("import runpy, sys; runpy.run_path('serve.py', run_name='__mp_main__'); "
+            "print(sorted(m for m in ('app', 'job_store') if m in sys.modules))")
+    assert _run(code, tmp_path) == "[]"
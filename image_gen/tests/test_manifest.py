@@ -0,0 +1,53 @@
+import json
+
+from conftest import make_image
+from manifest import Manifest
+
+
+def _append(manifest: Manifest, tid: str, files: list[str], error: str | None = None):
+    manifest.append(tid, prompt=f"prompt {tid}", model="m", aspect_ratio="16:9", size="1K",
+                    files=files, latency=1.0, error=error)
+
+
+def test_append_after_a_torn_line_starts_a_new_line(tmp_path):
+    manifest = Manifest(tmp_path / "manifest.jsonl")
+    _append(manifest, "a", ["a.png"])
+    with open(manifest.path, "a") as f:
+        f.write('{"task_id": "b", "stat')  # crash mid-write
+    _append(manifest, "c", ["c.png"])
+    lines = manifest.path.read_text().splitlines()
+    assert len(lines) == 3
+    assert json.loads(lines[2])["task_id"] == "c"
+    assert set(manifest.load()) == {"a", "c"}
+
+
+def test_load_skips_lines_that_are_not_records(tmp_path):
+    manifest = Manifest(tmp_path / "manifest.jsonl")
+    manifest.path.write_text('[1, 2]\n{"no_task_id": 1}\n"text"\n5\nnull\n\n')
+    _append(manifest, "a", ["a.png"])
+    assert list(manifest.load()) == ["a"]
+
+
+def test_completed_needs_done_and_files_on_disk_last_record_wins(tmp_path, output_dir):
+    make_image(output_dir, "manifest_kept.png")
+    manifest = Manifest(tmp_path / "manifest.jsonl")
+    _append(manifest, "kept", ["manifest_kept.png"])
+    _append(manifest, "deleted", ["manifest_deleted.png"])
+    _append(manifest, "failed", [], error="quota")
+    _append(manifest, "retried", [], error="quota")
+    _append(manifest, "retried", ["manifest_kept.png"])
+    _append(manifest, "regressed", ["manifest_kept.png"])
+    _append(manifest, "regressed", [], error="quota")
+    assert manifest.completed() == {"kept", "retried"}
+
+
+def test_resume_runs_only_unfinished_tasks(tmp_path, output_dir):
+    from batch import build_sweep, pending_tasks
+
+    tasks = build_sweep(["a red fox", "a blue whale"], ["16:9", "1:1"], ["1K"])
+    manifest = Manifest(tmp_path / "manifest.jsonl")
+    make_image(output_dir, "manifest_fox.png")
+    done = tasks[0]
+    manifest.append(done.id, prompt=done.prompt, model=done.model, aspect_ratio=done.aspect_ratio, size=done.size,
+                    files=["manifest_fox.png"], latency=1.0)
+    assert pending_tasks(tasks, manifest) == tasks[1:]
@@ -0,0 +1,86 @@
+import time
+
+import pytest
+
+import metrics
+
+
+@pytest.fixture
+def registry():
+    reg = metrics.Registry()
+    reg.counter("t_calls_total", "calls")
+    reg.gauge("t_in_flight", "in flight")
+    reg.histogram("t_seconds", "latency", (1, 5))
+    return reg
+
+
+def worker_state(calls=3, in_flight=2, seconds=(0.5, 3.0)):
+    reg = metrics.Registry()
+    reg.counter("t_calls_total", "calls").inc(calls, size="4K")
+    reg.gauge("t_in_flight", "in flight").set(in_flight)
+    hist = reg.histogram("t_seconds", "latency", (1, 5))
+    for s in seconds:
+        hist.observe(s, size="4K")
+    return reg.state()
+
+
+def test_merged_sums_counters_and_histograms(registry):
+    registry._metrics[0].inc(1, size="4K")
+    text = registry.merged([(worker_state(), True), (worker_state(calls=4), False)]).render()
+    assert 't_calls_total{size="4K"} 8' in text
+    assert 't_seconds_count{size="4K"} 4' in text
+    assert 't_seconds_bucket{size="4K",le="1"} 2' in text
+
+
+def test_merged_skips_gauges_from_stale_workers(registry):
+    text = registry.merged([(worker_state(in_flight=2), True), (worker_state(in_flight=5), False)]).render()
+    assert "t_in_flight 2" in text
+
+
+def test_merge_leaves_the_source_registry_alone(registry):
+    registry.merged([(worker_state(), True)])
+    assert "t_calls_total{" not in registry.render()
+
+
+def test_render_shared_includes_published_workers(tmp_path, monkeypatch):
+    monkeypatch.setattr(metrics, "SHARED_DB", tmp_path / "metrics.db")
+    before = metrics.model_retries.value()
+    metrics.model_retries.inc(2)
+    metrics.publish("worker-a")
+    metrics.model_retries.inc(-2)  # as if the retries had happened only in the worker
+    assert metrics.model_retries.value() == before
+    text = metrics.render_shared()
+    assert f"image_gen_model_retries_total {before + 2:g}" in text
+
+
+def test_render_shared_drops_gauges_of_silent_workers(tmp_path, monkeypatch):
+    monkeypatch.setattr(metrics, "SHARED_DB", tmp_path / "metrics.db")
+    with metrics.model_calls_in_flight.track():
+        metrics.publish("worker-b")
+    assert "image_gen_model_calls_in_flight 1" in metrics.render_shared()
+    monkeypatch.setattr(time, "time", lambda: 10 ** 12)
+    assert "image_gen_model_calls_in_flight 1" not in metrics.render_shared()
+
+
+def test_render_shared_counts_this_processs_own_snapshot_once(tmp_path, monkeypatch):
+    monkeypatch.setattr(metrics, "SHARED_DB", tmp_path / "metrics.db")
+    monkeypatch.setattr(metrics, "_publishing_as", "web-a")
+    before = metrics.model_retries.value()
+    metrics.model_retries.inc(3)
+    metrics.publish("web-a")
+    metrics.publish("web-b")  # another web process that saw the same retries
+    assert f"image_gen_model_retries_total {before + 6:g}" in metrics.render_shared()
+    metrics.model_retries.inc(-3)
+
+
+def test_callback_gauges_are_not_published(registry):
+    registry._metrics[1].set_function(lambda: 7)
+    assert "t_in_flight" in registry.state()
+    assert "t_in_flight" not in registry.state(callbacks=False)
+
+
+def test_percentile_is_nearest_rank():
+    assert metrics.percentile([], 50) is None
+    assert metrics.percentile([3.0, 1.0, 2.0], 50) == 2.0
+    assert metrics.percentile(range(1, 101), 95) == 96
+    assert metrics.percentile([5.0], 99) == 5.0
@@ -0,0 +1,68 @@
+import io
+
+import pytest
+from PIL import Image
+
+from conftest import make_image
+import refs
+from refs import RefError
+
+
+class _Upload(io.BytesIO):
+    """An upload stream that records how much each read asked for."""
+
+    def __init__(self, data: bytes):
+        super().__init__(data)
+        self.reads = []
+
+    def read(self, size=-1):
+        self.reads.append(size)
+        return super().read(size)
+
+
+def _png(tmp_path, size, pattern=0) -> bytes:
+    return make_image(tmp_path, f"ref_{size[0]}x{size[1]}_{pattern}.png", size=size, pattern=pattern).read_bytes()
+
+
+def _leftovers():
+    return list(refs.REF_DIR.glob(".upload-*"))
+
+
+def test_upload_is_streamed_in_chunks_and_downscaled(tmp_path):
+    upload = _Upload(_png(tmp_path, (3000, 1500), pattern=3))
+    ref_id = refs.ingest(upload)
+    assert set(upload.reads) == {refs.CHUNK_SIZE}
+    with Image.open(refs.ref_path(ref_id)) as img:
+        assert (img.format, img.size) == ("WEBP", (refs.MAX_REF_EDGE, refs.MAX_REF_EDGE // 2))
+    assert refs.load_part(ref_id).inline_data.mime_type == "image/webp"
+    assert not _leftovers()
+
+
+def test_small_images_keep_their_size(tmp_path):
+    ref_id = refs.ingest(io.BytesIO(_png(tmp_path, (200, 100), pattern=4)))
+    with Image.open(refs.ref_path(ref_id)) as img:
+        assert img.size == (200, 100)
+
+
+def test_same_upload_is_recognized_by_hash_without_decoding(tmp_path, monkeypatch):
+    data = _png(tmp_path, (300, 300), pattern=5)
+    ref_id = refs.ingest(io.BytesIO(data))
+    monkeypatch.setattr(refs, "_normalize", lambda src, dest: pytest.fail("decoded a known upload"))
+    assert refs.ingest(io.BytesIO(data)) == ref_id
+
+
+def test_oversized_upload_stops_early_and_leaves_nothing(tmp_path):
+    upload = _Upload(b"x" * (refs.CHUNK_SIZE * 4))
+    with pytest.raises(RefError, match="exceeds"):
+        refs.ingest(upload, max_bytes=refs.CHUNK_SIZE + 1)
+    assert len(upload.reads) == 2
+    assert not _leftovers()
+
+
+def test_unreadable_upload_and_unknown_ids_are_rejected():
+    with pytest.raises(RefError, match="Unreadable"):
+        refs.ingest(io.BytesIO(b"not an image"))
+    assert not _leftovers()
+    assert not refs.exists("../../etc/passwd")
+    with pytest.raises(RefError):
+        refs.load_part("0" * 32)
@@ -0,0 +1,117 @@
+import threading
+
+import pytest
+
+from conftest import make_image, wait_for
+from result_cache import InFlight, ResultCache, cache_key
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return ResultCache(db_path=tmp_path / "results.db", max_age=0, max_bytes=0)
+
+
+def _age(cache: ResultCache, key: str, seconds: float):
+    cache._db().execute("UPDATE results SET created = created - ?, last_hit = last_hit - ? WHERE key = ?",
+                        (seconds, seconds, key))
+
+
+def test_key_covers_every_input():
+    base = cache_key("model", "a cat", "1:1", "4K", ["ref"])
+    assert base == cache_key("model", "a cat", "1:1", "4K", ["ref"])
+    for other in (cache_key("model", "a dog", "1:1", "4K", ["ref"]), cache_key("model", "a cat", "16:9", "4K", ["ref"]),
+                  cache_key("model", "a cat", "1:1", "1K", ["ref"]), cache_key("model", "a cat", "1:1", "4K")):
+        assert other != base
+
+
+def test_hit_returns_files_and_deleted_outputs_miss(cache, output_dir):
+    make_image(output_dir, "cache_hit.png")
+    cache.put("k", ["cache_hit.png"])
+    assert cache.get("k") == ["cache_hit.png"]
+
+    (output_dir / "cache_hit.png").unlink()
+    assert cache.get("k") is None
+    assert cache._db().execute("SELECT COUNT(*) FROM results").fetchone()[0] == 0
+
+
+def test_entries_expire_by_age(cache, output_dir):
+    cache.max_age = 60
+    make_image(output_dir, "cache_old.png")
+    make_image(output_dir, "cache_new.png")
+    cache.put("old", ["cache_old.png"])
+    cache.put("new", ["cache_new.png"])
+    _age(cache, "old", 120)
+    assert cache.get("old") is None
+    assert cache.get("new") == ["cache_new.png"]
+
+    _age(cache, "new", 120)
+    assert cache.evict() == 1
+
+
+def test_byte_budget_evicts_least_recently_hit(cache, output_dir):
+    for name in ("lru_a.png", "lru_b.png", "lru_c.png"):
+        make_image(output_dir, name)
+        cache.put(name, [name])
+    size = (output_dir / "lru_a.png").stat().st_size
+    _age(cache, "lru_a.png", 30)
+    _age(cache, "lru_b.png", 20)
+    cache.get("lru_a.png")  # a hit makes it the most recent
+
+    cache.max_bytes = 2 * size
+    assert cache.evict() == 1
+    assert cache.get("lru_b.png") is None
+    assert cache.get("lru_a.png") and cache.get("lru_c.png")
+
+
+def test_in_flight_lets_exactly_one_concurrent_claimer_own_a_key():
+    in_flight = InFlight()
+    barrier = threading.Barrier(8)
+    results = {}
+
+    def claim(owner):
+        barrier.wait()
+        results[owner] = in_flight.claim("key", owner)
+
+    threads = [threading.Thread(target=claim, args=(f"job{i}",)) for i in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    owners = [owner for owner, existing in results.items() if existing is None]
+    assert len(owners) == 1
+    assert all(existing == owners[0] for owner, existing in results.items() if owner != owners[0])
+
+    in_flight.release_owner(owners[0])
+    assert in_flight.claim("key", "next") is None
+
+
+def test_identical_submissions_coalesce_onto_the_queued_job(client, held_scheduler):
+    data = {"prompt": "coalesce me", "size": "1K"}
+    first = client.post("/generate", data=data).get_json()
+    second = client.post("/generate", data=data).get_json()
+    assert second == {"job_id": first["job_id"], "coalesced": True}
+    assert list(held_scheduler.positions()) == [first["job_id"]]
+
+    fresh = client.post("/generate", data=dict(data, fresh="1")).get_json()
+    assert fresh["job_id"] != first["job_id"]
+    assert client.delete(f"/jobs/{first['job_id']}").status_code == 200
+    # cancelling the owner frees the key for the next submission
+    third = client.post("/generate", data=data).get_json()
+    assert third["job_id"] not in (first["job_id"], fresh["job_id"])
+    for job_id in (fresh["job_id"], third["job_id"]):
+        client.delete(f"/jobs/{job_id}")
+
+
+def test_repeat_generation_is_served_from_cache_unless_fresh(client):
+    data = {"prompt": "cache me once", "size": "1K"}
+    first = client.post("/generate", data=data).get_json()
+    done = wait_for(lambda: (s := client.get(f"/status/{first['job_id']}").get_json())["status"] == "done" and s)
+
+    repeat = client.post("/generate", data=data).get_json()
+    assert repeat["cached"] is True
+    assert client.get(f"/status/{repeat['job_id']}").get_json()["images"] == done["images"]
+
+    fresh = client.post("/generate", data=dict(data, fresh="1")).get_json()
+    assert "cached" not in fresh
+    again = wait_for(lambda: (s := client.get(f"/status/{fresh['job_id']}").get_json())["status"] == "done" and s)
+    assert again["images"] != done["images"]
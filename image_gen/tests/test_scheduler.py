@@ -0,0 +1,76 @@
+import threading
+
+import pytest
+
+from conftest import wait_for
+from scheduler import PRIORITY_BATCH, PRIORITY_INTERACTIVE, JobScheduler, QueueFull
+
+
+@pytest.fixture
+def held():
+    """A one-worker scheduler whose worker is busy until ``release`` is set."""
+    release = threading.Event()
+    scheduler = JobScheduler(concurrency=1, max_queue=3)
+    scheduler.submit("blocker", release.wait)
+    wait_for(lambda: scheduler.is_running("blocker"))
+    yield scheduler, release
+    release.set()
+
+
+def test_interactive_jobs_run_before_batch_jobs_in_submission_order(held):
+    scheduler, release = held
+    ran = []
+    for job_id, priority in (("batch-1", PRIORITY_BATCH), ("click-1", PRIORITY_INTERACTIVE),
+                             ("batch-2", PRIORITY_BATCH)):
+        scheduler.submit(job_id, lambda job_id=job_id: ran.append(job_id), priority)
+    assert scheduler.positions() == {"click-1": 1, "batch-1": 2, "batch-2": 3}
+
+    release.set()
+    wait_for(lambda: len(ran) == 3)
+    assert ran == ["click-1", "batch-1", "batch-2"]
+
+
+def test_full_queue_raises_with_a_retry_hint(held):
+    scheduler, _ = held
+    for i in range(3):
+        scheduler.submit(f"job-{i}", lambda: None)
+    with pytest.raises(QueueFull) as exc:
+        scheduler.submit("one-too-many", lambda: None)
+    # four queued jobs on one worker at the initial 30s average
+    assert exc.value.retry_after == 120
+    assert "one-too-many" not in scheduler.positions()
+
+
+def test_cancel_removes_only_queued_jobs(held):
+    scheduler, release = held
+    ran = []
+    scheduler.submit("a", lambda: ran.append("a"))
+    scheduler.submit("b", lambda: ran.append("b"))
+    assert scheduler.cancel("a")
+    assert not scheduler.cancel("blocker")  # running
+    assert not scheduler.cancel("unknown")
+    assert scheduler.positions() == {"b": 1}
+
+    release.set()
+    wait_for(lambda: ran)
+    assert ran == ["b"]
+
+
+def test_generate_returns_429_with_retry_after_when_full(client, held_scheduler):
+    for i in range(held_scheduler.max_queue):
+        held_scheduler.submit(f"filler-{i}", lambda: None)
+    resp = client.post("/generate", data={"prompt": "no room", "size": "1K", "fresh": "1"})
+    assert resp.status_code == 429
+    assert int(resp.headers["Retry-After"]) >= 1
+    assert "full" in resp.get_json()["error"]
+
+
+def test_cancel_queued_generate_job(client, held_scheduler):
+    body = client.post("/generate", data={"prompt": "cancel queued", "size": "1K", "fresh": "1"}).get_json()
+    assert body["queue_position"] == 1
+
+    resp = client.delete(f"/jobs/{body['job_id']}")
+    assert resp.get_json() == {"job_id": body["job_id"], "status": "cancelled"}
+    assert held_scheduler.positions() == {}
+    assert client.get(f"/status/{body['job_id']}").get_json()["status"] == "cancelled"
+    assert client.delete(f"/jobs/{body['job_id']}").status_code == 409
@@ -0,0 +1,81 @@
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+from job_store import SharedJobStore
+from scheduler import PRIORITY_BATCH, PRIORITY_INTERACTIVE, QueueFull
+from shared_queue import SharedQueue
+
+IMAGE_GEN_DIR = Path(__file__).resolve().parent.parent
+
+
+@pytest.fixture
+def queue(tmp_path):
+    return SharedQueue(max_queue=3, db_path=tmp_path / "queue.db")
+
+
+def test_claims_follow_priority_then_submission_order(queue):
+    queue.submit("batch", {"n": 1}, PRIORITY_BATCH)
+    queue.submit("first", {"n": 2}, PRIORITY_INTERACTIVE)
+    queue.submit("second", {"n": 3}, PRIORITY_INTERACTIVE)
+    assert queue.positions() == {"first": 1, "second": 2, "batch": 3}
+
+    assert queue.claim() == ("first", {"n": 2})
+    assert queue.is_running("first")
+    assert queue.position("second") == 1
+    assert [queue.claim()[0], queue.claim()[0]] == ["second", "batch"]
+    assert queue.claim() is None
+    assert queue.stats() == dict(queued=0, running=3, busy_workers=1)
+
+
+def test_finish_acks_a_claimed_job(queue):
+    queue.submit("job", {})
+    queue.claim()
+    queue.finish("job")
+    assert not queue.is_running("job")
+    assert queue.stats()["running"] == 0
+
+
+def test_identical_keys_coalesce_until_the_job_finishes(queue):
+    assert queue.submit("a", {}, key="k") is None
+    assert queue.submit("b", {}, key="k") == "a"
+    queue.claim()
+    assert queue.submit("c", {}, key="k") == "a"  # running entries coalesce too
+    queue.finish("a")
+    assert queue.submit("d", {}, key="k") is None
+
+
+def test_full_queue_and_cancel(queue):
+    for i in range(3):
+        queue.submit(f"job{i}", {})
+    with pytest.raises(QueueFull):
+        queue.submit("overflow", {})
+    queue.claim()
+    assert not queue.cancel("job0")  # running
+    assert queue.cancel("job1")
+    assert queue.positions() == {"job2": 1}
+
+
+def test_reap_drops_jobs_claimed_by_a_process_that_died(queue, tmp_path):
+    jobs = SharedJobStore(db_path=tmp_path / "jobs.db")
+    for job_id in ("orphan", "mine"):
+        jobs.create(job_id, "p", "1:1")
+        queue.submit(job_id, {})
+    # another process claims the first job and exits without finishing it
+    code = (f"from shared_queue import SharedQueue; "
+            f"print(SharedQueue(db_path={str(queue.db_path)!r}).claim()[0])")
+    out = subprocess.run([sys.executable, "-c", code], cwd=IMAGE_GEN_DIR, capture_output=True, text=True, check=True,
+                         env=dict(os.environ, IMAGE_GEN_OUTPUT_DIR=str(tmp_path)), timeout=60)
+    assert out.stdout.strip() == "orphan"
+    assert queue.claim()[0] == "mine"
+
+    reaped = queue.reap()
+    assert reaped == ["orphan"]
+    assert queue.is_running("mine")  # this process is alive
+    for job_id in reaped:  # as the worker.py supervisor does
+        jobs.fail_pending(job_id, "Generator worker exited mid-job")
+    assert jobs.get("orphan")["status"] == "error"
+    assert jobs.get("mine")["status"] == "pending"
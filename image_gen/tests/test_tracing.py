@@ -0,0 +1,49 @@
+import threading
+
+import tracing
+from tracing import Tracer, load_events
+
+
+def test_events_are_buffered_until_flushed(tmp_path, monkeypatch):
+    monkeypatch.setattr(tracing, "FLUSH_INTERVAL", 3600)
+    path = tmp_path / "trace.json"
+    tracer = Tracer(path)
+    with tracer.span("quiet"):
+        pass
+    assert not path.exists()
+    tracer.flush()
+    assert [e["name"] for e in load_events(path)] == ["quiet"]
+
+
+def test_writers_sharing_a_file_write_one_header(tmp_path, monkeypatch):
+    monkeypatch.setattr(tracing, "FLUSH_INTERVAL", 3600)
+    path = tmp_path / "trace.json"
+    tracers = [Tracer(path) for _ in range(8)]
+    for i, t in enumerate(tracers):
+        t.complete(f"span{i}", 1.0, 2.0)
+    barrier = threading.Barrier(len(tracers))
+
+    def flush(t):
+        barrier.wait()
+        t.flush()
+
+    threads = [threading.Thread(target=flush, args=(t,)) for t in tracers]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert path.read_text().startswith("[\n")
+    assert path.read_text().count("[") == 1
+    assert sorted(e["name"] for e in load_events(path)) == [f"span{i}" for i in range(8)]
+    assert [p.name for p in tmp_path.iterdir()] == ["trace.json"]
+
+
+def test_tracers_register_no_fork_or_exit_hooks_of_their_own(tmp_path, monkeypatch):
+    registered = []
+    monkeypatch.setattr(tracing.atexit, "register", registered.append)
+    monkeypatch.setattr(tracing.os, "register_at_fork", lambda **hooks: registered.append(hooks))
+    tracer = Tracer(tmp_path / "a.json")
+    tracer.enable(tmp_path / "b.json")
+    Tracer()
+    assert registered == []
+    assert tracer in tracing._tracers  # flushed at exit and reset after fork by the module's hooks
@@ -0,0 +1,73 @@
+import io
+import threading
+import time
+
+import pytest
+from PIL import Image, features
+
+from conftest import make_image
+
+
+@pytest.fixture(scope="module")
+def source(output_dir):
+    return make_image(output_dir, "variant_src.png", size=(1000, 500), pattern=1)
+
+
+def test_range_request_returns_partial_content(client, source):
+    resp = client.get("/outputs/variant_src.png", headers={"Range": "bytes=0-9"})
+    assert resp.status_code == 206
+    assert resp.data == source.read_bytes()[:10]
+    assert resp.headers["Content-Range"] == f"bytes 0-9/{source.stat().st_size}"
+
+
+@pytest.mark.parametrize("fmt", ["webp", "avif"])
+def test_width_variant_is_snapped_up_and_converted(client, source, fmt):
+    if fmt == "avif" and not features.check("avif"):
+        pytest.skip("Pillow built without AVIF")
+    resp = client.get(f"/outputs/variant_src.png?w=300&fmt={fmt}")
+    assert resp.status_code == 200
+    assert resp.mimetype == f"image/{fmt}"
+    assert "immutable" in resp.headers["Cache-Control"]
+    with Image.open(io.BytesIO(resp.data)) as img:
+        assert img.size == (320, 160)
+
+
+def test_full_size_format_variant(client, source):
+    resp = client.get("/outputs/variant_src.png?fmt=webp")
+    assert resp.status_code == 200
+    with Image.open(io.BytesIO(resp.data)) as img:
+        assert (img.format, img.size) == ("WEBP", (1000, 500))
+
+
+@pytest.mark.parametrize("query", ["w=0", "w=-5", "w=abc", "fmt=gif"])
+def test_bad_variant_params_are_400(client, source, query):
+    assert client.get(f"/outputs/variant_src.png?{query}").status_code == 400
+
+
+def test_variant_paths_are_distinct_per_output():
+    from variants import variant_path
+
+    assert variant_path("a/b.png", 160, "webp") != variant_path("a__b.png", 160, "webp")
+    assert variant_path("a.png", 160, "webp") != variant_path("a.png", None, "webp")
+
+
+def test_concurrent_requests_build_a_variant_once(source, monkeypatch):
+    import variants
+
+    calls = []
+
+    def slow_render(fn, *args):
+        calls.append(args)
+        time.sleep(0.05)
+        return fn(*args)
+
+    monkeypatch.setattr(variants, "run_in_pool", slow_render)
+    variants.variant_path(source.name, 640, "webp").unlink(missing_ok=True)
+    threads = [threading.Thread(target=variants.get_variant, args=(source.name, source, 640, "webp"))
+               for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(calls) == 1
+    assert variants._building == {}
@@ -0,0 +1,99 @@
+"""
+Thumbnail + blur-placeholder cache for the gallery grid.
+
+Thumbnails are downscaled WebPs stored next to the outputs in
+``outputs/.thumbs/``, under the output's relative path plus ``.webp``
+(``a/b.png`` -> ``.thumbs/a/b.png.webp``), so ``b.png`` and ``b.jpg`` or
+same-named files in different directories never share one. Each thumbnail also gets a tiny blurred placeholder
+(a base64 data URI) stored as a ``.lqip`` text file, so the grid can paint
+something immediately while the real thumbnail loads.
+
+A thumbnail is considered stale when its source image has a newer mtime, in
+which case it is rebuilt on the next request.
+"""
+
+import base64
+import io
+from pathlib import Path
+
+from PIL import Image, ImageFilter
+
+from config import OUTPUT_DIR
+import metrics
+from output_writer import write_atomic
+from perceptual_hash import dhash
+
+# ---------------------------------------------------------------------------
+# Config
+# ---------------------------------------------------------------------------
+THUMB_DIR = OUTPUT_DIR / ".thumbs"
+THUMB_DIR.mkdir(exist_ok=True)
+
+THUMB_WIDTH = 480
+THUMB_QUALITY = 72
+PLACEHOLDER_WIDTH = 16
+
+
+def thumb_path(filename: str) -> Path:
+    return THUMB_DIR / f"{filename}.webp"
+
+
+def placeholder_path(filename: str) -> Path:
+    return THUMB_DIR / f"{filename}.lqip"
+
+
+def is_fresh(derived: Path, source: Path) -> bool:
+    """Whether a derived file exists and is at least as new as its source."""
+    try:
+        return derived.stat().st_mtime >= source.stat().st_mtime
+    except FileNotFoundError:
+        return False
+
+
+def build_thumbnail(filename: str) -> tuple[Path, int]:
+    """Create the thumbnail and placeholder for an output image. Returns the thumbnail path and the image's dHash.
+
+    The hash is taken from the already-decoded thumbnail, so indexing a new
+    output doesn't decode the full-size image a second time.
+    """
+    with metrics.codec_seconds.time(op="thumbnail"):
+        return _build_thumbnail(filename)
+
+
+def _build_thumbnail(filename: str) -> tuple[Path, int]:
+    with Image.open(OUTPUT_DIR / filename) as image:
+        image.draft("RGB", (THUMB_WIDTH, THUMB_WIDTH))  # cheap JPEG downscale on decode
+        image = image.convert("RGB")
+
+    thumb = image
+    thumb.thumbnail((THUMB_WIDTH, THUMB_WIDTH * 4), Image.Resampling.LANCZOS)
+    buf = io.BytesIO()
+    thumb.save(buf, "WEBP", quality=THUMB_QUALITY, method=4)
+    thumb_path(filename).parent.mkdir(parents=True, exist_ok=True)
+    write_atomic(thumb_path(filename), buf.getvalue())
+
+    tiny = thumb.copy()
+    tiny.thumbnail((PLACEHOLDER_WIDTH, PLACEHOLDER_WIDTH * 4))
+    tiny = tiny.filter(ImageFilter.GaussianBlur(1))
+    buf = io.BytesIO()
+    tiny.save(buf, "WEBP", quality=30)
+    uri = "data:image/webp;base64," + base64.b64encode(buf.getvalue()).decode("ascii")
+    write_atomic(placeholder_path(filename), uri.encode("ascii"))
+
+    return thumb_path(filename), dhash(thumb)
+
+
+def ensure_thumbnail(filename: str) -> Path:
+    """Return the thumbnail path, rebuilding it if missing or older than its source."""
+    path = thumb_path(filename)
+    if not is_fresh(path, OUTPUT_DIR / filename):
+        build_thumbnail(filename)
+    return path
+
+
+def get_placeholder(filename: str) -> str | None:
+    """Return the cached blur placeholder data URI, or None if not built yet."""
+    path = placeholder_path(filename)
+    if not is_fresh(path, OUTPUT_DIR / filename):
+        return None
+    return path.read_text()
@@ -0,0 +1,253 @@
+"""
+Opt-in tracing of job stages to a Chrome trace-event file.
+
+With tracing on, each job stage (queued, rate-limit wait, model request,
+encode, disk write, thumbnail, ...) is recorded as a span with its process
+and thread id. The file opens in https://ui.perfetto.dev or
+chrome://tracing, like the ``.next/trace`` files from the frontend build.
+When tracing is off, ``span()`` returns a shared no-op context manager,
+so leaving the spans in hot paths costs next to nothing.
+
+Events are appended in the JSON Array Format with the closing ``]`` left
+off, which both viewers accept. The app, worker.py processes and CLIs can
+all write to the same file. Buffered events are written every
+IMAGE_GEN_TRACE_FLUSH seconds, after 256 events, and at exit, so a quiet
+long-running server still shows up, and a crash loses only the last
+few seconds.
+
+    IMAGE_GEN_TRACE        trace file to append to (default: unset = tracing off)
+    IMAGE_GEN_TRACE_FLUSH  seconds between writes  (default 2)
+
+Usage:
+  IMAGE_GEN_TRACE=trace.json python3 app.py
+  python3 generate.py --trace trace.json
+
+  # Where did the time go, per stage:
+  python3 tracing.py trace.json
+  python3 tracing.py trace.json --by cat
+"""
+
+import argparse
+import atexit
+import contextlib
+import json
+import os
+import threading
+import time
+import weakref
+from pathlib import Path
+
+from config import env_float
+
+FLUSH_EVERY = 256  # buffered events per write
+FLUSH_INTERVAL = env_float("IMAGE_GEN_TRACE_FLUSH", 2.0)
+
+_NULL_SPAN = contextlib.nullcontext()
+_tracers: "weakref.WeakSet[Tracer]" = weakref.WeakSet()
+
+
+class _Span:
+    __slots__ = ("tracer", "name", "cat", "args", "ts", "start")
+
+    def __init__(self, tracer: "Tracer", name: str, cat: str, args: dict):
+        self.tracer = tracer
+        self.name = name
+        self.cat = cat
+        self.args = args
+
+    def __enter__(self):
+        self.ts = time.time_ns() // 1000
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        dur = (time.perf_counter_ns() - self.start) // 1000
+        if exc_type is not None:
+            self.args["error"] = exc_type.__name__
+        self.tracer._emit(self.name, self.cat, self.ts, dur, self.args)
+        return False
+
+
+class Tracer:
+    def __init__(self, path: str | Path | None = None):
+        self.path: Path | None = None
+        self._lock = threading.Lock()
+        self._buffer: list[str] = []
+        self._named: set[int] = set()
+        self._flusher_pid: int | None = None
+        if path:
+            self.enable(path)
+        _tracers.add(self)
+
+    @property
+    def enabled(self) -> bool:
+        return self.path is not None
+
+    def enable(self, path: str | Path):
+        """Start appending events to ``path``."""
+        self.path = Path(path)
+
+    def span(self, name: str, cat: str = "job", **args):
+        """Context manager recording a span around its block; ``args`` show up in the viewer."""
+        if self.path is None:
+            return _NULL_SPAN
+        return _Span(self, name, cat, args)
+
+    def complete(self, name: str, start: float, end: float, cat: str = "job", **args):
+        """Record a span that has already happened; ``start``/``end`` are time.time() stamps."""
+        if self.path is None:
+            return
+        ts = int(start * 1e6)
+        self._emit(name, cat, ts, max(0, int(end * 1e6) - ts), args)
+
+    def _emit(self, name: str, cat: str, ts: int, dur: int, args: dict):
+        pid, tid = os.getpid(), threading.get_ident()
+        event = {"name": name, "cat": cat, "ph": "X", "ts": ts, "dur": dur, "pid": pid, "tid": tid}
+        if args:
+            event["args"] = args
+        line = json.dumps(event, default=str)
+        if self._flusher_pid != pid:
+            self._start_flusher(pid)
+        with self._lock:
+            if tid not in self._named:
+                self._named.add(tid)
+                self._buffer.append(json.dumps({"name": "thread_name", "ph": "M", "pid": pid, "tid": tid,
+                                                "args": {"name": threading.current_thread().name}}))
+            self._buffer.append(line)
+            full = len(self._buffer) >= FLUSH_EVERY
+        if full:
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            events, self._buffer = self._buffer, []
+        if not events or self.path is None:
+            return
+        data = "".join(f"{e},\n" for e in events).encode()
+        if not self.path.exists():
+            self._create()
+        # one O_APPEND write per batch, so processes sharing the file don't interleave mid-line
+        fd = os.open(self.path, os.O_WRONLY | os.O_APPEND)
+        try:
+            os.write(fd, data)
+        finally:
+            os.close(fd)
+
+    def _create(self):
+        """Create the trace file already holding its "[" header, unless another writer got there first.
+
+        The header goes into a private file that is then linked into place, so
+        no other process can ever append to the trace before the header is in.
+        """
+        tmp = self.path.with_name(f".{self.path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+        try:
+            os.write(fd, b"[\n")
+        finally:
+            os.close(fd)
+        try:
+            os.link(tmp, self.path)
+        except FileExistsError:
+            pass
+        finally:
+            tmp.unlink()
+
+    def _start_flusher(self, pid: int):
+        """Flush every FLUSH_INTERVAL from a daemon thread (one per process: threads don't survive a fork)."""
+        with self._lock:
+            if self._flusher_pid == pid:
+                return
+            self._flusher_pid = pid
+
+        def loop():
+            while True:
+                time.sleep(FLUSH_INTERVAL)
+                try:
+                    self.flush()
+                except OSError as e:
+                    print(f"Trace flush failed: {e}")
+
+        threading.Thread(target=loop, name="trace-flush", daemon=True).start()
+
+    def _reset(self):
+        # a forked child must not flush the events its parent had buffered
+        self._lock = threading.Lock()
+        self._buffer = []
+        self._named = set()
+
+
+def _flush_all():
+    for t in list(_tracers):
+        try:
+            t.flush()
+        except OSError as e:
+            print(f"Trace flush failed: {e}")
+
+
+def _reset_all():
+    for t in list(_tracers):
+        t._reset()
+
+
+# once per process, for every tracer
+atexit.register(_flush_all)
+os.register_at_fork(after_in_child=_reset_all)
+
+tracer = Tracer(os.getenv("IMAGE_GEN_TRACE") or None)
+span = tracer.span
+
+
+# ---------------------------------------------------------------------------
+# Summary CLI
+# ---------------------------------------------------------------------------
+def load_events(path: str | Path) -> list[dict]:
+    """Complete ("X") events from a trace file, whether or not its array was closed."""
+    text = Path(path).read_text().strip()
+    if not text:
+        return []
+    if not text.endswith("]"):
+        text = text.rstrip(",") + "]"
+    return [e for e in json.loads(text) if e.get("ph") == "X"]
+
+
+def summarize(events: list[dict], by: str = "name") -> list[dict]:
+    """Per-group count and total/mean/p50/p95/max seconds, biggest total first."""
+    groups: dict[str, list[float]] = {}
+    for e in events:
+        groups.setdefault(str(e.get(by, "")), []).append(e["dur"] / 1e6)
+    rows = []
+    for key, durations in groups.items():
+        durations.sort()
+        n = len(durations)
+        rows.append(dict(key=key, count=n, total=sum(durations), mean=sum(durations) / n,
+                         p50=durations[int(0.5 * (n - 1))], p95=durations[int(0.95 * (n - 1))], max=durations[-1]))
+    rows.sort(key=lambda r: r["total"], reverse=True)
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Summarize where time went in a trace file")
+    parser.add_argument("trace", type=Path, help="Trace file written with IMAGE_GEN_TRACE or --trace")
+    parser.add_argument("--by", choices=["name", "cat"], default="name", help="Group spans by stage name or category")
+    args = parser.parse_args()
+
+    events = load_events(args.trace)
+    if not events:
+        print(f"No spans in {args.trace}")
+        return
+    start = min(e["ts"] for e in events)
+    end = max(e["ts"] + e["dur"] for e in events)
+    processes = len({e["pid"] for e in events})
+    threads = len({(e["pid"], e["tid"]) for e in events})
+    print(f"{len(events)} spans over {(end - start) / 1e6:.1f}s wall, {processes} processes, {threads} threads\n")
+
+    rows = summarize(events, args.by)
+    width = max(len(args.by), *(len(r["key"]) for r in rows))
+    print(f"{args.by:<{width}}  {'count':>6}  {'total s':>9}  {'mean s':>8}  {'p50 s':>8}  {'p95 s':>8}  {'max s':>8}")
+    for r in rows:
+        print(f"{r['key']:<{width}}  {r['count']:>6}  {r['total']:>9.2f}  {r['mean']:>8.3f}  "
+              f"{r['p50']:>8.3f}  {r['p95']:>8.3f}  {r['max']:>8.3f}")
+
+
+if __name__ == "__main__":
+    main()
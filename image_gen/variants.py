@@ -0,0 +1,188 @@
+"""
+Content ETags and resized variants for ``/outputs``.
+
+Output filenames never change content — every writer picks a new name per
+run and output_writer.write_image refuses to replace an existing file — so
+files are served with a strong ETag (a hash of the bytes, computed once per
+file version) and ``Cache-Control: immutable``. Replace an output by hand
+under a new name, or browsers keep the old copy. ``?w=`` / ``?fmt=`` ask for a resized WebP or
+AVIF copy instead. Requested widths are snapped up to a fixed ladder so the
+number of variants per image stays small. Variants are built in the encoder
+process pool, stored under ``outputs/.variants/`` (named by a hash of the
+output's path, so no two outputs can share a variant file) and evicted
+least recently used first once the directory passes its size cap:
+
+    IMAGE_GEN_VARIANT_MAX_BYTES  variant cache size cap  (default 1 GB)
+    IMAGE_GEN_VARIANT_QUALITY    WebP/AVIF quality       (default 80)
+"""
+
+import functools
+import hashlib
+import io
+import os
+import threading
+from pathlib import Path
+
+from config import OUTPUT_DIR, env_int
+import metrics
+from output_writer import run_in_pool, write_atomic
+from thumbs import is_fresh
+
+VARIANT_DIR = OUTPUT_DIR / ".variants"
+VARIANT_DIR.mkdir(exist_ok=True)
+
+VARIANT_MAX_BYTES = env_int("IMAGE_GEN_VARIANT_MAX_BYTES", 1024 * 1024 * 1024)
+VARIANT_QUALITY = env_int("IMAGE_GEN_VARIANT_QUALITY", 80)
+
+WIDTHS = (160, 320, 480, 640, 768, 960, 1280, 1600, 1920, 2560, 3840)
+FORMATS = {"webp": ("WEBP", "image/webp"), "avif": ("AVIF", "image/avif")}
+
+_lock = threading.Lock()
+_building: dict[Path, list] = {}  # variant path -> [build lock, requests using it]
+_total_bytes: int | None = None
+
+
+class VariantError(ValueError):
+    """Raised for unsupported ``w`` / ``fmt`` values."""
+
+
+# ---------------------------------------------------------------------------
+# ETags
+# ---------------------------------------------------------------------------
+@functools.lru_cache(maxsize=8192)
+def _hash_file(path: str, mtime_ns: int, size: int) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(1024 * 1024):
+            digest.update(chunk)
+    return digest.hexdigest()[:32]
+
+
+def file_etag(path: Path) -> str:
+    """Strong ETag for a file: a hash of its bytes, memoized per (mtime, size)."""
+    st = path.stat()
+    return _hash_file(str(path), st.st_mtime_ns, st.st_size)
+
+
+# ---------------------------------------------------------------------------
+# Variants
+# ---------------------------------------------------------------------------
+def parse_params(w: str | None, fmt: str | None) -> tuple[int | None, str]:
+    """Validate query parameters; returns (snapped width or None, format)."""
+    fmt = (fmt or "webp").lower()
+    if fmt not in FORMATS:
+        raise VariantError(f"fmt must be one of {', '.join(FORMATS)}")
+    if w is None or w == "":
+        return None, fmt
+    try:
+        width = int(w)
+    except ValueError:
+        raise VariantError("w must be an integer") from None
+    if width <= 0:
+        raise VariantError("w must be positive")
+    return next((x for x in WIDTHS if x >= width), WIDTHS[-1]), fmt
+
+
+def _variant_prefix(filename: str) -> str:
+    return hashlib.sha256(filename.encode()).hexdigest()[:32]
+
+
+def variant_path(filename: str, width: int | None, fmt: str) -> Path:
+    return VARIANT_DIR / f"{_variant_prefix(filename)}.{f'w{width}' if width else 'full'}.{fmt}"
+
+
+def remove_variants(filename: str) -> int:
+    """Delete every variant of an output, e.g. when it is evicted. Returns the bytes freed."""
+    global _total_bytes
+    freed = 0
+    for p in VARIANT_DIR.glob(f"{_variant_prefix(filename)}.*"):
+        try:
+            size = p.stat().st_size
+            p.unlink()
+        except FileNotFoundError:
+            continue
+        freed += size
+    with _lock:
+        if _total_bytes is not None:
+            _total_bytes -= freed
+    return freed
+
+
+def _render(source: str, width: int | None, fmt: str, quality: int) -> bytes:
+    """Decode, downscale and encode one variant. Runs in a worker process."""
+    from PIL import Image
+
+    with Image.open(source) as img:
+        if width:
+            img.draft("RGB", (width, width * 4))  # JPEG: decode at reduced scale
+        img = img.convert("RGBA" if "A" in img.getbands() else "RGB")
+    if width and img.width > width:
+        img = img.resize((width, max(1, round(img.height * width / img.width))), Image.Resampling.LANCZOS)
+    buf = io.BytesIO()
+    img.save(buf, FORMATS[fmt][0], quality=quality)
+    return buf.getvalue()
+
+
+def get_variant(filename: str, source: Path, width: int | None, fmt: str) -> Path:
+    """Return the variant's path, building it (once, even under concurrent requests) if needed."""
+    path = variant_path(filename, width, fmt)
+    with _lock:
+        entry = _building.setdefault(path, [threading.Lock(), 0])
+        entry[1] += 1
+    try:
+        with entry[0]:
+            if is_fresh(path, source):
+                os.utime(path)  # mark as recently used for eviction
+                return path
+            with metrics.codec_seconds.time(op=f"variant_{fmt}"):
+                data = run_in_pool(_render, str(source), width, fmt, VARIANT_QUALITY)
+            write_atomic(path, data)
+    finally:
+        # the lock stays while anyone still holds or waits on it, so they all share one build
+        with _lock:
+            entry[1] -= 1
+            if not entry[1]:
+                del _building[path]
+    _account(len(data), path)
+    return path
+
+
+def _account(added: int, keep: Path):
+    global _total_bytes
+    with _lock:
+        if _total_bytes is None:
+            _total_bytes = sum(p.stat().st_size for p in VARIANT_DIR.iterdir() if p.is_file())
+        else:
+            _total_bytes += added
+        over = _total_bytes > VARIANT_MAX_BYTES
+    if over:
+        prune(keep=keep)
+
+
+def prune(max_bytes: int = VARIANT_MAX_BYTES, keep: Path | None = None) -> int:
+    """Delete least recently used variants until the cache fits. Returns files removed.
+
+    ``keep`` (the variant about to be served) is never evicted.
+    """
+    global _total_bytes
+    entries = []
+    for p in VARIANT_DIR.iterdir():
+        try:
+            st = p.stat()
+        except FileNotFoundError:
+            continue
+        if p.is_file() and not p.name.startswith(".") and p != keep:
+            entries.append((st.st_mtime, st.st_size, p))
+    entries.sort()
+    total = sum(size for _, size, _ in entries) + (keep.stat().st_size if keep else 0)
+    removed = 0
+    # evict down to 90% so we don't prune again on the very next variant
+    for _, size, p in entries:
+        if total <= max_bytes * 0.9:
+            break
+        p.unlink(missing_ok=True)
+        total -= size
+        removed += 1
+    with _lock:
+        _total_bytes = total
+    return removed
@@ -0,0 +1,155 @@
+"""
+Generator worker pool for production mode.
+
+In production mode (``IMAGE_GEN_MODE=production``) the web processes only
+accept, queue and report on jobs. Generation runs here instead: a supervisor
+starts N worker processes, each running T threads that claim jobs from the
+shared SQLite queue. Request handling and generation scale separately.
+
+The supervisor restarts workers that exit. Jobs a dead worker had claimed
+are failed, so their /status calls don't stay pending forever. SIGTERM or
+Ctrl-C stops claiming new jobs and lets in-flight ones finish. It also runs
+the gallery watcher and the disk budget (disk_budget.py), which must run
+once rather than in every web process.
+
+Usage:
+  # Generator processes (2 x 4 model calls in flight):
+  IMAGE_GEN_MODE=production python3 worker.py --processes 2 --threads 4
+
+  # Web processes, any number of them (pip install gunicorn):
+  IMAGE_GEN_MODE=production gunicorn -w 4 -k gthread --threads 16 -b 127.0.0.1:5000 app:app
+
+    IMAGE_GEN_WORKER_PROCESSES  worker processes          (default 2)
+    IMAGE_GEN_CONCURRENCY       threads per process       (default 4)
+    IMAGE_GEN_WORKER_POLL       idle poll interval, secs  (default 0.25)
+
+Each worker, the supervisor and each web process publish their metrics to
+the shared state directory; the web processes' /metrics includes them all
+(see metrics.py).
+"""
+
+import argparse
+import multiprocessing
+import os
+import signal
+import sys
+import threading
+import uuid
+from pathlib import Path
+
+from dotenv import load_dotenv
+
+from config import env_float, env_int
+from disk_budget import DiskBudget
+from gallery_index import GalleryIndex
+from genai_client import clients
+from job_runner import JobRunner
+from job_store import SharedJobStore
+import metrics
+from scheduler import CONCURRENCY
+from shared_queue import SharedQueue
+
+load_dotenv(Path(__file__).parent / ".env")
+
+PROCESSES = env_int("IMAGE_GEN_WORKER_PROCESSES", 2)
+POLL_INTERVAL = env_float("IMAGE_GEN_WORKER_POLL", 0.25)
+REAP_INTERVAL = 2.0
+
+
+def work(threads: int, poll: float = POLL_INTERVAL):
+    """Body of one worker process: ``threads`` loops claiming and running jobs."""
+    # Ctrl-C reaches the whole process group; let the supervisor decide
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+
+    queue = SharedQueue()
+    runner = JobRunner(SharedJobStore(), GalleryIndex())
+    # web /metrics merges these snapshots; a fresh id per process start keeps restarts from clobbering totals
+    worker_id = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+    metrics.start_publishing(worker_id)
+
+    def loop():
+        while not stop.is_set():
+            claimed = queue.claim()
+            if claimed is None:
+                stop.wait(poll)
+                continue
+            job_id, payload = claimed
+            try:
+                runner.run_leased(clients, job_id, **payload)
+            finally:
+                queue.finish(job_id)
+
+    pool = [threading.Thread(target=loop, name=f"gen-worker-{i}") for i in range(threads)]
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    metrics.publish(worker_id)
+
+
+def supervise(processes: int, threads: int):
+    queue = SharedQueue()
+    jobs = SharedJobStore()
+    # spawn: children must not inherit the supervisor's SQLite connections
+    ctx = multiprocessing.get_context("spawn")
+    stopping = threading.Event()
+
+    def on_signal(*_):
+        stopping.set()
+
+    signal.signal(signal.SIGINT, on_signal)
+    signal.signal(signal.SIGTERM, on_signal)
+
+    def start(i: int) -> multiprocessing.Process:
+        p = ctx.Process(target=work, args=(threads,), name=f"image-gen-worker-{i}", daemon=False)
+        p.start()
+        return p
+
+    index = GalleryIndex()
+    index.start_watcher()
+    DiskBudget(index).start()
+    supervisor_id = f"supervisor-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+    metrics.start_publishing(supervisor_id)
+
+    procs = [start(i) for i in range(processes)]
+    print(f"Started {processes} worker processes x {threads} threads (pids {', '.join(str(p.pid) for p in procs)})")
+
+    while not stopping.is_set():
+        for job_id in queue.reap():
+            jobs.fail_pending(job_id, "Generator worker exited mid-job")
+            print(f"Failed job {job_id}: its worker exited")
+        for i, p in enumerate(procs):
+            if not p.is_alive():
+                print(f"Worker {p.pid} exited with {p.exitcode}; restarting")
+                procs[i] = start(i)
+        stopping.wait(REAP_INTERVAL)
+
+    print("Stopping: finishing in-flight jobs...")
+    for p in procs:
+        if p.is_alive():
+            os.kill(p.pid, signal.SIGTERM)
+    for p in procs:
+        p.join()
+    for job_id in queue.reap():
+        jobs.fail_pending(job_id, "Generator worker exited mid-job")
+    metrics.publish(supervisor_id)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run generator worker processes for production mode")
+    parser.add_argument("--processes", type=int, default=PROCESSES, help=f"Worker processes (default: {PROCESSES})")
+    parser.add_argument("--threads", type=int, default=CONCURRENCY, help=f"Jobs in flight per process (default: {CONCURRENCY})")
+    args = parser.parse_args()
+
+    api_key = os.getenv("GOOGLE_API_KEY")
+    if clients.needs_api_key and (not api_key or api_key == "your-key-here"):
+        print("Set your GOOGLE_API_KEY in image_gen/.env")
+        sys.exit(1)
+
+    supervise(args.processes, args.threads)
+
+
+if __name__ == "__main__":
+    main()